@@ -3,6 +3,8 @@ from pytest_factoryboy import register
 from PIL import Image
 import io
 import asyncio
+import threading
+import time
 from channels.layers import get_channel_layer
 
 from django.test import RequestFactory
@@ -10,8 +12,10 @@ from django.contrib.auth.middleware import AuthenticationMiddleware
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.db import connection
 
 from core_apps.users.tests.factories import UserFactory
+from light_messages.redis_client import get_redis_client
 
 
 register(UserFactory)
@@ -133,6 +137,25 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Point every ``get_redis_client`` user at one in-memory fakeredis server
+    (with Lua support), so Redis-backed code runs its real scripts.
+    """
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis, "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    get_redis_client.cache_clear()
+    yield get_redis_client("redis://fake")
+    get_redis_client.cache_clear()
+
+
 @pytest.fixture(autouse=True)
 def use_test_settings(settings):
     """Force use of test settings"""
@@ -142,4 +165,53 @@ def use_test_settings(settings):
         }
     }
     settings.MESSAGE_CONSUMER_PING_INTERVAL = 5
-    settings.MESSAGE_CONSUMER_PONG_TIMEOUT = 2
\ No newline at end of file
+    settings.MESSAGE_CONSUMER_PONG_TIMEOUT = 2
+
+
+@pytest.fixture
+def wait_for_lock_wait():
+    """
+    Return a function that waits until another Postgres backend is blocked
+    on a lock.
+    """
+    def wait(timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with connection.cursor() as cursor:
+            while time.monotonic() < deadline:
+                cursor.execute(
+                    "SELECT EXISTS (SELECT FROM pg_locks WHERE NOT granted)"
+                )
+                if cursor.fetchone()[0]:
+                    return
+                time.sleep(0.01)
+        raise AssertionError("No backend is waiting for a lock")
+    return wait
+
+
+@pytest.fixture
+def run_in_thread():
+    """
+    Return a function that starts ``func`` in a thread with its own
+    database connection, and returns a ``join`` that re-raises its error.
+    """
+    def run(func):
+        errors = []
+
+        def target():
+            try:
+                func()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=target)
+        thread.start()
+
+        def join():
+            thread.join(10)
+            assert not thread.is_alive()
+            if errors:
+                raise errors[0]
+        return join
+    return run
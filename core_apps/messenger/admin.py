@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Message, Conversation
+from .models import Message, Conversation, InboxEntry, MessageArchive
 
 
 class MessageAdmin(admin.ModelAdmin):
@@ -16,6 +16,20 @@ class ConversationAdmin(admin.ModelAdmin):
     ordering = ('-last_message_timestamp',)
 
 
+class InboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'peer', 'conversation', 'last_activity', 'unread_count')
+    list_filter = ('owner',)
+    ordering = ('-last_activity',)
+
+
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ('conversation_id', 'first_timestamp', 'last_timestamp', 'message_count')
+    search_fields = ('conversation_id',)
+    exclude = ('payload',)
+    ordering = ('-last_timestamp',)
+
+
 admin.site.register(Message, MessageAdmin)
 admin.site.register(Conversation, ConversationAdmin)
-
+admin.site.register(InboxEntry, InboxEntryAdmin)
+admin.site.register(MessageArchive, MessageArchiveAdmin)
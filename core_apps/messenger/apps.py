@@ -7,3 +7,4 @@ class MessengerConfig(AppConfig):
 
     def ready(self):
         from . import signals  # Ensure signals are imported
+        from . import checks  # Register system checks
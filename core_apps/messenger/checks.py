@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError
+
+from .utils.snowflake import TICK_MS, TIMESTAMP_SHIFT
+
+# Smallest snowflake id issued a day after EPOCH; database sequences never
+# get near it, so anything above was issued by the generator.
+SNOWFLAKE_FLOOR = (24 * 3600 * 1000 // TICK_MS) << TIMESTAMP_SHIFT
+
+
+@checks.register(checks.Tags.database)
+def check_message_id_generator(app_configs, databases=None, **kwargs):
+    """
+    Refuse to run on database-sequence ids once snowflake ids exist: new
+    ids would sort below them and break the id-based read watermarks and
+    sync tokens.
+    """
+    if settings.MESSENGER_MESSAGE_ID_GENERATOR or not databases:
+        return []
+    from .models import Message
+
+    errors = []
+    for alias in databases:
+        try:
+            has_snowflakes = Message.objects.using(alias).filter(
+                id__gte=SNOWFLAKE_FLOOR,
+            ).exists()
+        except DatabaseError:
+            continue  # Table not migrated yet
+        if has_snowflakes:
+            errors.append(checks.Error(
+                "Messages with generated (snowflake) ids exist but "
+                "MESSENGER_MESSAGE_ID_GENERATOR is empty.",
+                hint=(
+                    "Keep MESSENGER_MESSAGE_ID_GENERATOR set; database "
+                    "sequence ids would sort below the existing ids."
+                ),
+                id="messenger.E001",
+            ))
+    return errors
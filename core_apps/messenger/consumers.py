@@ -7,6 +7,8 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
+from light_messages import fast_json
+
 User = get_user_model()
 logger = logging.getLogger("light_messages.websocket")
 
@@ -97,11 +99,15 @@ class MessageConsumer(AsyncWebsocketConsumer):
 
     async def new_message(self, event):
         # Send message to WebSocket
-        await self.send(text_data=json.dumps(event))
+        await self.send(text_data=fast_json.dumps(event).decode())
 
     async def read_message(self, event):
         # Send message to WebSocket
-        await self.send(text_data=json.dumps(event))
+        await self.send(text_data=fast_json.dumps(event).decode())
+
+    async def unread_count(self, event):
+        # Send the unread badge total to WebSocket
+        await self.send(text_data=fast_json.dumps(event).decode())
 
 
     async def keep_connection_alive(self):
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core_apps.messenger.models import Message, MessageArchive, Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than --older-than-days out of the hot messages "
+        "table into compressed MessageArchive batches"
+    )
+
+    def add_arguments(self, parser):
+        after_days = settings.MESSENGER_ARCHIVE_AFTER_DAYS
+        batch_size = settings.MESSENGER_ARCHIVE_BATCH_SIZE
+        parser.add_argument(
+            "--older-than-days", type=int, default=after_days,
+            help=f"Archive messages older than this (default: {after_days})"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=batch_size,
+            help=f"Messages per archive row (default: {batch_size})"
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=0.0,
+            help="Seconds to pause between batches (default: 0)"
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        batch_size = options["batch_size"]
+        archived = 0
+        conversations = Conversation.objects.values_list("conversation_id", flat=True)
+        for conversation_id in conversations.iterator():
+            while True:
+                count = self.archive_batch(conversation_id, cutoff, batch_size)
+                archived += count
+                if count < batch_size:
+                    break
+                time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived:,} messages"))
+
+    @transaction.atomic
+    def archive_batch(self, conversation_id, cutoff, batch_size):
+        """
+        Archive the oldest ``batch_size`` messages of a conversation sent
+        before ``cutoff``: one seek on conversation_timestamp_idx, one
+        archive row, one delete.
+        """
+        messages = list(
+            Message.objects
+            .filter(conversation_id=conversation_id, timestamp__lt=cutoff)
+            .order_by("timestamp", "id")[:batch_size]
+        )
+        if messages:
+            MessageArchive.from_messages(messages).save()
+            Message.objects.filter(id__in=[message.id for message in messages]).delete()
+        return len(messages)
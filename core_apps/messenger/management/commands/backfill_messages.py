@@ -0,0 +1,95 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from core_apps.messenger.models import Message, Conversation
+from core_apps.messenger.utils.conversations import get_conversation_key_or_none
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill conversation_key and number messages from before seqs, in short "
+        "batches so the tables keep taking writes (run after migrating)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1_000,
+            help="Rows updated per transaction (default: 1,000)"
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=0.0,
+            help="Seconds to pause between batches (default: 0)"
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.pause = options["sleep"]
+        self.backfill_conversation_key()
+        self.backfill_seq()
+
+    def backfill_conversation_key(self):
+        """
+        Derive ``conversation_key`` from ``conversation_id`` for rows written
+        before the column existed, walking the primary key in batches.  Rows
+        whose ids do not fit the key are skipped and stay null.
+        """
+        legacy = (
+            Message.objects.filter(conversation_key__isnull=True)
+            .order_by("id")
+            .only("id", "conversation_id")
+        )
+        last_id, filled = 0, 0
+        while True:
+            batch = list(legacy.filter(id__gt=last_id)[:self.batch_size])
+            if not batch:
+                break
+            for message in batch:
+                low, high = message.conversation_id.split("_")
+                message.conversation_key = get_conversation_key_or_none(low, high)
+            batch_keys = [m for m in batch if m.conversation_key is not None]
+            Message.objects.bulk_update(batch_keys, ["conversation_key"])
+            filled += len(batch_keys)
+            last_id = batch[-1].id
+            time.sleep(self.pause)
+        self.stdout.write(self.style.SUCCESS(f"Filled {filled:,} conversation keys"))
+
+    def backfill_seq(self):
+        """
+        Number each legacy conversation (``last_seq`` null) 1..n in
+        ``(timestamp, id)`` order.  Every batch locks the Conversation row,
+        so sends into it wait for the batch instead of racing it; they keep
+        writing null seqs until the final batch sets ``last_seq``, and are
+        numbered by the batches after them.
+        """
+        conversations = Conversation.objects.filter(last_seq__isnull=True)
+        numbered = 0
+        for conversation_id in conversations.values_list("id", flat=True).iterator():
+            while True:
+                done, count = self.number_batch(conversation_id)
+                numbered += count
+                if done:
+                    break
+                time.sleep(self.pause)
+        self.stdout.write(self.style.SUCCESS(f"Numbered {numbered:,} messages"))
+
+    @transaction.atomic
+    def number_batch(self, conversation_pk):
+        conv = Conversation.objects.select_for_update().get(pk=conversation_pk)
+        messages = Message.objects.filter(conversation_id=conv.conversation_id)
+        batch = list(
+            messages.filter(seq__isnull=True)
+            .order_by("timestamp", "id")
+            .only("id")[:self.batch_size]
+        )
+        last_seq = messages.aggregate(last_seq=Max("seq"))["last_seq"] or 0
+        for offset, message in enumerate(batch, start=1):
+            message.seq = last_seq + offset
+        Message.objects.bulk_update(batch, ["seq"])
+        if len(batch) < self.batch_size:
+            conv.last_seq = last_seq + len(batch)
+            conv.save(update_fields=["last_seq"])
+            return True, len(batch)
+        return False, len(batch)
@@ -0,0 +1,66 @@
+import timeit
+from collections import namedtuple
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core_apps.messenger.models import Message
+from core_apps.messenger.paginations import ConversationMessagesPagination
+from core_apps.messenger.serializers import (
+    MESSAGE_ROW_FIELDS,
+    MessageDetailSerializer,
+    message_row_serializer,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time MessageDetailSerializer against the message list fast path "
+        "(message_row_serializer) on one in-memory page; no database needed"
+    )
+
+    def add_arguments(self, parser):
+        page_size = ConversationMessagesPagination.max_page_size
+        parser.add_argument(
+            "--rows", type=int, default=page_size,
+            help=f"Messages per page (default: {page_size})"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=200,
+            help="Pages serialized per measurement (default: 200)"
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        messages = [
+            Message(
+                id=index, seq=index, sender_id=1 + index % 2, receiver_id=2 - index % 2,
+                message=f"Message number {index}", timestamp=now, read=False,
+            )
+            for index in range(1, options["rows"] + 1)
+        ]
+        Row = namedtuple("Row", MESSAGE_ROW_FIELDS)
+        rows = [
+            Row(*(getattr(message, field) for field in MESSAGE_ROW_FIELDS))
+            for message in messages
+        ]
+        watermarks = {1: options["rows"] // 2, 2: 0}
+
+        def serializer():
+            return MessageDetailSerializer(
+                messages, many=True, context={"read_watermarks": watermarks},
+            ).data
+
+        def fast_path():
+            to_representation = message_row_serializer(watermarks)
+            return [to_representation(row) for row in rows]
+
+        assert fast_path() == serializer()
+        repeat = options["repeat"]
+        for name, func in (("MessageDetailSerializer", serializer),
+                           ("message_row_serializer", fast_path)):
+            seconds = min(timeit.repeat(func, number=repeat, repeat=5)) / repeat
+            self.stdout.write(f"{name:<24} {seconds * 1000:8.3f} ms/page")
+            if name == "MessageDetailSerializer":
+                baseline = seconds
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {baseline / seconds:.1f}x"))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core_apps.messenger.models import Message
+
+
+INDEX_SIZES_SQL = {
+    # Partitioned indexes have no storage; count each partition's share
+    "postgresql": """
+        SELECT indexrelname, pg_relation_size(indexrelid)
+        FROM pg_stat_user_indexes
+        WHERE relid = %(table)s::regclass OR relid IN (
+            SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass
+        )
+        ORDER BY indexrelname
+    """,
+    # Needs SQLite built with SQLITE_ENABLE_DBSTAT_VTAB (the CPython default)
+    "sqlite": """
+        SELECT name, SUM(pgsize)
+        FROM dbstat
+        WHERE name IN (
+            SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %(table)s
+        )
+        GROUP BY name
+        ORDER BY name
+    """,
+}
+
+
+class Command(BaseCommand):
+    help = "Print the on-disk size of every index on a table (default: messages)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--table", default=Message._meta.db_table,
+            help=f"Table to inspect (default: {Message._meta.db_table})"
+        )
+
+    def handle(self, *args, **options):
+        table = options["table"]
+        sql = INDEX_SIZES_SQL.get(connection.vendor)
+        if sql is None:
+            raise CommandError(f"Index sizes are not supported on {connection.vendor}")
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {"table": table})
+            rows = cursor.fetchall()
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+            row_count = cursor.fetchone()[0]
+
+        self.stdout.write(f"{table}: {row_count:,} rows")
+        for name, size in rows:
+            per_row = size / row_count if row_count else 0
+            self.stdout.write(
+                f"  {name:<40} {size / 1024 / 1024:>10.2f} MiB  {per_row:>6.1f} B/row"
+            )
+        total = sum(size for _, size in rows)
+        self.stdout.write(f"  {'total':<40} {total / 1024 / 1024:>10.2f} MiB")
@@ -0,0 +1,66 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core_apps.messenger.models import Message
+from core_apps.messenger.utils.partitions import (
+    detach_partition,
+    ensure_partitions,
+    is_partitioned,
+    list_partitions,
+)
+
+
+def parse_month(value):
+    try:
+        return datetime.strptime(value, "%Y-%m").replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        raise CommandError(f"Expected a month as YYYY-MM, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly messenger_message partitions and detach old "
+        "ones (Postgres); run daily"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead", type=int, default=settings.MESSENGER_MESSAGE_PARTITIONS_AHEAD,
+            help="Months to keep ready beyond the current one "
+                 f"(default: {settings.MESSENGER_MESSAGE_PARTITIONS_AHEAD})"
+        )
+        parser.add_argument(
+            "--detach-before",
+            help="Detach partitions that only hold messages before this month (YYYY-MM)"
+        )
+        parser.add_argument(
+            "--drop", action="store_true",
+            help="Drop detached partitions instead of keeping them for archiving"
+        )
+
+    def handle(self, *args, **options):
+        table = Message._meta.db_table
+        if connection.vendor != "postgresql" or not is_partitioned(connection, table):
+            raise CommandError(f"{table} is not a partitioned Postgres table")
+
+        created = ensure_partitions(connection, table, timezone.now(), options["ahead"])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+
+        if options["detach_before"]:
+            before = parse_month(options["detach_before"])
+            # Never detach the partition taking today's messages
+            before = min(before, timezone.now())
+            for name, _, upper in list_partitions(connection, table):
+                if upper <= before:
+                    detach_partition(connection, table, name, drop=options["drop"])
+                    action = "Dropped" if options["drop"] else "Detached"
+                    self.stdout.write(f"{action} {name}")
+
+        for name, lower, upper in list_partitions(connection, table):
+            lower = f"{lower:%Y-%m-%d}" if lower else "MINVALUE"
+            self.stdout.write(f"  {name:<40} {lower:>10} .. {upper:%Y-%m-%d}")
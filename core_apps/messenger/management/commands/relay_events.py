@@ -0,0 +1,91 @@
+import os
+import socket
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core_apps.messenger.utils import outbox
+from core_apps.messenger.utils.breaker import get_breaker
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish WebSocket events from the outbox to the channel layer, "
+        "oldest first, until stopped"
+    )
+
+    def add_arguments(self, parser):
+        batch_size = settings.OUTBOX_RELAY_BATCH_SIZE
+        poll_interval = settings.OUTBOX_RELAY_POLL_INTERVAL
+        parser.add_argument(
+            "--batch-size", type=int, default=batch_size,
+            help=f"Events published per transaction (default: {batch_size})"
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=poll_interval,
+            help=f"Seconds to wait once the outbox is empty (default: {poll_interval})"
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Exit once the outbox is drained or a batch publishes nothing"
+        )
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        breaker = get_breaker()
+        batch_size = options["batch_size"]
+        name = os.getenv("POD_NAME") or f"{socket.gethostname()}:{os.getpid()}"
+        stats_at = 0.0
+        heartbeat_at, heartbeat_state = 0.0, None
+        while True:
+            published, failed, lag = outbox.relay_batch(
+                channel_layer, batch_size, breaker,
+            )
+            # Refresh the heartbeat well within its TTL, and at once when
+            # the breaker changes state
+            state = breaker.get_stats()["state"]
+            heartbeat_interval = settings.OUTBOX_RELAY_HEARTBEAT_TTL / 3
+            if (
+                state != heartbeat_state
+                or time.monotonic() - heartbeat_at >= heartbeat_interval
+            ):
+                heartbeat_at, heartbeat_state = time.monotonic(), state
+                try:
+                    outbox.write_heartbeat(name, breaker)
+                except Exception as e:
+                    outbox.logger.warning(
+                        "outbox_relay_heartbeat_error",
+                        extra={
+                            "event": "outbox_relay_heartbeat_error",
+                            "error": str(e),
+                        },
+                    )
+            if published or failed:
+                outbox.logger.info(
+                    "outbox_relay_batch",
+                    extra={
+                        "event": "outbox_relay_batch",
+                        "published": published,
+                        "failed": failed,
+                        "lag_seconds": round(lag, 3),
+                    },
+                )
+            if time.monotonic() - stats_at >= settings.OUTBOX_RELAY_STATS_INTERVAL:
+                stats_at = time.monotonic()
+                outbox.logger.info(
+                    "outbox_relay_stats",
+                    extra={
+                        "event": "outbox_relay_stats",
+                        **outbox.get_stats(),
+                        "breaker": breaker.get_stats()["state"],
+                    },
+                )
+            # Wait for new events, or back off while the channel layer
+            # rejects everything or the breaker is open
+            idle = not published or published + failed < batch_size
+            if idle and options["once"]:
+                break
+            if idle:
+                time.sleep(max(options["poll_interval"], breaker.retry_in()))
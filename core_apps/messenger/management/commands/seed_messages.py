@@ -3,11 +3,15 @@ import random
 
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.db.models import Max
 
 from faker import Faker
 
-from core_apps.messenger.models import Message, Conversation
-from core_apps.messenger.utils.conversations import get_conversation_id
+from core_apps.messenger.models import Message, Conversation, InboxEntry
+from core_apps.messenger.utils.conversations import (
+    get_conversation_id,
+    get_conversation_key_or_none,
+)
 
 User = get_user_model()
 fake = Faker()
@@ -53,6 +57,11 @@ class Command(BaseCommand):
             return
 
         conversation_id = get_conversation_id(sender_id, receiver_id)
+        conversation_key = get_conversation_key_or_none(sender_id, receiver_id)
+        # Continue the conversation's sequence after any existing messages
+        seq = Message.objects.filter(
+            conversation_id=conversation_id,
+        ).aggregate(last_seq=Max("seq"))["last_seq"] or 0
         p1_id = min(sender_id, receiver_id)
         p2_id = max(sender_id, receiver_id)
         users = [sender, receiver]
@@ -71,12 +80,15 @@ class Command(BaseCommand):
 
             for _ in range(current_batch):
                 s, r = random.sample(users, 2)
+                seq += 1
                 messages.append(Message(
                     sender=s,
                     receiver=r,
                     message=fake.sentence(nb_words=random.randint(3, 25)),
                     read=random.random() > unread_ratio,
                     conversation_id=conversation_id,
+                    conversation_key=conversation_key,
+                    seq=seq,
                 ))
 
             Message.objects.bulk_create(messages, ignore_conflicts=False)
@@ -91,7 +103,7 @@ class Command(BaseCommand):
             )
 
         # Build accurate Conversation row from the final DB state
-        self._sync_conversation(conversation_id, p1_id, p2_id)
+        self._sync_conversation(conversation_id, p1_id, p2_id, seq)
 
         elapsed = time.time() - start
         self.stdout.write(self.style.SUCCESS(
@@ -100,7 +112,7 @@ class Command(BaseCommand):
         ))
 
     @staticmethod
-    def _sync_conversation(conversation_id, p1_id, p2_id):
+    def _sync_conversation(conversation_id, p1_id, p2_id, last_seq):
         """Create or update the Conversation row to match the seeded messages."""
         last_msg = (
             Message.objects
@@ -118,7 +130,7 @@ class Command(BaseCommand):
             conversation_id=conversation_id, receiver_id=p2_id, read=False,
         ).count()
 
-        Conversation.objects.update_or_create(
+        conversation, _ = Conversation.objects.update_or_create(
             conversation_id=conversation_id,
             defaults={
                 "participant_1_id": p1_id,
@@ -128,5 +140,7 @@ class Command(BaseCommand):
                 "last_message_timestamp": last_msg.timestamp,
                 "unread_count_p1": unread_p1,
                 "unread_count_p2": unread_p2,
+                "last_seq": last_seq,
             },
         )
+        InboxEntry.sync_from_conversation(conversation)
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_inbox(apps, schema_editor):
+    """Create both participants' inbox entries for existing conversations."""
+    Conversation = apps.get_model("messenger", "Conversation")
+    InboxEntry = apps.get_model("messenger", "InboxEntry")
+    batch = []
+    for conv in Conversation.objects.iterator(chunk_size=2000):
+        batch.append(InboxEntry(
+            owner_id=conv.participant_1_id, peer_id=conv.participant_2_id,
+            conversation_id=conv.id, unread_count=conv.unread_count_p1,
+            last_activity=conv.last_message_timestamp,
+        ))
+        batch.append(InboxEntry(
+            owner_id=conv.participant_2_id, peer_id=conv.participant_1_id,
+            conversation_id=conv.id, unread_count=conv.unread_count_p2,
+            last_activity=conv.last_message_timestamp,
+        ))
+        if len(batch) >= 2000:
+            InboxEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        InboxEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0002_conversation_read_watermarks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(null=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='messenger.conversation')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inbox Entry',
+                'verbose_name_plural': 'Inbox Entries',
+                'indexes': [models.Index(fields=['owner', '-last_activity'], name='inbox_owner_latest_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'conversation'), name='inbox_owner_conversation_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core_apps.messenger.utils.migrations import (
+    AddIndexConcurrently,
+    RemoveIndexConcurrently,
+)
+
+
+class Migration(migrations.Migration):
+    # Build the (…, -id) indexes next to the old ones, then swap them in by
+    # name, so the hot tables are never without their list index.
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0003_inboxentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='inboxentry',
+            index=models.Index(fields=['owner', '-last_activity', '-id'], name='inbox_owner_latest_id_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='inboxentry',
+            name='inbox_owner_latest_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='inboxentry',
+            new_name='inbox_owner_latest_idx',
+            old_name='inbox_owner_latest_id_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['conversation_id', '-timestamp', '-id'], name='conversation_ts_id_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='message',
+            name='conversation_timestamp_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='message',
+            new_name='conversation_timestamp_idx',
+            old_name='conversation_ts_id_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:50
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+from core_apps.messenger.utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0004_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        AddIndexConcurrently(
+            model_name='inboxentry',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='inbox_owner_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'id'], name='message_receiver_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['sender', 'id'], name='message_sender_id_idx'),
+        ),
+    ]
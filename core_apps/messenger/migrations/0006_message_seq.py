@@ -0,0 +1,40 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core_apps.messenger.utils.migrations import AddUniqueConstraintConcurrently
+
+
+class Migration(migrations.Migration):
+    # Existing conversations and messages keep a null last_seq / seq; the
+    # ``backfill_messages`` command numbers them in batches after deploy.
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0005_sync_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        # Only new rows get 0 (the model default); no table rewrite
+        migrations.AlterField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.BigIntegerField(blank=True, default=0, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation_id', 'seq'), name='message_conversation_seq_uniq'),
+        ),
+    ]
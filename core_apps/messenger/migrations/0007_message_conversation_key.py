@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-17 23:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core_apps.messenger.utils.migrations import (
+    AddIndexConcurrently,
+    AddUniqueConstraintConcurrently,
+)
+
+
+class Migration(migrations.Migration):
+    # Existing rows are filled by the ``backfill_messages`` command after
+    # deploy; the indexes are built without blocking writes.
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0006_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation_key',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['conversation_key', '-timestamp', '-id'], name='conversation_key_timestamp_idx'),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation_key', 'seq'), name='message_conversation_key_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from core_apps.messenger.utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Postgres cannot enforce these unique constraints or the foreign key
+    # into messenger_message once it is partitioned (0010)
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0008_message_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Gap fills keep an index while the unique constraints go away
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['conversation_id', 'seq'], name='message_conversation_seq_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['conversation_key', 'seq'], name='message_conv_key_seq_idx'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='message',
+            name='message_conversation_seq_uniq',
+        ),
+        migrations.RemoveConstraint(
+            model_name='message',
+            name='message_conversation_key_seq_uniq',
+        ),
+        migrations.AlterField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messenger.message'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:45
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+from core_apps.messenger.utils.partitions import (
+    add_months,
+    convert_to_partitioned,
+    ensure_partitions,
+    is_partitioned,
+    month_start,
+)
+
+
+def partition_messages(apps, schema_editor):
+    """
+    Postgres only: partition messenger_message by month on timestamp.
+    Existing rows stay where they are, as the legacy partition; it also
+    takes new rows until the month after next, leaving time for the swap.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    table = apps.get_model("messenger", "Message")._meta.db_table
+    now = timezone.now()
+    if not is_partitioned(connection, table):
+        convert_to_partitioned(
+            connection, table, "timestamp", add_months(month_start(now), 2),
+        )
+    ensure_partitions(connection, table, now, settings.MESSENGER_MESSAGE_PARTITIONS_AHEAD)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('messenger', '0009_partition_prep'),
+    ]
+
+    operations = [
+        # Irreversible: undoing it means copying every row back
+        migrations.RunPython(partition_messages),
+    ]
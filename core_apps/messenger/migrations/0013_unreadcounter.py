@@ -0,0 +1,49 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_unread_counters(apps, schema_editor):
+    """Sum each user's inbox unread counts into their counter."""
+    InboxEntry = apps.get_model("messenger", "InboxEntry")
+    UnreadCounter = apps.get_model("messenger", "UnreadCounter")
+    totals = (
+        InboxEntry.objects.filter(unread_count__gt=0)
+        .values("owner_id")
+        .annotate(total=Sum("unread_count"))
+        .order_by()
+    )
+    batch = []
+    for row in totals.iterator(chunk_size=2000):
+        batch.append(UnreadCounter(user_id=row["owner_id"], total=row["total"]))
+        if len(batch) >= 2000:
+            UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0012_message_search'),
+        ('users', '0003_user_search_trigram_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Unread Counter',
+                'verbose_name_plural': 'Unread Counters',
+            },
+        ),
+        migrations.RunPython(backfill_unread_counters, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,29 @@
-from django.db import models
-from django.db.models import F
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db import connection, models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Cast, Greatest, Upper
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 
-from .utils.conversations import get_conversation_id
+from .utils import conversation_cache
+from .utils.archive import pack_messages, unpack_messages
+from .utils.conversations import get_conversation_id, get_conversation_key_or_none
+from .utils.snowflake import get_message_id_generator
 
 User = get_user_model()
 
+# Text search configuration of message_search_idx; queries must use the
+# same one for the index to apply.  "simple" does no stemming, so it works
+# for any language.
+SEARCH_CONFIG = "simple"
+# Search ranks are rounded so they survive a round trip through a cursor
+SEARCH_RANK_FIELD = models.DecimalField(max_digits=12, decimal_places=6)
+
 
 class Conversation(models.Model):
     """
@@ -21,14 +38,26 @@ class Conversation(models.Model):
     participant_2 = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="conversations_as_p2",
     )
+    # No database constraint: Postgres cannot reference a partitioned
+    # table by ``id`` alone (its primary key is ``(id, timestamp)``)
     last_message = models.ForeignKey(
         "Message", on_delete=models.SET_NULL, null=True, related_name="+",
+        db_constraint=False,
     )
     last_message_text = models.CharField(max_length=2048, default="")
     last_message_timestamp = models.DateTimeField(null=True, db_index=True)
     # unread_count for participant_1 / participant_2 respectively
     unread_count_p1 = models.PositiveIntegerField(default=0)
     unread_count_p2 = models.PositiveIntegerField(default=0)
+    # Read watermark for participant_1 / participant_2 respectively: every
+    # message they received with id <= last_read_message_id_pX is read.
+    last_read_message_id_p1 = models.BigIntegerField(null=True, blank=True)
+    last_read_message_id_p2 = models.BigIntegerField(null=True, blank=True)
+    last_read_at_p1 = models.DateTimeField(null=True, blank=True)
+    last_read_at_p2 = models.DateTimeField(null=True, blank=True)
+    # Highest Message.seq handed out in this conversation; null on
+    # conversations from before seq until ``backfill_messages`` numbers them
+    last_seq = models.BigIntegerField(null=True, blank=True, default=0)
 
     class Meta:
         verbose_name = _("Conversation")
@@ -62,10 +91,239 @@ class Conversation(models.Model):
             return self.unread_count_p1
         return self.unread_count_p2
 
+    def get_last_read_message_id(self, user_id):
+        if self.participant_1_id == user_id:
+            return self.last_read_message_id_p1
+        return self.last_read_message_id_p2
+
+    def get_read_watermarks(self):
+        """Return {receiver_id: last_read_message_id} for both participants."""
+        return {
+            self.participant_1_id: self.last_read_message_id_p1 or 0,
+            self.participant_2_id: self.last_read_message_id_p2 or 0,
+        }
+
     def __str__(self):
         return self.conversation_id
 
 
+class InboxEntry(models.Model):
+    """
+    Fan-out-on-write inbox: one row per (owner, conversation), maintained
+    alongside Conversation so the conversation list is a single range scan
+    on ``(owner, -last_activity)`` instead of an OR across participants.
+    """
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="inbox_entries",
+    )
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="inbox_entries",
+    )
+    peer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+",
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True)
+    # Bumped on every change either participant should sync (new message,
+    # either side reading); drives the delta sync endpoint.
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("Inbox Entry")
+        verbose_name_plural = _("Inbox Entries")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "conversation"],
+                name="inbox_owner_conversation_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "-last_activity", "-id"],
+                name="inbox_owner_latest_idx",
+            ),
+            models.Index(
+                fields=["owner", "updated_at", "id"],
+                name="inbox_owner_updated_idx",
+            ),
+        ]
+
+    @classmethod
+    def record_message(cls, conversation, message, unread_increment=1):
+        """Bump both participants' entries for a new message (portable path)."""
+        entries = (
+            (message.sender_id, message.receiver_id, 0),
+            (message.receiver_id, message.sender_id, unread_increment),
+        )
+        for owner_id, peer_id, increment in entries:
+            updated = cls.objects.filter(
+                owner_id=owner_id, conversation=conversation,
+            ).update(
+                unread_count=F("unread_count") + increment,
+                last_activity=message.timestamp,
+                updated_at=message.timestamp,
+            )
+            if not updated:
+                cls.objects.create(
+                    owner_id=owner_id,
+                    conversation=conversation,
+                    peer_id=peer_id,
+                    unread_count=increment,
+                    last_activity=message.timestamp,
+                    updated_at=message.timestamp,
+                )
+
+    @classmethod
+    def sync_from_conversation(cls, conversation):
+        """Rebuild both entries from a Conversation row (seeding / repair)."""
+        participants = (
+            (conversation.participant_1_id, conversation.participant_2_id,
+             conversation.unread_count_p1),
+            (conversation.participant_2_id, conversation.participant_1_id,
+             conversation.unread_count_p2),
+        )
+        for owner_id, peer_id, unread_count in participants:
+            cls.objects.update_or_create(
+                owner_id=owner_id,
+                conversation=conversation,
+                defaults={
+                    "peer_id": peer_id,
+                    "unread_count": unread_count,
+                    "last_activity": conversation.last_message_timestamp,
+                    "updated_at": timezone.now(),
+                },
+            )
+            UnreadCounter.recount(owner_id)
+
+    def __str__(self):
+        return f"{self.owner_id}:{self.conversation_id}"
+
+
+class UnreadCounter(models.Model):
+    """
+    A user's unread messages across all conversations (the sum of their
+    InboxEntry.unread_count), kept in step with the per-conversation
+    counters so the unread badge is a single primary key read.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name="unread_counter",
+    )
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Unread Counter")
+        verbose_name_plural = _("Unread Counters")
+
+    @classmethod
+    def get_total(cls, user_id):
+        return (
+            cls.objects.filter(user_id=user_id)
+            .values_list("total", flat=True)
+            .first()
+        ) or 0
+
+    @classmethod
+    def lock(cls, *user_ids):
+        """
+        Create the counters of ``user_ids`` if missing and lock them in
+        ``user_id`` order (portable path).  A transaction that adds to one
+        user's total and subtracts from another's takes both here first, so
+        concurrent replies in a ring (A to B, B to C, C to A) cannot deadlock.
+        """
+        user_ids = sorted(set(user_ids))
+        cls.objects.bulk_create(
+            [cls(user_id=user_id) for user_id in user_ids], ignore_conflicts=True,
+        )
+        list(
+            cls.objects.select_for_update()
+            .filter(user_id__in=user_ids)
+            .order_by("user_id")
+            .values_list("pk", flat=True)
+        )
+
+    @classmethod
+    def add(cls, user_id, increment):
+        """Add ``increment`` unread messages (portable path); return the total."""
+        counter, created = cls.objects.select_for_update().get_or_create(
+            user_id=user_id, defaults={"total": increment},
+        )
+        if not created:
+            counter.total += increment
+            counter.save(update_fields=["total"])
+        return counter.total
+
+    @classmethod
+    def subtract(cls, user_id, decrement):
+        """Remove ``decrement`` unread messages, never below zero; return the total."""
+        cls.objects.filter(user_id=user_id).update(
+            total=Greatest(F("total") - decrement, 0),
+        )
+        return cls.get_total(user_id)
+
+    @classmethod
+    def recount(cls, user_id):
+        """Rebuild a user's total from their inbox entries (seeding / repair)."""
+        total = (
+            InboxEntry.objects.filter(owner_id=user_id)
+            .aggregate(total=Sum("unread_count"))["total"]
+        ) or 0
+        cls.objects.update_or_create(user_id=user_id, defaults={"total": total})
+        return total
+
+    def __str__(self):
+        return f"{self.user_id}:{self.total}"
+
+
+class MessageQuerySet(models.QuerySet):
+
+    def for_conversation(self, user_a_id, user_b_id):
+        """
+        Messages between two users.  Filters on the packed integer key once
+        ``MESSENGER_READ_CONVERSATION_KEY`` is on (after the backfill), and
+        on the legacy string id until then, and for ids too large to pack.
+        """
+        if settings.MESSENGER_READ_CONVERSATION_KEY:
+            conversation_key = get_conversation_key_or_none(user_a_id, user_b_id)
+            if conversation_key is not None:
+                return self.filter(conversation_key=conversation_key)
+        return self.filter(conversation_id=get_conversation_id(user_a_id, user_b_id))
+
+    def for_user(self, user_id):
+        """
+        Messages the user sent or received: two index range scans,
+        message_sender_id_idx and message_receiver_id_idx.
+        """
+        return self.filter(models.Q(sender_id=user_id) | models.Q(receiver_id=user_id))
+
+    def search(self, text):
+        """
+        Full-text match of ``text`` (web search syntax) on
+        message_search_idx, annotated with its ``rank``.  Postgres only.
+        """
+        query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            self.annotate(search=SearchVector("message", config=SEARCH_CONFIG))
+            .filter(search=query)
+            .annotate(rank=Cast(SearchRank(F("search"), query), SEARCH_RANK_FIELD))
+        )
+
+    def search_substring(self, text):
+        """
+        Case-insensitive substring match of ``text``, for terms too short
+        or too partial for full-text search.  On Postgres it runs on
+        message_trigram_idx and ``rank`` is the trigram word similarity;
+        elsewhere every match ranks the same.
+        """
+        if connection.vendor == "postgresql":
+            rank = TrigramWordSimilarity(text, "message")
+        else:
+            rank = models.Value(0)
+        return self.filter(message__icontains=text).annotate(
+            rank=Cast(rank, SEARCH_RANK_FIELD),
+        )
+
+
 class Message(models.Model):
     sender = models.ForeignKey(
         User,
@@ -78,9 +336,26 @@ class Message(models.Model):
         related_name="received_messages",
     )
     message = models.CharField(max_length=2048)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set on construction (not at INSERT) so the Conversation upsert can
+    # run before the message row is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Legacy per-row flag; read state is derived from the receiver's
+    # watermark on Conversation (see Conversation.get_read_watermarks).
     read = models.BooleanField(default=False)
     conversation_id = models.CharField(max_length=255)
+    # Packed (min_id << 32 | max_id) replacement for conversation_id; written
+    # alongside it, null on rows the backfill has not reached yet and for
+    # user ids past 31 bits.
+    conversation_key = models.BigIntegerField(null=True, blank=True)
+    # Gapless per-conversation sequence, assigned by the Conversation upsert
+    seq = models.BigIntegerField(null=True, blank=True)
+
+    objects = MessageQuerySet.as_manager()
+
+    # The receiver's UnreadCounter total right after sending; set by _send
+    total_unread = None
+    # ``read`` from Message.send when it left the read marking to the caller
+    READ_DEFERRED = "deferred"
 
     class Meta:
         verbose_name = _("Message")
@@ -96,55 +371,630 @@ class Message(models.Model):
         ]
 
         indexes = [
-            # Primary index for fetching messages in a conversation
+            # Primary index for fetching messages in a conversation; the id
+            # tie-break matches the (timestamp, id) keyset cursor.
             models.Index(
-                fields=["conversation_id", "-timestamp"],
+                fields=["conversation_id", "-timestamp", "-id"],
                 name="conversation_timestamp_idx"
             ),
+            # Same, on the fixed-width key (MESSENGER_READ_CONVERSATION_KEY)
+            models.Index(
+                fields=["conversation_key", "-timestamp", "-id"],
+                name="conversation_key_timestamp_idx"
+            ),
+            # Delta sync: a user's incoming / outgoing messages after an id
+            models.Index(
+                fields=["receiver", "id"],
+                name="message_receiver_id_idx"
+            ),
+            models.Index(
+                fields=["sender", "id"],
+                name="message_sender_id_idx"
+            ),
+            # Gap fills: WHERE conversation_id = ? AND seq BETWEEN ? AND ?.
+            # Not unique: a partitioned table can only enforce uniqueness
+            # together with timestamp.  The Conversation row lock already
+            # hands out each seq once.
+            models.Index(
+                fields=["conversation_id", "seq"],
+                name="message_conversation_seq_idx"
+            ),
+            models.Index(
+                fields=["conversation_key", "seq"],
+                name="message_conv_key_seq_idx"
+            ),
+            # Message search (Postgres only): full-text on the tsvector of
+            # the text, and trigrams for ILIKE '%term%' fallbacks
+            GinIndex(
+                SearchVector("message", config=SEARCH_CONFIG),
+                name="message_search_idx"
+            ),
+            GinIndex(
+                OpClass(Upper("message"), name="gin_trgm_ops"),
+                name="message_trigram_idx"
+            ),
         ]
 
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        if is_new:
-            self.conversation_id = get_conversation_id(self.sender_id, self.receiver_id)
-        super().save(*args, **kwargs)
-        if is_new:
-            self._update_conversation()
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        generate_id = get_message_id_generator()
+        if generate_id is not None and self.pk is None:
+            self.pk = generate_id()
+        # The pk may be set before the INSERT (generator, or reserved by the
+        # Postgres upsert); skip the UPDATE Django would try first
+        kwargs["force_insert"] = True
+        self.conversation_id = get_conversation_id(self.sender_id, self.receiver_id)
+        self.conversation_key = get_conversation_key_or_none(
+            self.sender_id, self.receiver_id,
+        )
+        with transaction.atomic():
+            self._send([self], lambda: super(Message, self).save(*args, **kwargs))
+
+    @classmethod
+    def bulk_send(cls, sender_id, receiver_id, texts):
+        """
+        Insert a batch of messages with one ``bulk_create`` and update the
+        Conversation row once for the whole batch.  ``post_save`` is not
+        fired; callers emit ``messages_created`` instead.
+        """
+        conversation_id = get_conversation_id(sender_id, receiver_id)
+        conversation_key = get_conversation_key_or_none(sender_id, receiver_id)
+        generate_id = get_message_id_generator()
+        messages = [
+            cls(
+                id=generate_id() if generate_id else None,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                message=text,
+                conversation_id=conversation_id,
+                conversation_key=conversation_key,
+            )
+            for text in texts
+        ]
+        with transaction.atomic():
+            messages[-1]._send(messages, lambda: cls.objects.bulk_create(messages))
+        return messages
+
+    @classmethod
+    def send(cls, sender_id, receiver_id, texts):
+        """
+        Postgres only: send a batch of messages and mark everything the
+        receiver sent so far as read by the sender, in one statement.
 
-    def _update_conversation(self):
-        """Atomically upsert the Conversation row after a new message."""
-        from django.db import transaction
+        The statement checks the receiver exists, inserts the messages,
+        upserts the Conversation row, both InboxEntry rows and the
+        receiver's UnreadCounter, and clears the sender's unread count,
+        watermark and UnreadCounter share, like ``emit_read_signal``.  It
+        also writes the events the ``messages_created`` and
+        ``messages_read`` receivers would to the outbox, so callers must not
+        send those signals, unless ``EVENT_DISPATCH`` is ``"queue"``: then
+        nothing is written and the caller sends both.  ``post_save`` is not
+        fired either way.
 
+        Returns ``(messages, read)``.  ``messages`` is None when the
+        receiver does not exist.  ``read`` is None, or
+        ``(last_read_message_id, sender's total_unread)`` when unreads
+        were cleared, or ``READ_DEFERRED`` when the Conversation row
+        changed between the statement's snapshot and its lock: the newest
+        message it can see may not be the receiver's newest, so nothing
+        was marked read and the caller must do it in a new statement.
+        """
+        conversation_id = get_conversation_id(sender_id, receiver_id)
+        conversation_key = get_conversation_key_or_none(sender_id, receiver_id)
+        generate_id = get_message_id_generator()
+        messages = [
+            cls(
+                id=generate_id() if generate_id else None,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                message=text,
+                conversation_id=conversation_id,
+                conversation_key=conversation_key,
+            )
+            for text in texts
+        ]
+        newest = messages[-1]
+        p1_id, p2_id = min(sender_id, receiver_id), max(sender_id, receiver_id)
+        receiver_suffix, sender_suffix = (
+            ("p1", "p2") if receiver_id == p1_id else ("p2", "p1")
+        )
+        unread_increment = len(messages)
+
+        quote = connection.ops.quote_name
+        table = quote(Conversation._meta.db_table)
+        inbox_table = quote(InboxEntry._meta.db_table)
+        counter_table = quote(UnreadCounter._meta.db_table)
+        message_table = quote(cls._meta.db_table)
+        outbox_table = quote(OutboxEvent._meta.db_table)
+        user_table = quote(User._meta.db_table)
+        receiver_unread = quote(f"unread_count_{receiver_suffix}")
+        sender_unread = quote(f"unread_count_{sender_suffix}")
+        sender_watermark = quote(f"last_read_message_id_{sender_suffix}")
+        sender_read_at = quote(f"last_read_at_{sender_suffix}")
+        # ``locked`` locks the Conversation row first, so the sender's
+        # unread count it reads is the one the upsert resets.  Under READ
+        # COMMITTED a concurrent send can commit while it waits: the row is
+        # then re-read at its new version (new xmin), but ``newest`` still
+        # comes from the old snapshot, so ``cleared`` keeps the row only
+        # when its version is the snapshot's.  Both
+        # UnreadCounter rows are then locked in user_id order
+        # (``counter_lock``, which ``counter`` and ``sender_counter`` wait
+        # for), as ``UnreadCounter.lock`` does on the portable path.
+        sql = f"""
+            WITH batch AS MATERIALIZED (
+                SELECT given.*, COALESCE(
+                    given.given_id, nextval(pg_get_serial_sequence(%s, 'id'))
+                ) AS id
+                FROM unnest(
+                    %s::bigint[], %s::varchar[], %s::timestamptz[], %s::text[]
+                ) WITH ORDINALITY AS given (given_id, message, timestamp, sent_at, n)
+            ),
+            locked AS MATERIALIZED (
+                SELECT {table}.{sender_unread} AS unread_count, newest.id,
+                    {table}.xmin = (
+                        SELECT xmin FROM {table} WHERE conversation_id = %s
+                    ) AS current
+                FROM {table}
+                CROSS JOIN LATERAL (
+                    SELECT id FROM {message_table}
+                    WHERE conversation_id = %s AND sender_id = %s
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT 1
+                ) AS newest
+                WHERE {table}.conversation_id = %s
+                    AND {table}.{sender_unread} > 0
+                    AND (
+                        {table}.{sender_watermark} IS NULL
+                        OR {table}.{sender_watermark} < newest.id
+                    )
+                FOR UPDATE OF {table}
+            ),
+            cleared AS MATERIALIZED (
+                SELECT unread_count, id FROM locked WHERE current
+            ),
+            conv AS (
+                INSERT INTO {table} (
+                    conversation_id, participant_1_id, participant_2_id,
+                    last_message_id, last_message_text, last_message_timestamp,
+                    unread_count_p1, unread_count_p2, last_seq
+                )
+                SELECT
+                    %s, %s, %s, (SELECT id FROM batch WHERE n = %s),
+                    %s, %s, %s, %s, %s
+                FROM {user_table} WHERE id = %s
+                ON CONFLICT (conversation_id) DO UPDATE SET
+                    last_message_id = EXCLUDED.last_message_id,
+                    last_message_text = EXCLUDED.last_message_text,
+                    last_message_timestamp = EXCLUDED.last_message_timestamp,
+                    {receiver_unread} = {table}.{receiver_unread} + %s,
+                    last_seq = {table}.last_seq + EXCLUDED.last_seq,
+                    {sender_unread} = CASE WHEN EXISTS (SELECT FROM cleared)
+                        THEN 0 ELSE {table}.{sender_unread} END,
+                    {sender_watermark} = COALESCE(
+                        (SELECT id FROM cleared), {table}.{sender_watermark}
+                    ),
+                    {sender_read_at} = CASE WHEN EXISTS (SELECT FROM cleared)
+                        THEN %s ELSE {table}.{sender_read_at} END
+                RETURNING id, last_seq
+            ),
+            inserted AS (
+                INSERT INTO {message_table} (
+                    id, sender_id, receiver_id, message, timestamp, read,
+                    conversation_id, conversation_key, seq
+                )
+                SELECT batch.id, %s, %s, batch.message, batch.timestamp, false,
+                    %s, %s, conv.last_seq - %s + batch.n
+                FROM batch, conv
+            ),
+            inbox AS (
+                INSERT INTO {inbox_table} (
+                    owner_id, peer_id, conversation_id, unread_count,
+                    last_activity, updated_at
+                )
+                SELECT
+                    entry.owner_id, entry.peer_id, conv.id, entry.unread_count,
+                    %s, %s
+                FROM conv, (VALUES (%s, %s, %s), (%s, %s, %s))
+                    AS entry (owner_id, peer_id, unread_count)
+                ON CONFLICT (owner_id, conversation_id) DO UPDATE SET
+                    unread_count = CASE
+                        WHEN EXCLUDED.owner_id = %s AND EXISTS (SELECT FROM cleared)
+                        THEN 0
+                        ELSE {inbox_table}.unread_count + EXCLUDED.unread_count
+                    END,
+                    last_activity = EXCLUDED.last_activity,
+                    updated_at = EXCLUDED.updated_at
+            ),
+            counter_lock AS MATERIALIZED (
+                SELECT {counter_table}.user_id FROM {counter_table}
+                WHERE {counter_table}.user_id IN (%s, %s)
+                    AND EXISTS (SELECT FROM conv)
+                ORDER BY {counter_table}.user_id
+                FOR UPDATE
+            ),
+            counter AS (
+                INSERT INTO {counter_table} (user_id, total)
+                SELECT %s, %s FROM conv
+                WHERE (SELECT count(*) FROM counter_lock) >= 0
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total = {counter_table}.total + EXCLUDED.total
+                RETURNING total
+            ),
+            sender_counter AS (
+                UPDATE {counter_table}
+                SET total = GREATEST({counter_table}.total - cleared.unread_count, 0)
+                FROM cleared
+                WHERE {counter_table}.user_id = %s
+                    AND (SELECT count(*) FROM counter_lock) >= 0
+                RETURNING {counter_table}.total
+            ),
+            events AS (
+                INSERT INTO {outbox_table} ("group", payload, created_at)
+                SELECT event.group_name, event.payload, %s
+                FROM (
+                    SELECT 1, %s, jsonb_build_object(
+                        'type', 'new_message',
+                        'message', sent.payloads -> -1,
+                        'messages', sent.payloads,
+                        'total_unread', counter.total
+                    )
+                    FROM counter, (
+                        SELECT jsonb_agg(jsonb_build_object(
+                            'id', batch.id,
+                            'seq', conv.last_seq - %s + batch.n,
+                            'sender', %s,
+                            'message', batch.message,
+                            'timestamp', batch.sent_at
+                        ) ORDER BY batch.n) AS payloads
+                        FROM batch, conv
+                    ) AS sent
+                    UNION ALL
+                    SELECT 2, %s, jsonb_build_object(
+                        'type', 'read_message',
+                        'message', jsonb_build_object(
+                            'last_read_message_id', cleared.id, 'reader_id', %s
+                        )
+                    )
+                    FROM cleared
+                    UNION ALL
+                    SELECT 3, %s, jsonb_build_object(
+                        'type', 'unread_count',
+                        'message', jsonb_build_object(
+                            'total_unread', COALESCE(sender_counter.total, 0)
+                        )
+                    )
+                    FROM cleared LEFT JOIN sender_counter ON true
+                ) AS event (position, group_name, payload)
+                WHERE %s
+                ORDER BY event.position
+            )
+            SELECT batch.id, conv.last_seq - %s + batch.n, counter.total,
+                cleared.id, sender_counter.total,
+                EXISTS (SELECT FROM locked WHERE NOT current)
+            FROM batch CROSS JOIN conv CROSS JOIN counter
+            LEFT JOIN cleared ON true
+            LEFT JOIN sender_counter ON true
+            ORDER BY batch.n
+        """
+        # With the in-process queue the caller sends the signals instead
+        write_events = settings.EVENT_DISPATCH == "outbox"
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [
+                cls._meta.db_table,
+                [message.pk for message in messages],
+                [message.message for message in messages],
+                [message.timestamp for message in messages],
+                [message.timestamp.isoformat() for message in messages],
+                conversation_id,
+                conversation_id, receiver_id, conversation_id,
+                conversation_id, p1_id, p2_id, unread_increment,
+                newest.message, newest.timestamp,
+                unread_increment if receiver_suffix == "p1" else 0,
+                unread_increment if receiver_suffix == "p2" else 0,
+                unread_increment, receiver_id,
+                unread_increment, now,
+                sender_id, receiver_id, conversation_id,
+                conversation_key, unread_increment,
+                newest.timestamp, newest.timestamp,
+                sender_id, receiver_id, 0,
+                receiver_id, sender_id, unread_increment,
+                sender_id,
+                min(sender_id, receiver_id), max(sender_id, receiver_id),
+                receiver_id, unread_increment,
+                sender_id,
+                now, f"user_{receiver_id}", unread_increment, sender_id,
+                f"user_{receiver_id}", sender_id,
+                f"user_{sender_id}",
+                write_events,
+                unread_increment,
+            ])
+            rows = cursor.fetchall()
+        if not rows:
+            return None, None
+        for message, row in zip(messages, rows):
+            message.pk, message.seq = row[0], row[1]
+            message._state.adding = False
+            message._state.db = connection.alias
+        newest.total_unread, last_read_message_id, sender_total, changed = rows[-1][2:]
+        transaction.on_commit(lambda: conversation_cache.safe_call(
+            conversation_cache.record_message, newest, unread_increment,
+        ))
+        read = None
+        if last_read_message_id is not None:
+            read = (last_read_message_id, sender_total or 0)
+        elif changed:
+            read = cls.READ_DEFERRED
+        return messages, read
+
+    def _send(self, batch, insert):
+        """
+        Reserve ``seq`` (and, on Postgres, the ids) for ``batch``, then call
+        ``insert`` to write the rows with them already set, and update the
+        Conversation, InboxEntry and receiver's UnreadCounter rows.  ``self``
+        must be the newest message; ``batch`` is the whole insert, oldest
+        first.  Sets ``self.total_unread`` to the receiver's new total.
+        Must run inside a transaction.
+        """
+        if self.sender_id == self.receiver_id:
+            # No conversation to update; the INSERT reports
+            # different_sender_receiver_constraint
+            return insert()
+        unread_increment = len(batch)
         p1_id = min(self.sender_id, self.receiver_id)
         p2_id = max(self.sender_id, self.receiver_id)
         receiver_is_p1 = self.receiver_id == p1_id
         unread_field = "unread_count_p1" if receiver_is_p1 else "unread_count_p2"
 
-        with transaction.atomic():
-            try:
-                conv = (
-                    Conversation.objects
-                    .select_for_update()
-                    .get(conversation_id=self.conversation_id)
+        if connection.vendor == "postgresql":
+            self._upsert_conversation(p1_id, p2_id, unread_field, batch)
+            insert()
+        else:
+            self._lock_and_update_conversation(
+                p1_id, p2_id, unread_field, batch, insert,
+            )
+        transaction.on_commit(lambda: conversation_cache.safe_call(
+            conversation_cache.record_message, self, unread_increment,
+        ))
+
+    def _upsert_conversation(self, p1_id, p2_id, unread_field, batch):
+        """
+        Single-statement ``INSERT ... ON CONFLICT DO UPDATE`` of the
+        Conversation row, chained through CTEs into the upsert of both
+        participants' InboxEntry rows and the receiver's UnreadCounter, run
+        before the messages are inserted.
+        Ids missing from the batch are drawn from the message sequence and
+        the reserved ``last_seq`` range is returned, so the INSERT writes
+        both and the rows are never touched again.  Counters are
+        incremented in place, so concurrent senders never wait on a row
+        lock held across round trips; the conflict row lock is what keeps
+        ``last_seq`` gapless.  ``last_message`` briefly points at a row that
+        is inserted right after, in the same transaction.
+        """
+        quote = connection.ops.quote_name
+        table = quote(Conversation._meta.db_table)
+        inbox_table = quote(InboxEntry._meta.db_table)
+        counter_table = quote(UnreadCounter._meta.db_table)
+        message_table = Message._meta.db_table
+        unread_column = quote(unread_field)
+        unread_increment = len(batch)
+        unread_p1 = unread_increment if unread_field == "unread_count_p1" else 0
+        unread_p2 = unread_increment - unread_p1
+        sql = f"""
+            WITH batch AS MATERIALIZED (
+                SELECT given.n, COALESCE(
+                    given.id, nextval(pg_get_serial_sequence(%s, 'id'))
+                ) AS id
+                FROM unnest(%s::bigint[]) WITH ORDINALITY AS given (id, n)
+            ),
+            conv AS (
+                INSERT INTO {table} (
+                    conversation_id, participant_1_id, participant_2_id,
+                    last_message_id, last_message_text, last_message_timestamp,
+                    unread_count_p1, unread_count_p2, last_seq
                 )
-                conv.last_message = self
-                conv.last_message_text = self.message
-                conv.last_message_timestamp = self.timestamp
-                setattr(conv, unread_field, getattr(conv, unread_field) + 1)
-                conv.save(update_fields=[
-                    "last_message", "last_message_text",
-                    "last_message_timestamp", unread_field,
-                ])
-            except Conversation.DoesNotExist:
-                Conversation.objects.create(
-                    conversation_id=self.conversation_id,
-                    participant_1_id=p1_id,
-                    participant_2_id=p2_id,
-                    last_message=self,
-                    last_message_text=self.message,
-                    last_message_timestamp=self.timestamp,
-                    **{unread_field: 1},
+                VALUES (
+                    %s, %s, %s, (SELECT id FROM batch WHERE n = %s),
+                    %s, %s, %s, %s, %s
                 )
+                ON CONFLICT (conversation_id) DO UPDATE SET
+                    last_message_id = EXCLUDED.last_message_id,
+                    last_message_text = EXCLUDED.last_message_text,
+                    last_message_timestamp = EXCLUDED.last_message_timestamp,
+                    {unread_column} = {table}.{unread_column} + %s,
+                    last_seq = {table}.last_seq + EXCLUDED.last_seq
+                RETURNING id, last_seq
+            ),
+            inbox AS (
+                INSERT INTO {inbox_table} (
+                owner_id, peer_id, conversation_id, unread_count,
+                last_activity, updated_at
+            )
+                SELECT entry.owner_id, entry.peer_id, conv.id, entry.unread_count, %s, %s
+                FROM conv, (VALUES (%s, %s, %s), (%s, %s, %s))
+                    AS entry (owner_id, peer_id, unread_count)
+                ON CONFLICT (owner_id, conversation_id) DO UPDATE SET
+                    unread_count = {inbox_table}.unread_count + EXCLUDED.unread_count,
+                    last_activity = EXCLUDED.last_activity,
+                    updated_at = EXCLUDED.updated_at
+            ),
+            counter AS (
+                INSERT INTO {counter_table} (user_id, total)
+                VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total = {counter_table}.total + EXCLUDED.total
+                RETURNING total
+            )
+            SELECT batch.id, conv.last_seq - %s + batch.n, counter.total
+            FROM batch, conv, counter
+            ORDER BY batch.n
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [
+                message_table, [message.pk for message in batch],
+                self.conversation_id, p1_id, p2_id, unread_increment,
+                self.message, self.timestamp,
+                unread_p1, unread_p2, unread_increment, unread_increment,
+                self.timestamp, self.timestamp,
+                self.sender_id, self.receiver_id, 0,
+                self.receiver_id, self.sender_id, unread_increment,
+                self.receiver_id, unread_increment,
+                unread_increment,
+            ])
+            reserved = cursor.fetchall()
+        for message, (message_id, seq, total_unread) in zip(batch, reserved):
+            message.pk, message.seq = message_id, seq
+        self.total_unread = total_unread
+
+    def _lock_and_update_conversation(self, p1_id, p2_id, unread_field, batch, insert):
+        """
+        Portable fallback (SQLite): lock the Conversation row, reserve the
+        seqs, insert, then update the row, the inbox entries and the
+        receiver's unread total.
+        """
+        unread_increment = len(batch)
+        conv = (
+            Conversation.objects
+            .select_for_update()
+            .get_or_create(
+                conversation_id=self.conversation_id,
+                defaults={"participant_1_id": p1_id, "participant_2_id": p2_id},
+            )[0]
+        )
+        # Legacy conversations keep null seqs until they are backfilled
+        if conv.last_seq is not None:
+            for offset, message in enumerate(batch, start=1):
+                message.seq = conv.last_seq + offset
+            conv.last_seq += unread_increment
+        # Both participants' totals may change (the sender's when the send
+        # also marks their unreads as read): lock them in a fixed order
+        UnreadCounter.lock(p1_id, p2_id)
+        # Before the insert: its post_save handler reports the new total
+        self.total_unread = UnreadCounter.add(self.receiver_id, unread_increment)
+        insert()
+        conv.last_message = self
+        conv.last_message_text = self.message
+        conv.last_message_timestamp = self.timestamp
+        setattr(conv, unread_field, getattr(conv, unread_field) + unread_increment)
+        conv.save(update_fields=[
+            "last_message", "last_message_text",
+            "last_message_timestamp", unread_field, "last_seq",
+        ])
+        InboxEntry.record_message(conv, self, unread_increment)
+
+    def __str__(self):
+        return self.message
+
+
+class MessageArchiveQuerySet(models.QuerySet):
+
+    def messages_before(self, conversation_id, position, limit):
+        """
+        Up to ``limit`` archived messages older than ``position``
+        (``(timestamp, id)``, None for the newest), newest first.
+        Batches are decompressed one at a time, newest first, until enough
+        rows are collected.
+        """
+        batches = self.filter(conversation_id=conversation_id).order_by(
+            "-last_timestamp", "-last_message_id",
+        )
+        if position is not None:
+            batches = batches.filter(first_timestamp__lte=position[0])
+        messages = []
+        for batch in batches.iterator(chunk_size=4):
+            messages += [
+                message for message in reversed(batch.get_messages())
+                if position is None or (message.timestamp, message.id) < position
+            ]
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
+
+    def messages_after(self, conversation_id, position, limit):
+        """Up to ``limit`` archived messages newer than ``position``, oldest first."""
+        batches = (
+            self.filter(conversation_id=conversation_id, last_timestamp__gte=position[0])
+            .order_by("last_timestamp", "last_message_id")
+        )
+        messages = []
+        for batch in batches.iterator(chunk_size=4):
+            messages += [
+                message for message in batch.get_messages()
+                if (message.timestamp, message.id) > position
+            ]
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
+
+
+class MessageArchive(models.Model):
+    """
+    Cold tier for old messages: consecutive messages of one conversation
+    packed into one compressed row by ``archive_messages`` and removed from
+    the hot Message table.  Message history reads through to it once a
+    cursor passes the oldest hot message.
+    """
+    conversation_id = models.CharField(max_length=255)
+    first_timestamp = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    # zlib-compressed JSON rows, see utils.archive
+    payload = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageArchiveQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _("Message Archive")
+        verbose_name_plural = _("Message Archives")
+        indexes = [
+            models.Index(
+                fields=["conversation_id", "-last_timestamp", "-last_message_id"],
+                name="archive_conversation_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Unsaved archive row for ``messages`` (one conversation, oldest first)."""
+        return cls(
+            conversation_id=messages[0].conversation_id,
+            first_timestamp=messages[0].timestamp,
+            first_message_id=messages[0].id,
+            last_timestamp=messages[-1].timestamp,
+            last_message_id=messages[-1].id,
+            message_count=len(messages),
+            payload=pack_messages(messages),
+        )
+
+    def get_messages(self):
+        """The archived messages as unsaved Message instances, oldest first."""
+        return [
+            Message(conversation_id=self.conversation_id, **values)
+            for values in unpack_messages(self.payload)
+        ]
+
+    def __str__(self):
+        return f"{self.conversation_id}:{self.first_message_id}-{self.last_message_id}"
+
+
+class OutboxEvent(models.Model):
+    """
+    A WebSocket event waiting to be published, written in the transaction
+    of the change it reports so a rollback never leaves a phantom event.
+    ``relay_events`` publishes the rows to the channel layer in id order
+    and deletes them once sent.
+    """
+    group = models.CharField(max_length=150)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("Outbox Event")
+        verbose_name_plural = _("Outbox Events")
 
     def __str__(self):
-        return self.message
\ No newline at end of file
+        return f"{self.group}:{self.payload.get('type')}"
@@ -1,5 +1,19 @@
-from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    PageNumberPagination,
+    CursorPagination,
+    Cursor,
+    _reverse_ordering,
+)
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+
+from .models import MessageArchive
 
 
 class BasePagination(PageNumberPagination):
@@ -17,17 +31,327 @@ class BasePagination(PageNumberPagination):
         })
 
 
-class RecentConversationsPagination(CursorPagination):
-    """Cursor-based pagination for conversation lists — avoids COUNT(*)."""
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on a composite key, e.g. ``('-timestamp', '-id')``.
+
+    DRF's CursorPagination only uses the first ordering field as the cursor
+    position and falls back to OFFSET inside runs of equal values.  Here
+    the cursor carries every ordering value, so each page is a bounded
+    seek on the matching composite index, however deep the client scrolls
+    and however many rows share a timestamp.
+    """
+    position_separator = '|'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor and self.cursor.position is not None:
+            try:
+                queryset = queryset.filter(
+                    self.get_keyset_filter(self.cursor.position, ordering)
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = self.get_results(queryset, reverse)
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_results(self, queryset, reverse):
+        ''' Up to page_size + 1 rows of the ordered, cursor-filtered queryset '''
+        return list(queryset[:self.page_size + 1])
+
+    def get_keyset_filter(self, position, ordering, include_position=False):
+        '''
+        Rows after ``position`` in ``ordering`` (strictly, unless
+        ``include_position``).  The leading ``<=``/``>=`` bound keeps the
+        index range closed for the planner.
+        '''
+        values = position.split(self.position_separator)
+        descending = {order.startswith('-') for order in ordering}
+        assert len(descending) == 1, 'Keyset ordering fields must share a direction.'
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        strict, inclusive = ('lt', 'lte') if descending.pop() else ('gt', 'gte')
+        fields = [order.lstrip('-') for order in ordering]
+        keyset = Q()
+        last = len(fields) - 1
+        for index in range(last, -1, -1):
+            lookup = inclusive if index == last and include_position else strict
+            step = Q(**{f'{fields[index]}__{lookup}': values[index]})
+            if index < last:
+                step |= Q(**{fields[index]: values[index]}) & keyset
+            keyset = step
+        return Q(**{f'{fields[0]}__{inclusive}': values[0]}) & keyset
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = (
+            self._get_position_from_instance(self.page[-1], self.ordering)
+            if self.page else self.cursor.position
+        )
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = (
+            self._get_position_from_instance(self.page[0], self.ordering)
+            if self.page else self.cursor.position
+        )
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(str(instance[field_name]))
+            else:
+                values.append(str(getattr(instance, field_name)))
+        return self.position_separator.join(values)
+
+
+class RecentConversationsPagination(KeysetCursorPagination):
+    """Keyset pagination for conversation lists — avoids COUNT(*) and OFFSET."""
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 50
-    ordering = '-last_message_timestamp'
+    ordering = ('-last_activity', '-id')
+
+    def is_cacheable(self, request, cache_size):
+        ''' First page only, and small enough to tell whether a next page exists '''
+        return (
+            self.cursor_query_param not in request.query_params
+            and self.get_page_size(request) < cache_size
+        )
+
+    def paginate_cached_rows(self, rows, request, view=None):
+        ''' Paginate pre-rendered cache rows the same way as the first DB page '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, None, view)
+        self.cursor = None
+        self.page = rows[:self.page_size]
+        self.has_previous = False
+        self.has_next = len(rows) > self.page_size
+        return self.page
+
+
+class MessageSearchPagination(KeysetCursorPagination):
+    """
+    Keyset pagination over search results, best match first.  Ranks are
+    decimals rounded by the query, so cursors compare them exactly.  Links
+    keep the search ``mode`` the first page settled on.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = ('-rank', '-id')
+    mode_query_param = 'mode'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super().paginate_queryset(queryset, request, view)
+        self.base_url = replace_query_param(
+            self.base_url, self.mode_query_param, view.search_mode,
+        )
+        return page
 
 
-class ConversationMessagesPagination(CursorPagination):
-    """Cursor-based pagination for message lists — avoids COUNT(*)."""
+class ConversationMessagesPagination(KeysetCursorPagination):
+    """
+    Keyset pagination for message lists — avoids COUNT(*) and OFFSET.
+
+    Scrolling back reads through to ``MessageArchive`` once the hot table
+    runs out, with the same cursors; ``around``, ``after`` and ``seq_from``
+    only see the hot table.
+    """
     page_size = 25
     page_size_query_param = 'page_size'
     max_page_size = 100
-    ordering = '-timestamp'
\ No newline at end of file
+    ordering = ('-timestamp', '-id')
+    around_query_param = 'around'
+    after_query_param = 'after'
+    seq_from_query_param = 'seq_from'
+    seq_to_query_param = 'seq_to'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_conversation_id = getattr(view, 'get_conversation_id', None)
+        self.conversation_id = get_conversation_id() if get_conversation_id else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_results(self, queryset, reverse):
+        '''
+        Hot rows, continued into the archive.  Archived messages are older
+        than every hot one, so they follow the hot rows when scrolling back
+        and come first when paging forward from an archived cursor.
+        '''
+        if self.conversation_id is None:
+            return super().get_results(queryset, reverse)
+        limit = self.page_size + 1
+        position = self.parse_position(self.cursor.position) if self.cursor else None
+        if reverse:
+            results = MessageArchive.objects.messages_after(
+                self.conversation_id, position, limit,
+            )
+            if len(results) < limit:
+                results += super().get_results(queryset, reverse)
+            return results[:limit]
+
+        results = super().get_results(queryset, reverse)
+        if len(results) < limit:
+            if results:
+                position = (results[-1].timestamp, results[-1].id)
+            results += MessageArchive.objects.messages_before(
+                self.conversation_id, position, limit - len(results),
+            )
+        return results
+
+    def parse_position(self, position):
+        ''' ``(timestamp, id)`` of a cursor position '''
+        try:
+            timestamp, message_id = position.split(self.position_separator)
+            timestamp = parse_datetime(timestamp)
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            timestamp = None
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, message_id
+
+    def get_anchor_position(self, queryset, message_id):
+        ''' Keyset position of a message in this conversation (404 if absent) '''
+        try:
+            anchor = queryset.filter(id=int(message_id)).values_list(
+                *[order.lstrip('-') for order in self.ordering]
+            ).first()
+        except (TypeError, ValueError):
+            anchor = None
+        if anchor is None:
+            raise NotFound(_('Message not found in this conversation.'))
+        return self.position_separator.join(str(value) for value in anchor)
+
+    def paginate_around(self, queryset, request, message_id, view=None):
+        '''
+        Window of ``page_size`` messages centred on ``message_id`` (newest
+        first, anchor included): two index seeks in opposite directions.
+        next/previous continue as normal cursors from the window edges.
+        '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.around_query_param,
+        )
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = None
+        position = self.get_anchor_position(queryset, message_id)
+
+        newer_count = self.page_size // 2
+        older_count = self.page_size - newer_count
+        reversed_ordering = _reverse_ordering(self.ordering)
+        older = list(
+            queryset.order_by(*self.ordering)
+            .filter(self.get_keyset_filter(
+                position, self.ordering, include_position=True,
+            ))
+            [:older_count + 1]
+        )
+        newer = list(
+            queryset.order_by(*reversed_ordering)
+            .filter(self.get_keyset_filter(position, reversed_ordering))
+            [:newer_count + 1]
+        )
+
+        self.page = list(reversed(newer[:newer_count])) + older[:older_count]
+        self.has_next = len(older) > older_count
+        self.has_previous = len(newer) > newer_count
+        return self.page
+
+    def paginate_after(self, queryset, request, message_id, view=None):
+        '''
+        Messages newer than ``message_id`` in ascending order, for catching
+        up from a known message.  ``next`` continues with ``?after=<last id>``.
+        '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = None
+        position = self.get_anchor_position(queryset, message_id)
+
+        ascending = _reverse_ordering(self.ordering)
+        results = list(
+            queryset.order_by(*ascending)
+            .filter(self.get_keyset_filter(position, ascending))
+            [:self.page_size + 1]
+        )
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = False
+        self.after_mode = True
+        return self.page
+
+    def paginate_seq_range(self, queryset, request, seq_from, seq_to=None, view=None):
+        '''
+        Messages with ``seq_from <= seq <= seq_to`` in ascending order, for
+        filling a gap spotted in the per-conversation sequence.  A range
+        scan on message_conversation_seq_idx; ``next`` moves ``seq_from``.
+        '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = None
+        try:
+            queryset = queryset.filter(seq__gte=int(seq_from))
+            if seq_to is not None:
+                queryset = queryset.filter(seq__lte=int(seq_to))
+        except (TypeError, ValueError):
+            raise NotFound(_('Invalid sequence range.'))
+
+        results = list(queryset.order_by('seq')[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = False
+        self.seq_range_mode = True
+        return self.page
+
+    def get_next_link(self):
+        if getattr(self, 'seq_range_mode', False):
+            if not self.has_next:
+                return None
+            return replace_query_param(
+                self.base_url, self.seq_from_query_param, self.page[-1].seq + 1,
+            )
+        if getattr(self, 'after_mode', False):
+            if not self.has_next:
+                return None
+            return replace_query_param(
+                self.base_url, self.after_query_param, self.page[-1].id,
+            )
+        return super().get_next_link()
@@ -1,36 +1,54 @@
+from operator import attrgetter
+
 from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
-from .models import Message, Conversation
+from core_apps.users.utils.avatars import get_profile_image_url
+
+from .models import Message, InboxEntry
 
 
 User = get_user_model()
 
 class MessageCreateSerializer(serializers.ModelSerializer):
-    sender = serializers.SlugRelatedField(
-        slug_field='id',
-        read_only=True
-    )
-    receiver = serializers.SlugRelatedField(
-        slug_field='id',
-        read_only=True
-    )
+    # Read from the FK columns: sent messages never load the users
+    sender = serializers.IntegerField(source='sender_id', read_only=True)
+    receiver = serializers.IntegerField(source='receiver_id', read_only=True)
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'receiver', 'message', 'timestamp', 'read']
-        read_only_fields = ['id', 'sender', 'timestamp', 'read']
+        fields = ['id', 'sender', 'receiver', 'message', 'timestamp', 'read', 'seq']
+        read_only_fields = ['id', 'sender', 'timestamp', 'read', 'seq']
+
+
+class MessageBulkCreateSerializer(serializers.Serializer):
+    ''' Input for the bulk send endpoint: a list of message texts. '''
+    MAX_BATCH_SIZE = 100
+
+    messages = serializers.ListField(
+        child=serializers.CharField(max_length=2048),
+        min_length=1,
+        max_length=MAX_BATCH_SIZE,
+    )
+
+
+class MessageReadSerializer(serializers.Serializer):
+    ''' Input for the mark-read endpoint; omit up_to to read everything. '''
+    up_to = serializers.IntegerField(min_value=1, required=False)
 
 
 class MessageDetailSerializer(serializers.ModelSerializer):
     sender = serializers.SerializerMethodField()
     receiver = serializers.SerializerMethodField()
+    read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'receiver', 'message', 'timestamp', 'read']
-        read_only_fields = ['id', 'sender', 'receiver', 'timestamp', 'read']
+        fields = ['id', 'seq', 'sender', 'receiver', 'message', 'timestamp', 'read']
+        read_only_fields = ['id', 'seq', 'sender', 'receiver', 'timestamp', 'read']
 
     def get_sender(self, obj):
         return obj.sender_id
@@ -38,36 +56,108 @@ class MessageDetailSerializer(serializers.ModelSerializer):
     def get_receiver(self, obj):
         return obj.receiver_id
 
-
-class ConversationSerializer(serializers.ModelSerializer):
-    user_id = serializers.SerializerMethodField()
-    first_name = serializers.SerializerMethodField()
+    def get_read(self, obj):
+        ''' Read if below the receiver's watermark (or flagged by legacy rows) '''
+        if obj.read:
+            return True
+        watermarks = self.context.get('read_watermarks', {})
+        return obj.id <= watermarks.get(obj.receiver_id, 0)
+
+
+# Columns read by the message list fast path, e.g.
+# ``queryset.values_list(*MESSAGE_ROW_FIELDS, named=True)``
+MESSAGE_ROW_FIELDS = (
+    'id', 'seq', 'sender_id', 'receiver_id', 'message', 'timestamp', 'read',
+)
+
+
+def get_timestamp_formatter():
+    '''
+    ``DateTimeField.to_representation`` for aware datetimes, reduced to a
+    timezone conversion and ``isoformat()`` under the default settings
+    (ISO 8601 output, ``USE_TZ``)
+    '''
+    field = serializers.DateTimeField()
+    if api_settings.DATETIME_FORMAT != ISO_8601 or not settings.USE_TZ:
+        return field.to_representation
+    field_timezone = field.default_timezone()
+
+    def format_timestamp(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return format_timestamp
+
+
+def message_row_serializer(read_watermarks=None):
+    '''
+    Read-only fast path for ``MessageDetailSerializer``: returns a function
+    turning one row into the dict the serializer would produce, without
+    building or calling a field object per value.  Rows are named tuples
+    of ``MESSAGE_ROW_FIELDS`` or Message instances (e.g. from the archive).
+    Keep in step with ``MessageDetailSerializer``.
+    '''
+    watermarks = read_watermarks or {}
+    get_values = attrgetter(*MESSAGE_ROW_FIELDS)
+    format_timestamp = get_timestamp_formatter()
+
+    def to_representation(row):
+        message_id, seq, sender_id, receiver_id, message, timestamp, read = (
+            get_values(row)
+        )
+        return {
+            'id': message_id,
+            'seq': seq,
+            'sender': sender_id,
+            'receiver': receiver_id,
+            'message': message,
+            'timestamp': format_timestamp(timestamp),
+            'read': read or message_id <= watermarks.get(receiver_id, 0),
+        }
+
+    return to_representation
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    ''' A conversation as listed in the owner's inbox '''
+    user_id = serializers.IntegerField(source='peer_id')
+    first_name = serializers.CharField(source='peer.first_name')
     profile_image = serializers.SerializerMethodField()
-    last_message = serializers.CharField(source='last_message_text')
-    timestamp = serializers.DateTimeField(source='last_message_timestamp')
-    unread_count = serializers.SerializerMethodField()
+    last_message = serializers.CharField(source='conversation.last_message_text')
+    timestamp = serializers.DateTimeField(source='last_activity')
+    unread_count = serializers.IntegerField()
 
     class Meta:
-        model = Conversation
+        model = InboxEntry
         fields = ['user_id', 'first_name', 'profile_image', 'last_message', 'timestamp', 'unread_count']
         read_only_fields = fields
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.user = self.context['request'].user
+    def get_profile_image(self, obj):
+        return get_profile_image_url(self.context['request'], obj.peer.profile_image)
+
 
-    def get_user_id(self, obj):
-        return obj.get_other_user_id(self.user.id)
+class SyncConversationSerializer(serializers.ModelSerializer):
+    ''' Conversation state for delta sync, including both read watermarks '''
+    user_id = serializers.IntegerField(source='peer_id')
+    last_message = serializers.CharField(source='conversation.last_message_text')
+    timestamp = serializers.DateTimeField(source='last_activity')
+    unread_count = serializers.IntegerField()
+    last_seq = serializers.IntegerField(source='conversation.last_seq')
+    last_read_message_id = serializers.SerializerMethodField()
+    peer_last_read_message_id = serializers.SerializerMethodField()
 
-    def get_first_name(self, obj):
-        other, _ = obj.get_other_user(self.user.id)
-        return other.first_name
+    class Meta:
+        model = InboxEntry
+        fields = [
+            'user_id', 'last_message', 'timestamp', 'unread_count', 'last_seq',
+            'last_read_message_id', 'peer_last_read_message_id',
+        ]
+        read_only_fields = fields
 
-    def get_profile_image(self, obj):
-        other, _ = obj.get_other_user(self.user.id)
-        if other.profile_image:
-            return self.context['request'].build_absolute_uri(other.profile_image.url)
-        return None
+    def get_last_read_message_id(self, obj):
+        return obj.conversation.get_last_read_message_id(obj.owner_id)
 
-    def get_unread_count(self, obj):
-        return obj.get_unread_count(self.user.id)
\ No newline at end of file
+    def get_peer_last_read_message_id(self, obj):
+        return obj.conversation.get_last_read_message_id(obj.peer_id)
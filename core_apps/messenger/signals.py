@@ -2,65 +2,80 @@ import logging
 
 from django.db.models.signals import post_save
 from django.dispatch import receiver, Signal
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 
 from .models import Message
+from .utils import dispatch
 
 logger = logging.getLogger("light_messages.signals")
 
-# Custom signal emitted when a batch of messages is marked as read
+# Custom signal emitted when a batch of messages is marked as read, inside
+# the transaction that marked them
 messages_read = Signal()
+# Custom signal emitted after Message.bulk_send (bulk_create skips post_save),
+# inside the transaction that inserted the batch
+messages_created = Signal()
+
+
+def build_message_payload(instance):
+    """Serialize a message for the ``new_message`` WebSocket event."""
+    return {
+        'id': instance.id,
+        'seq': instance.seq,
+        'sender': instance.sender_id,
+        'message': instance.message,
+        'timestamp': instance.timestamp.isoformat(),
+    }
 
 
 @receiver(post_save, sender=Message)
 def send_websocket_notification(sender, instance, created, **kwargs):
-    """Push a new-message event to the receiver's WebSocket group."""
+    """
+    Queue a new-message event for the receiver's WebSocket group, sent once
+    the insert commits; ``seq`` is already set.
+    """
     if created:
-        channel_layer = get_channel_layer()
-        receiver_group_name = f"user_{instance.receiver.id}"
-        message_data = {
+        dispatch.send_event(f"user_{instance.receiver_id}", {
             'type': 'new_message',
-            'message': {
-                'id': instance.id,
-                'sender': instance.sender.id,
-                'message': instance.message,
-                'timestamp': instance.timestamp.isoformat(),
-            }
-        }
-        async_to_sync(channel_layer.group_send)(
-            receiver_group_name,
-            message_data
-        )
+            'message': build_message_payload(instance),
+            'total_unread': instance.total_unread,
+        })
+
+
+@receiver(messages_created)
+def send_bulk_websocket_notification(sender, messages, **kwargs):
+    """
+    Queue one combined ``new_message`` event for a batch.  ``message`` is the
+    newest entry (what single-message clients read); ``messages`` carries
+    the whole batch in send order and ``total_unread`` the receiver's total
+    after it.
+    """
+    if not messages:
+        return
+    payloads = [build_message_payload(instance) for instance in messages]
+    dispatch.send_event(f"user_{messages[-1].receiver_id}", {
+        'type': 'new_message',
+        'message': payloads[-1],
+        'messages': payloads,
+        'total_unread': messages[-1].total_unread,
+    })
 
 
 @receiver(messages_read)
 def send_read_message_notification(sender, reader_id, sender_id, last_message_id, **kwargs):
-    """Push a read-receipt event to the original sender's WebSocket group."""
-    try:
-        channel_layer = get_channel_layer()
-        if channel_layer is None:
-            return
-        sender_group_name = f"user_{sender_id}"
-        message_data = {
-            'type': 'read_message',
-            'message': {
-                'last_read_message_id': last_message_id,
-                'reader_id': reader_id,
-            }
+    """Queue a read-receipt event for the original sender's WebSocket group."""
+    dispatch.send_event(f"user_{sender_id}", {
+        'type': 'read_message',
+        'message': {
+            'last_read_message_id': last_message_id,
+            'reader_id': reader_id,
         }
-        async_to_sync(channel_layer.group_send)(
-            sender_group_name,
-            message_data
-        )
-    except Exception as e:
-        logger.error(
-            "error_sending_read_message_notification",
-            extra={
-                "event": "error_sending_read_message_notification",
-                "reader_id": reader_id,
-                "sender_id": sender_id,
-                "last_message_id": last_message_id,
-                "error": str(e),
-            },
-        )
\ No newline at end of file
+    })
+
+
+@receiver(messages_read)
+def send_unread_count_notification(sender, reader_id, total_unread, **kwargs):
+    """Queue the reader's new unread total for their own WebSocket group."""
+    dispatch.send_event(f"user_{reader_id}", {
+        'type': 'unread_count',
+        'message': {'total_unread': total_unread},
+    })
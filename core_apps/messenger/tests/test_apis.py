@@ -1,13 +1,35 @@
 import pytest
+from datetime import timedelta
+from io import StringIO
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from django.contrib.auth import get_user_model
-from core_apps.messenger.models import Message
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from core_apps.messenger.models import (
+    Message, Conversation, InboxEntry, MessageArchive, OutboxEvent, UnreadCounter,
+)
+from core_apps.messenger.utils import conversation_cache, dispatch, outbox
+from core_apps.messenger.utils.breaker import CircuitBreaker
+from core_apps.messenger.utils.conversations import get_conversation_id
+from light_messages import health
 
 User = get_user_model()
 
+
+class RecordingChannelLayer:
+    """Records group_send calls."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
 @pytest.mark.django_db
 class TestMessengerAPIs:
     def setup_method(self):
@@ -72,6 +94,221 @@ class TestMessengerAPIs:
         
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+    def test_message_to_unknown_user(self, user):
+        self.client.force_authenticate(user=user)
+        for user_id in (user.id + 1000, "abc", 2 ** 70):
+            conversation_url = reverse(
+                "conversation-list-create-view", kwargs={'user_id': user_id},
+            )
+            response = self.client.post(conversation_url, {"message": "Hello"})
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert not Message.objects.exists()
+        assert not Conversation.objects.exists()
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Single-statement send is Postgres only",
+    )
+    def test_message_send_query_budget(
+        self, user, user_factory, django_assert_num_queries,
+    ):
+        other_user = user_factory()
+        conversation_url = reverse(
+            "conversation-list-create-view", kwargs={'user_id': other_user.id},
+        )
+        self.client.force_authenticate(user=user)
+        # Receiver check, insert, conversation / inbox / counter upserts and
+        # read marking are a single statement
+
+        # New conversation
+        with django_assert_num_queries(1):
+            response = self.client.post(conversation_url, {"message": "Hello"})
+        assert response.status_code == status.HTTP_201_CREATED
+
+        # Existing conversation with unread messages to clear
+        first = self.create_test_message(other_user, user, "first")
+        second = self.create_test_message(other_user, user, "second")
+        with django_assert_num_queries(1):
+            response = self.client.post(conversation_url, {"message": "Hi"})
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['seq'] == 4
+        assert response.data['sender'] == user.id
+        assert response.data['receiver'] == other_user.id
+
+        conv = Conversation.objects.get(
+            conversation_id=get_conversation_id(user.id, other_user.id)
+        )
+        assert conv.get_unread_count(user.id) == 0
+        assert conv.get_unread_count(other_user.id) == 2
+        assert conv.get_last_read_message_id(user.id) == second.id
+        assert conv.last_message_id == response.data['id']
+        assert first.id < second.id < response.data['id']
+        assert {
+            entry.owner_id: entry.unread_count
+            for entry in InboxEntry.objects.filter(conversation=conv)
+        } == {user.id: 0, other_user.id: 2}
+        assert UnreadCounter.get_total(user.id) == 0
+        assert UnreadCounter.get_total(other_user.id) == 2
+        # The statement also wrote the WebSocket events
+        events = list(
+            OutboxEvent.objects.order_by('id').values_list('group', 'payload')
+        )
+        assert [(group, payload['type']) for group, payload in events[-3:]] == [
+            (f"user_{other_user.id}", 'new_message'),
+            (f"user_{other_user.id}", 'read_message'),
+            (f"user_{user.id}", 'unread_count'),
+        ]
+        new_message, read_message, unread_count = (
+            payload for _, payload in events[-3:]
+        )
+        sent = Message.objects.get(id=response.data['id'])
+        assert new_message['message'] == {
+            'id': response.data['id'],
+            'seq': 4,
+            'sender': user.id,
+            'message': 'Hi',
+            'timestamp': sent.timestamp.isoformat(),
+        }
+        assert new_message['messages'] == [new_message['message']]
+        assert new_message['total_unread'] == 2
+        assert read_message['message'] == {
+            'last_read_message_id': second.id, 'reader_id': user.id,
+        }
+        assert unread_count['message'] == {'total_unread': 0}
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Single-statement send is Postgres only",
+    )
+    @pytest.mark.django_db(transaction=True)
+    def test_message_send_after_concurrent_reply(
+        self, user, user_factory, run_in_thread, wait_for_lock_wait,
+    ):
+        other_user = user_factory()
+        self.create_test_message(other_user, user, "first")
+        self.client.force_authenticate(user=user)
+        conversation_url = reverse(
+            "conversation-list-create-view", kwargs={'user_id': other_user.id},
+        )
+        responses = []
+
+        with transaction.atomic():
+            # Commits while the POST's statement waits for the Conversation row
+            Message.send(other_user.id, user.id, ["second"])
+            join = run_in_thread(lambda: responses.append(
+                self.client.post(conversation_url, {"message": "Hi"})
+            ))
+            wait_for_lock_wait()
+        join()
+
+        assert responses[0].status_code == status.HTTP_201_CREATED
+        second = Message.objects.get(message="second")
+        conv = Conversation.objects.get(
+            conversation_id=get_conversation_id(user.id, other_user.id)
+        )
+        # Read up to the reply that raced the send, not the older snapshot
+        assert conv.get_last_read_message_id(user.id) == second.id
+        assert conv.get_unread_count(user.id) == 0
+        assert InboxEntry.objects.get(owner=user, conversation=conv).unread_count == 0
+        assert UnreadCounter.get_total(user.id) == 0
+        [read_message] = OutboxEvent.objects.filter(payload__type='read_message')
+        assert read_message.payload['message']['last_read_message_id'] == second.id
+
+    def test_message_send_queue_dispatch(
+        self, user, user_factory, settings, monkeypatch,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.EVENT_DISPATCH = "queue"
+        channel_layer = RecordingChannelLayer()
+        dispatcher = dispatch.EventDispatcher(
+            maxsize=10, batch_size=10, channel_layer=channel_layer,
+        )
+        monkeypatch.setattr(dispatch, "get_dispatcher", lambda: dispatcher)
+        other_user = user_factory()
+        unread = self.create_test_message(other_user, user, "unread")
+        self.client.force_authenticate(user=user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    "conversation-list-create-view",
+                    kwargs={'user_id': other_user.id},
+                ),
+                {"message": "Hi"},
+            )
+        dispatcher.close()
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert not OutboxEvent.objects.exists()
+        # Ordered within a group; groups are published concurrently
+        received = {}
+        for group, message in channel_layer.sent:
+            received.setdefault(group, []).append(message)
+        assert {
+            group: [message['type'] for message in messages]
+            for group, messages in received.items()
+        } == {
+            f"user_{other_user.id}": ['new_message', 'read_message'],
+            f"user_{user.id}": ['unread_count'],
+        }
+        new_message, read_message = received[f"user_{other_user.id}"]
+        [unread_count] = received[f"user_{user.id}"]
+        assert new_message['message']['id'] == response.data['id']
+        assert new_message['total_unread'] == 1
+        assert read_message['message'] == {
+            'last_read_message_id': unread.id, 'reader_id': user.id,
+        }
+        assert unread_count['message'] == {'total_unread': 0}
+
+    def test_health_reports_event_dispatch(self, settings, monkeypatch, fake_redis):
+        # No relay running
+        response = self.client.get(reverse("health_check"))
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == 'degraded'
+        assert response.data['events'] == {
+            'dispatch': 'outbox',
+            'outbox': {'pending': 0, 'lag_seconds': 0.0},
+            'relays': {},
+        }
+
+        breaker = CircuitBreaker(
+            "test", failure_threshold=1, latency_threshold=0.5, reset_timeout=10,
+        )
+        outbox.write_heartbeat("relay-1", breaker)
+        response = self.client.get(reverse("health_check"))
+        assert response.data['status'] == 'healthy'
+        assert response.data['events']['relays']['relay-1']['state'] == 'closed'
+
+        # Events waiting longer than the threshold
+        settings.OUTBOX_RELAY_LAG_THRESHOLD = 60
+        OutboxEvent.objects.create(group="user_1", payload={})
+        OutboxEvent.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        response = self.client.get(reverse("health_check"))
+        assert response.data['status'] == 'degraded'
+        assert response.data['events']['outbox']['pending'] == 1
+        OutboxEvent.objects.all().delete()
+
+        # The relay's breaker opened
+        breaker.record_failure()
+        outbox.write_heartbeat("relay-1", breaker)
+        response = self.client.get(reverse("health_check"))
+        assert response.data['status'] == 'degraded'
+        assert response.data['events']['relays']['relay-1']['state'] == 'open'
+
+        settings.EVENT_DISPATCH = "queue"
+        breaker = CircuitBreaker(
+            "test", failure_threshold=1, latency_threshold=0.5, reset_timeout=10,
+        )
+        monkeypatch.setattr(health, "get_breaker", lambda: breaker)
+        monkeypatch.setattr(
+            dispatch, "get_dispatcher",
+            lambda: dispatch.EventDispatcher(maxsize=10, batch_size=10),
+        )
+        breaker.record_failure()
+        response = self.client.get(reverse("health_check"))
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == 'degraded'
+        assert response.data['events']['circuit_breaker']['state'] == 'open'
+        assert response.data['events']['queue']['depth'] == 0
+
     def test_message_read_status(self, user):
         other_user = User.objects.create_user(
             email="other@example.com",
@@ -88,8 +325,14 @@ class TestMessengerAPIs:
         response = self.client.get(conversation_url)
         
         assert response.status_code == status.HTTP_200_OK
-        message.refresh_from_db()
-        assert message.read
+        assert response.data['results'][0]['read'] is True
+        # Read state lives in the watermark, not on the message row
+        conv = Conversation.objects.get(
+            conversation_id=get_conversation_id(user.id, other_user.id)
+        )
+        assert conv.get_last_read_message_id(user.id) == message.id
+        assert conv.last_read_at_p1 or conv.last_read_at_p2
+        assert conv.get_unread_count(user.id) == 0
 
     def test_long_message_validation(self, user):
         other_user = User.objects.create_user(
@@ -144,4 +387,506 @@ class TestMessengerAPIs:
         assert 'next' in response.data
         assert 'previous' in response.data
         assert 'results' in response.data
-        assert len(response.data['results']) <= 25
\ No newline at end of file
+        assert len(response.data['results']) <= 25
+
+    def test_message_list_reads_through_archive(self, user, user_factory):
+        other_user = user_factory()
+        messages = [
+            self.create_test_message(user, other_user, f"Message {i}") for i in range(8)
+        ]
+        old = timezone.now() - timedelta(days=400)
+        for offset, message in enumerate(messages[:5]):
+            message.timestamp = old + timedelta(minutes=offset)
+            Message.objects.filter(id=message.id).update(timestamp=message.timestamp)
+        call_command(
+            "archive_messages", "--older-than-days", "365", "--batch-size", "2",
+            stdout=StringIO(),
+        )
+        assert Message.objects.count() == 3
+        assert MessageArchive.objects.count() == 3
+
+        self.client.force_authenticate(user=user)
+        url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+        pages, response = [], self.client.get(f"{url}?page_size=3")
+        while True:
+            pages.append([m['id'] for m in response.data['results']])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        expected = [m.id for m in reversed(messages)]
+        assert pages == [expected[:3], expected[3:6], expected[6:]]
+        assert response.data['results'][0]['message'] == "Message 1"
+
+        # Back towards newer messages from an archived position
+        response = self.client.get(response.data['previous'])
+        assert [m['id'] for m in response.data['results']] == expected[3:6]
+        response = self.client.get(response.data['previous'])
+        assert [m['id'] for m in response.data['results']] == expected[:3]
+
+    def test_bulk_message_create(self, user, user_factory):
+        other_user = user_factory()
+        bulk_url = reverse("conversation-bulk-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            bulk_url, {"messages": ["one", "two", "three"]}, format="json"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [m['message'] for m in response.data] == ["one", "two", "three"]
+        assert all(m['sender'] == user.id for m in response.data)
+
+        conv = Conversation.objects.get(
+            conversation_id=get_conversation_id(user.id, other_user.id)
+        )
+        assert conv.last_message_id == response.data[-1]['id']
+        assert conv.last_message_text == "three"
+        assert conv.get_unread_count(other_user.id) == 3
+        assert conv.get_unread_count(user.id) == 0
+
+    def test_bulk_message_create_validation(self, user, user_factory):
+        other_user = user_factory()
+        bulk_url = reverse("conversation-bulk-create-view", kwargs={'user_id': other_user.id})
+        self_url = reverse("conversation-bulk-create-view", kwargs={'user_id': user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(bulk_url, {"messages": []}, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = self.client.post(bulk_url, {"messages": ["x" * 2049]}, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = self.client.post(self_url, {"messages": ["hi"]}, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Message.objects.exists()
+
+    def test_mark_read_endpoint(self, user, user_factory):
+        other_user = user_factory()
+        first = self.create_test_message(other_user, user, "first")
+        second = self.create_test_message(other_user, user, "second")
+        read_url = reverse("conversation-read-view", kwargs={'user_id': other_user.id})
+        conv_id = get_conversation_id(user.id, other_user.id)
+
+        self.client.force_authenticate(user=user)
+        response = self.client.post(read_url, {"up_to": first.id}, format="json")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['updated'] is True
+        conv = Conversation.objects.get(conversation_id=conv_id)
+        assert conv.get_last_read_message_id(user.id) == first.id
+        assert conv.get_unread_count(user.id) == 1
+
+        # Watermark never moves backwards
+        response = self.client.post(read_url, {"up_to": first.id}, format="json")
+        assert response.data['updated'] is False
+
+        response = self.client.post(read_url, {}, format="json")
+        assert response.data['updated'] is True
+        conv.refresh_from_db()
+        assert conv.get_last_read_message_id(user.id) == second.id
+        assert conv.get_unread_count(user.id) == 0
+        assert InboxEntry.objects.get(owner=user, conversation=conv).unread_count == 0
+
+    def test_read_and_list_reject_invalid_user_id(self, user):
+        self.client.force_authenticate(user=user)
+        for user_id in ("abc", 2 ** 70):
+            read_url = reverse("conversation-read-view", kwargs={'user_id': user_id})
+            response = self.client.post(read_url, {}, format="json")
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+            list_url = reverse(
+                "conversation-list-create-view", kwargs={'user_id': user_id},
+            )
+            response = self.client.get(list_url)
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_unread_count_endpoint(self, user, user_factory):
+        alice = user_factory()
+        bob = user_factory()
+        unread_url = reverse("unread-count-view")
+        self.client.force_authenticate(user=user)
+        assert self.client.get(unread_url).data == {'total_unread': 0}
+
+        first = self.create_test_message(alice, user, "first")
+        self.create_test_message(alice, user, "second")
+        messages = Message.bulk_send(bob.id, user.id, ["a", "b", "c"])
+        self.create_test_message(user, alice, "reply")
+        assert messages[-1].total_unread == 5
+        response = self.client.get(unread_url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'total_unread': 5}
+
+        # Partial read of one conversation, then the rest
+        read_url = reverse("conversation-read-view", kwargs={'user_id': alice.id})
+        self.client.post(read_url, {"up_to": first.id}, format="json")
+        assert self.client.get(unread_url).data == {'total_unread': 4}
+        self.client.post(read_url, {}, format="json")
+        assert self.client.get(unread_url).data == {'total_unread': 3}
+        assert self.client.get(unread_url).data['total_unread'] == sum(
+            InboxEntry.objects.filter(owner=user).values_list('unread_count', flat=True)
+        )
+
+    def test_message_list_without_implicit_read(self, user, user_factory, settings):
+        settings.MESSENGER_MARK_READ_ON_LIST = False
+        other_user = user_factory()
+        self.create_test_message(other_user, user)
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(conversation_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['read'] is False
+        conv = Conversation.objects.get(
+            conversation_id=get_conversation_id(user.id, other_user.id)
+        )
+        assert conv.get_unread_count(user.id) == 1
+
+    def test_conversation_list_ordering(self, user, user_factory):
+        older_peer = user_factory()
+        newer_peer = user_factory()
+        self.create_test_message(older_peer, user, "older")
+        self.create_test_message(user, newer_peer, "newer")
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.conversation_list_url)
+
+        results = response.data['results']
+        assert [r['user_id'] for r in results] == [newer_peer.id, older_peer.id]
+        assert results[0]['last_message'] == "newer"
+        assert results[0]['unread_count'] == 0
+        assert results[1]['unread_count'] == 1
+
+    def test_conversation_list_cache_unavailable(self, user, user_factory, settings):
+        """An unreachable cache degrades to Postgres for reads and writes."""
+        settings.MESSENGER_CONVERSATION_CACHE_ENABLED = True
+        settings.MESSENGER_CONVERSATION_CACHE_URL = "redis://127.0.0.1:1/0"
+        other_user = user_factory()
+        self.create_test_message(other_user, user, "cached?")
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.conversation_list_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['last_message'] == "cached?"
+
+    def test_conversation_list_cache_hit_and_updates(
+        self, user, user_factory, settings, fake_redis,
+        django_capture_on_commit_callbacks,
+    ):
+        """Sends and reads update the cached list in place (Lua scripts)."""
+        settings.MESSENGER_CONVERSATION_CACHE_ENABLED = True
+        peers = [user_factory() for _ in range(3)]
+        for i, peer in enumerate(peers):
+            with django_capture_on_commit_callbacks(execute=True):
+                self.create_test_message(peer, user, f"m{i}")
+
+        self.client.force_authenticate(user=user)
+        first = self.client.get(self.conversation_list_url)
+        assert fake_redis.zcard(f"conv:list:{user.id}") == 3
+        # Served from Redis: a change made behind the cache's back is not seen
+        Conversation.objects.update(last_message_text="changed in db")
+        cached = self.client.get(self.conversation_list_url)
+        assert cached.data == first.data
+
+        with django_capture_on_commit_callbacks(execute=True):
+            self.create_test_message(peers[0], user, "again")
+        row = self.client.get(self.conversation_list_url).data['results'][0]
+        assert (row['user_id'], row['last_message'], row['unread_count']) == (
+            peers[0].id, "again", 2,
+        )
+
+        read_url = reverse("conversation-read-view", kwargs={'user_id': peers[0].id})
+        self.client.post(read_url, {}, format='json')
+        row = self.client.get(self.conversation_list_url).data['results'][0]
+        assert row['unread_count'] == 0
+
+    def test_conversation_list_cache_evicts_oldest(
+        self, user, user_factory, settings, fake_redis,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.MESSENGER_CONVERSATION_CACHE_ENABLED = True
+        settings.MESSENGER_CONVERSATION_CACHE_SIZE = 2
+        peers = [user_factory() for _ in range(3)]
+        self.create_test_message(peers[0], user)
+        self.create_test_message(peers[1], user)
+        self.client.force_authenticate(user=user)
+        self.client.get(f"{self.conversation_list_url}?page_size=1")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            self.create_test_message(peers[0], user, "bump")
+        assert fake_redis.zrevrange(f"conv:list:{user.id}", 0, -1) == [
+            get_conversation_id(user.id, peers[0].id),
+            get_conversation_id(user.id, peers[1].id),
+        ]
+
+    def test_conversation_cache_fill_skipped_after_concurrent_write(
+        self, user, user_factory, settings, fake_redis,
+        django_capture_on_commit_callbacks,
+    ):
+        """A write between the Postgres snapshot and store_page wins."""
+        settings.MESSENGER_CONVERSATION_CACHE_ENABLED = True
+        peer = user_factory()
+        self.create_test_message(peer, user, "old")
+        version = conversation_cache.get_version(user.id)
+        stale_entries = list(InboxEntry.objects.filter(owner=user).select_related(
+            'conversation', 'peer',
+        ))
+        with django_capture_on_commit_callbacks(execute=True):
+            self.create_test_message(peer, user, "new")
+
+        rows = conversation_cache.store_page(user.id, stale_entries, version)
+        assert rows[0]['last_message'] == "old"
+        assert not fake_redis.exists(f"conv:list:{user.id}")
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.conversation_list_url)
+        assert response.data['results'][0]['last_message'] == "new"
+
+    def test_message_list_keyset_with_shared_timestamps(self, user, user_factory):
+        """Rows sharing a timestamp are neither skipped nor repeated."""
+        other_user = user_factory()
+        messages = Message.bulk_send(user.id, other_user.id, [f"m{i}" for i in range(12)])
+        Message.objects.update(timestamp=messages[0].timestamp)
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        seen = []
+        url = f"{conversation_url}?page_size=5"
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            seen.extend(m['id'] for m in response.data['results'])
+            url = response.data['next']
+        assert seen == sorted((m.id for m in messages), reverse=True)
+
+        # Walking back from the last page returns the previous page unchanged
+        response = self.client.get(f"{conversation_url}?page_size=5")
+        second = self.client.get(response.data['next'])
+        back = self.client.get(second.data['previous'])
+        assert [m['id'] for m in back.data['results']] == seen[:5]
+        assert back.data['previous'] is None
+
+    def test_message_list_invalid_cursor(self, user, user_factory):
+        other_user = user_factory()
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{conversation_url}?cursor=cD1ub3QtYS1kYXRl")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_message_list_around(self, user, user_factory):
+        other_user = user_factory()
+        messages = Message.bulk_send(user.id, other_user.id, [f"m{i}" for i in range(20)])
+        ids = [m.id for m in messages]
+        anchor = ids[10]
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{conversation_url}?around={anchor}&page_size=6")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [m['id'] for m in response.data['results']] == ids[7:14][::-1][:6]
+        older = self.client.get(response.data['next'])
+        assert [m['id'] for m in older.data['results']] == ids[1:8][::-1][:6]
+        newer = self.client.get(response.data['previous'])
+        assert [m['id'] for m in newer.data['results']] == ids[14:20][::-1]
+
+    def test_message_list_after(self, user, user_factory):
+        other_user = user_factory()
+        messages = Message.bulk_send(user.id, other_user.id, [f"m{i}" for i in range(8)])
+        ids = [m.id for m in messages]
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{conversation_url}?after={ids[2]}&page_size=3")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [m['id'] for m in response.data['results']] == ids[3:6]
+        assert response.data['previous'] is None
+        response = self.client.get(response.data['next'])
+        assert [m['id'] for m in response.data['results']] == ids[6:8]
+        assert response.data['next'] is None
+
+    def test_message_list_seq_range(self, user, user_factory):
+        other_user = user_factory()
+        messages = Message.bulk_send(user.id, other_user.id, [f"m{i}" for i in range(10)])
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{conversation_url}?seq_from=3&seq_to=8&page_size=4")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [m['seq'] for m in response.data['results']] == [3, 4, 5, 6]
+        assert response.data['results'][0]['id'] == messages[2].id
+        response = self.client.get(response.data['next'])
+        assert [m['seq'] for m in response.data['results']] == [7, 8]
+        assert response.data['next'] is None
+        response = self.client.get(f"{conversation_url}?seq_from=x")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_message_list_anchor_outside_conversation(self, user, user_factory):
+        other_user = user_factory()
+        stranger_message = self.create_test_message(user_factory(), user_factory())
+        conversation_url = reverse("conversation-list-create-view", kwargs={'user_id': other_user.id})
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{conversation_url}?around={stranger_message.id}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = self.client.get(f"{conversation_url}?after=abc")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_sync_returns_changes_since_token(self, user, user_factory, settings):
+        settings.MESSENGER_SYNC_SETTLE_SECONDS = 0
+        other_user = user_factory()
+        sync_url = reverse("sync-view")
+        self.create_test_message(user, other_user, "before")
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(sync_url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['messages'] == []
+        token = response.data['token']
+
+        incoming = self.create_test_message(other_user, user, "after")
+        response = self.client.get(f"{sync_url}?since={token}")
+        assert response.status_code == status.HTTP_200_OK
+        assert [m['id'] for m in response.data['messages']] == [incoming.id]
+        assert [c['user_id'] for c in response.data['conversations']] == [other_user.id]
+        assert response.data['conversations'][0]['unread_count'] == 1
+        assert response.data['has_more'] is False
+        token = response.data['token']
+
+        # The peer reading our message only moves their watermark
+        self.client.force_authenticate(user=other_user)
+        read_url = reverse("conversation-read-view", kwargs={'user_id': user.id})
+        self.client.post(read_url, {}, format='json')
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{sync_url}?since={token}")
+        assert response.data['messages'] == []
+        conversation = response.data['conversations'][0]
+        assert conversation['peer_last_read_message_id'] == incoming.id - 1
+        assert conversation['unread_count'] == 1
+
+        response = self.client.get(f"{sync_url}?since={response.data['token']}")
+        assert response.data['messages'] == []
+        assert response.data['conversations'] == []
+
+    def test_sync_has_more(self, user, user_factory, settings):
+        settings.MESSENGER_SYNC_MAX_ITEMS = 2
+        settings.MESSENGER_SYNC_SETTLE_SECONDS = 0
+        other_user = user_factory()
+        sync_url = reverse("sync-view")
+        self.client.force_authenticate(user=user)
+        token = self.client.get(sync_url).data['token']
+        messages = Message.bulk_send(other_user.id, user.id, ["a", "b", "c"])
+
+        response = self.client.get(f"{sync_url}?since={token}")
+        assert [m['id'] for m in response.data['messages']] == [m.id for m in messages[:2]]
+        assert response.data['has_more'] is True
+        response = self.client.get(f"{sync_url}?since={response.data['token']}")
+        assert [m['id'] for m in response.data['messages']] == [messages[2].id]
+        assert response.data['has_more'] is False
+
+    def test_sync_resends_unsettled_changes(self, user, user_factory, settings):
+        settings.MESSENGER_SYNC_SETTLE_SECONDS = 60
+        other_user = user_factory()
+        sync_url = reverse("sync-view")
+        self.client.force_authenticate(user=user)
+        token = self.client.get(sync_url).data['token']
+        message = self.create_test_message(other_user, user, "recent")
+
+        # Still inside the settle window: returned, but the token stays put
+        for _ in range(2):
+            response = self.client.get(f"{sync_url}?since={token}")
+            assert [m['id'] for m in response.data['messages']] == [message.id]
+            assert len(response.data['conversations']) == 1
+            token = response.data['token']
+
+        settled = timezone.now() - timedelta(seconds=120)
+        Message.objects.filter(id=message.id).update(timestamp=settled)
+        InboxEntry.objects.filter(owner=user).update(updated_at=settled)
+        response = self.client.get(f"{sync_url}?since={token}")
+        assert [m['id'] for m in response.data['messages']] == [message.id]
+        response = self.client.get(f"{sync_url}?since={response.data['token']}")
+        assert response.data['messages'] == []
+        assert response.data['conversations'] == []
+
+    def test_sync_entries_with_same_updated_at(self, user, user_factory, settings):
+        settings.MESSENGER_SYNC_MAX_ITEMS = 1
+        settings.MESSENGER_SYNC_SETTLE_SECONDS = 0
+        sync_url = reverse("sync-view")
+        self.client.force_authenticate(user=user)
+        token = self.client.get(sync_url).data['token']
+        for peer in user_factory.create_batch(2):
+            self.create_test_message(peer, user, "hi")
+        entries = InboxEntry.objects.filter(owner=user)
+        entries.update(updated_at=entries.earliest('updated_at').updated_at)
+
+        seen = []
+        for _ in range(4):
+            response = self.client.get(f"{sync_url}?since={token}")
+            seen += [c['user_id'] for c in response.data['conversations']]
+            token = response.data['token']
+        assert len(seen) == len(set(seen)) == 2
+
+    def test_sync_invalid_token(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{reverse('sync-view')}?since=not-a-token")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_message_search_scoped_to_user(self, user, user_factory):
+        peer, stranger = user_factory.create_batch(2)
+        sent = self.create_test_message(user, peer, "Lunch tomorrow?")
+        received = self.create_test_message(peer, user, "Sure, lunch at noon")
+        self.create_test_message(peer, user, "See you")
+        self.create_test_message(peer, stranger, "lunch without you")
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get(f"{reverse('message-search-view')}?q=lunch")
+        assert response.status_code == status.HTTP_200_OK
+        assert {m['id'] for m in response.data['results']} == {sent.id, received.id}
+
+    def test_message_search_pagination(self, user, user_factory):
+        peer = user_factory()
+        for index in range(5):
+            self.create_test_message(peer, user, f"meeting notes {index}")
+        self.client.force_authenticate(user=user)
+
+        seen = []
+        url = f"{reverse('message-search-view')}?q=meeting&page_size=2"
+        while url:
+            response = self.client.get(url)
+            seen += [m['id'] for m in response.data['results']]
+            url = response.data['next']
+        assert len(seen) == len(set(seen)) == 5
+
+    def test_message_search_partial_term(self, user, user_factory):
+        peer = user_factory()
+        message = self.create_test_message(peer, user, "Congratulations!")
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(f"{reverse('message-search-view')}?q=congr")
+        assert [m['id'] for m in response.data['results']] == [message.id]
+
+    def test_message_search_requires_query(self, user):
+        self.client.force_authenticate(user=user)
+        url = reverse('message-search-view')
+        assert self.client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+        response = self.client.get(f"{url}?q=hi&mode=regex")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Full-text search is Postgres only",
+    )
+    def test_message_search_ranks_full_text_matches(self, user, user_factory):
+        peer = user_factory()
+        passing = self.create_test_message(peer, user, "the budget is on the agenda")
+        focused = self.create_test_message(user, peer, "budget review: budget cuts")
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(
+            f"{reverse('message-search-view')}?q=budget&page_size=1"
+        )
+        assert [m['id'] for m in response.data['results']] == [focused.id]
+        assert "mode=fts" in response.data['next']
+        response = self.client.get(response.data['next'])
+        assert [m['id'] for m in response.data['results']] == [passing.id]
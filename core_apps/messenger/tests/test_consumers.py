@@ -179,6 +179,27 @@ class TestMessageConsumer:
         finally:
             await self.teardown_communicator(communicator)
 
+    @pytest.mark.django_db(transaction=True)
+    async def test_unread_count_broadcast(self, user):
+        """Test pushing the unread badge total"""
+        connected, communicator = await self.setup_communicator(user=user)
+        try:
+            assert connected
+
+            channel_layer = get_channel_layer()
+            await channel_layer.group_send(
+                f"user_{user.id}",
+                {"type": "unread_count", "message": {"total_unread": 3}}
+            )
+
+            response = await communicator.receive_json_from()
+            if response["type"] == "ping":
+                response = await communicator.receive_json_from()
+            assert response["type"] == "unread_count"
+            assert response["message"]["total_unread"] == 3
+        finally:
+            await self.teardown_communicator(communicator)
+
     @pytest.mark.django_db(transaction=True)
     async def test_multiple_connections_same_user(self, user):
         """Test handling multiple connections for the same user"""
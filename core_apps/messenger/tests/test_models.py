@@ -1,8 +1,44 @@
+import json
+import time
+
 import pytest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from core_apps.messenger.models import Message, Conversation
-from core_apps.messenger.utils.conversations import get_conversation_id
+from core_apps.messenger.models import (
+    Message, Conversation, InboxEntry, MessageArchive, OutboxEvent, UnreadCounter,
+)
+from core_apps.messenger.checks import check_message_id_generator
+from core_apps.messenger.utils import dispatch, outbox, snowflake
+from core_apps.messenger.utils.breaker import CircuitBreaker
+from core_apps.messenger.utils.snowflake import (
+    MAX_SEQUENCE,
+    MAX_WORKER_ID,
+    SnowflakeGenerator,
+    WorkerLease,
+    parse_snowflake,
+)
+from core_apps.messenger.utils.partitions import (
+    add_months,
+    detach_partition,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    partition_name,
+)
+from core_apps.messenger.utils.conversations import (
+    get_conversation_id,
+    get_conversation_key,
+    split_conversation_key,
+)
 
 User = get_user_model()
 
@@ -74,7 +110,43 @@ def test_message_database_indexes(db):
     indexes = {idx.name: idx for idx in Message._meta.indexes}
     assert "conversation_timestamp_idx" in indexes
     conv_idx = indexes["conversation_timestamp_idx"]
-    assert conv_idx.fields == ["conversation_id", "-timestamp"]
+    assert conv_idx.fields == ["conversation_id", "-timestamp", "-id"]
+    key_idx = indexes["conversation_key_timestamp_idx"]
+    assert key_idx.fields == ["conversation_key", "-timestamp", "-id"]
+
+
+def test_message_conversation_key(db, user_factory, settings):
+    sender = user_factory()
+    receiver = user_factory()
+    msg = Message.objects.create(sender=sender, receiver=receiver, message="hi")
+    batch = Message.bulk_send(receiver.id, sender.id, ["a", "b"])
+
+    low, high = sorted((sender.id, receiver.id))
+    assert msg.conversation_key == (low << 32) | high
+    assert split_conversation_key(msg.conversation_key) == (low, high)
+    assert {m.conversation_key for m in batch} == {msg.conversation_key}
+
+    settings.MESSENGER_READ_CONVERSATION_KEY = False
+    by_id = list(Message.objects.for_conversation(sender.id, receiver.id))
+    settings.MESSENGER_READ_CONVERSATION_KEY = True
+    by_key = list(Message.objects.for_conversation(receiver.id, sender.id))
+    assert by_id == by_key
+    assert len(by_key) == 3
+
+
+def test_conversation_key_rejects_wide_ids():
+    with pytest.raises(ValueError):
+        get_conversation_key(1, 1 << 31)
+
+
+def test_wide_user_ids_fall_back_to_conversation_id(db, user_factory, settings):
+    settings.MESSENGER_READ_CONVERSATION_KEY = True
+    sender = user_factory()
+    receiver = user_factory(id=1 << 31)
+    msg = Message.objects.create(sender=sender, receiver=receiver, message="hi")
+
+    assert msg.conversation_key is None
+    assert list(Message.objects.for_conversation(sender.id, receiver.id)) == [msg]
 
 
 def test_message_model_meta_options(db):
@@ -148,4 +220,604 @@ def test_conversation_str(db, user_factory):
     conv = Conversation.objects.get(
         conversation_id=get_conversation_id(sender.id, receiver.id)
     )
-    assert str(conv) == conv.conversation_id
\ No newline at end of file
+    assert str(conv) == conv.conversation_id
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql",
+    reason="Single-statement upsert uses a data-modifying CTE (Postgres only)",
+)
+def test_conversation_upsert_statement(db, user_factory):
+    """The Postgres upsert reserves ids and seqs before the messages exist."""
+    sender = user_factory()
+    receiver = user_factory()
+    msg1 = Message(sender=sender, receiver=receiver, message="m1")
+    msg2 = Message(sender=sender, receiver=receiver, message="m2")
+    for msg in (msg1, msg2):
+        msg.conversation_id = get_conversation_id(sender.id, receiver.id)
+
+    p1_id, p2_id = min(sender.id, receiver.id), max(sender.id, receiver.id)
+    unread_field = "unread_count_p1" if receiver.id == p1_id else "unread_count_p2"
+    with transaction.atomic():
+        msg1._upsert_conversation(p1_id, p2_id, unread_field, [msg1])
+        msg2._upsert_conversation(p1_id, p2_id, unread_field, [msg2])
+        assert msg1.pk < msg2.pk
+        assert not Message.objects.exists()
+        Message.objects.bulk_create([msg1, msg2])
+
+    conv = Conversation.objects.get(conversation_id=msg1.conversation_id)
+    assert conv.last_message_id == msg2.id
+    assert conv.last_message_text == "m2"
+    assert conv.get_unread_count(receiver.id) == 2
+    assert conv.get_unread_count(sender.id) == 0
+    assert conv.last_seq == 2
+    assert list(Message.objects.order_by("seq").values_list("id", "seq")) == [
+        (msg1.id, 1), (msg2.id, 2),
+    ]
+    receiver_entry = InboxEntry.objects.get(owner=receiver, conversation=conv)
+    assert receiver_entry.unread_count == 2
+    assert receiver_entry.last_activity == msg2.timestamp
+    assert InboxEntry.objects.get(owner=sender, conversation=conv).unread_count == 0
+
+
+def test_message_seq_is_per_conversation(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    msg1 = Message.objects.create(sender=sender, receiver=receiver, message="m1")
+    reply = Message.objects.create(sender=receiver, receiver=sender, message="m2")
+    other = Message.objects.create(sender=sender, receiver=user_factory(), message="x")
+    batch = Message.bulk_send(sender.id, receiver.id, ["b1", "b2", "b3"])
+
+    assert (msg1.seq, reply.seq) == (1, 2)
+    assert other.seq == 1
+    assert [m.seq for m in batch] == [3, 4, 5]
+    assert list(
+        Message.objects.filter(conversation_id=msg1.conversation_id)
+        .order_by("seq").values_list("seq", flat=True)
+    ) == [1, 2, 3, 4, 5]
+    conv = Conversation.objects.get(conversation_id=msg1.conversation_id)
+    assert conv.last_seq == 5
+
+
+def test_send_writes_each_message_row_once(db, user_factory):
+    """seq is reserved before the INSERT; the message row is never updated."""
+    sender = user_factory()
+    receiver = user_factory()
+    Message.objects.create(sender=sender, receiver=receiver, message="m1")
+    update = f'UPDATE "{Message._meta.db_table}"'
+    with CaptureQueriesContext(connection) as queries:
+        msg = Message.objects.create(sender=sender, receiver=receiver, message="m2")
+        Message.bulk_send(sender.id, receiver.id, ["b1", "b2"])
+    assert not [q for q in queries.captured_queries if q["sql"].startswith(update)]
+    assert msg.seq == 2
+    assert list(
+        Message.objects.order_by("seq").values_list("seq", flat=True)
+    ) == [1, 2, 3, 4]
+
+
+def test_backfill_messages_numbers_legacy_conversations(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    messages = Message.bulk_send(sender.id, receiver.id, ["a", "b", "c"])
+    # State right after migrating: nothing numbered yet
+    Message.objects.update(seq=None)
+    Conversation.objects.update(last_seq=None)
+
+    new = Message.objects.create(sender=receiver, receiver=sender, message="d")
+    assert new.seq is None
+
+    Message.objects.filter(id=messages[0].id).update(conversation_key=None)
+
+    call_command("backfill_messages", "--batch-size", "2", stdout=StringIO())
+    assert not Message.objects.filter(conversation_key__isnull=True).exists()
+    assert list(
+        Message.objects.order_by("seq").values_list("id", flat=True)
+    ) == [m.id for m in messages] + [new.id]
+    conv = Conversation.objects.get()
+    assert conv.last_seq == 4
+    assert Message.objects.create(sender=sender, receiver=receiver, message="e").seq == 5
+
+
+# ── Message id generator tests ──────────────────────────────────
+
+def test_snowflake_ids_are_time_ordered():
+    now = [1_760_000_000.0]
+    generate = SnowflakeGenerator(worker_id=7, clock=lambda: now[0])
+    first_tick = [generate() for _ in range(MAX_SEQUENCE + 1)]
+    assert first_tick == sorted(set(first_tick))
+    assert parse_snowflake(first_tick[0]) == (1_760_000_000_000, 7, 0)
+    assert parse_snowflake(first_tick[-1])[2] == MAX_SEQUENCE
+
+    now[0] += 5
+    later = generate()
+    assert parse_snowflake(later) == (1_760_000_005_000, 7, 0)
+    assert later < 2 ** 53
+
+    now[0] -= 1  # clock stepped back: keep issuing from the last tick
+    assert generate() == later + 1
+
+
+def test_snowflake_rejects_out_of_range_worker():
+    with pytest.raises(ValueError):
+        SnowflakeGenerator(worker_id=512)
+
+
+def test_worker_leases_are_exclusive(fake_redis):
+    leases = [WorkerLease(fake_redis, ttl_seconds=60) for _ in range(20)]
+    worker_ids = [lease.ensure() for lease in leases]
+    assert len(set(worker_ids)) == len(worker_ids)
+    assert all(0 <= worker_id <= MAX_WORKER_ID for worker_id in worker_ids)
+
+
+def test_worker_lease_lost_is_replaced(fake_redis):
+    lease = WorkerLease(fake_redis, ttl_seconds=60)
+    first = lease.ensure()
+    # Idle past the TTL and the id went to another process
+    fake_redis.set(f"{WorkerLease.key_prefix}:{first}", "someone-else")
+    lease._renewed_at -= 60
+    assert lease.ensure() != first
+    assert fake_redis.get(f"{WorkerLease.key_prefix}:{lease.worker_id}") == lease.owner
+
+
+def test_message_ids_from_configured_generator(
+    db, user_factory, settings, fake_redis, monkeypatch,
+):
+    monkeypatch.setattr(snowflake, "_generator_pid", None)  # fresh lease
+    settings.MESSENGER_MESSAGE_ID_GENERATOR = (
+        "core_apps.messenger.utils.snowflake.next_id"
+    )
+    sender = user_factory()
+    receiver = user_factory()
+    msg = Message.objects.create(sender=sender, receiver=receiver, message="m1")
+    batch = Message.bulk_send(sender.id, receiver.id, ["m2", "m3"])
+
+    ids = [msg.id] + [m.id for m in batch]
+    assert ids == sorted(ids)
+    assert len({parse_snowflake(i)[1] for i in ids}) == 1
+    assert list(Message.objects.order_by("id").values_list("id", flat=True)) == ids
+    assert [m.seq for m in batch] == [2, 3]
+    conv = Conversation.objects.get(conversation_id=msg.conversation_id)
+    assert conv.last_message_id == batch[-1].id
+
+    # Switching the generator off afterwards is reported by the system check
+    settings.MESSENGER_MESSAGE_ID_GENERATOR = ""
+    errors = check_message_id_generator(None, databases=["default"])
+    assert [error.id for error in errors] == ["messenger.E001"]
+
+
+# ── Partitioning tests ──────────────────────────────────────────
+
+def test_partition_month_helpers():
+    start = month_start(datetime(2026, 11, 30, 23, 59, tzinfo=dt_timezone.utc))
+    assert start == datetime(2026, 11, 1, tzinfo=dt_timezone.utc)
+    assert add_months(start, 2) == datetime(2027, 1, 1, tzinfo=dt_timezone.utc)
+    assert add_months(start, -11) == datetime(2025, 12, 1, tzinfo=dt_timezone.utc)
+    assert partition_name("messenger_message", start) == "messenger_message_p202611"
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Range partitioning is Postgres only",
+)
+def test_message_table_is_partitioned(db, user_factory):
+    table = Message._meta.db_table
+    assert is_partitioned(connection, table)
+    partitions = list_partitions(connection, table)
+    assert partitions[0][0] == f"{table}_legacy"
+    assert partitions[0][1] is None
+    # Contiguous, and ready for the months ahead
+    assert all(
+        previous[2] == current[1]
+        for previous, current in zip(partitions, partitions[1:])
+    )
+    assert partitions[-1][2] > timezone.now() + timedelta(days=60)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE relname = 'conversation_timestamp_idx'"
+        )
+        assert cursor.fetchone() == ("I",)  # partitioned index
+
+    msg = Message.objects.create(
+        sender=user_factory(), receiver=user_factory(), message="hi",
+    )
+    Message.objects.filter(pk=msg.pk).update(timestamp=partitions[-1][1])
+    assert Message.objects.get(pk=msg.pk).timestamp == partitions[-1][1]
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Range partitioning is Postgres only",
+)
+def test_message_partitions_command(transactional_db):
+    table = Message._meta.db_table
+    existing = list_partitions(connection, table)
+    last = existing[-1]
+    out = StringIO()
+    call_command("message_partitions", "--ahead", "6", stdout=out)
+    assert f"Created {partition_name(table, last[2])}" in out.getvalue()
+    assert list_partitions(connection, table)[-1][2] >= add_months(
+        month_start(timezone.now()), 7,
+    )
+
+    # The legacy partition ends in the future, so nothing can be detached yet
+    out = StringIO()
+    call_command("message_partitions", "--detach-before", "2020-01", stdout=out)
+    assert "Detached" not in out.getvalue()
+    for name, _, _ in list_partitions(connection, table)[len(existing):]:
+        detach_partition(connection, table, name, drop=True)
+
+
+# ── Archive tests ───────────────────────────────────────────────
+
+def test_message_archive_round_trip(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    messages = Message.bulk_send(sender.id, receiver.id, ["a", "b" * 2048, "c"])
+    archive = MessageArchive.from_messages(messages)
+    archive.save()
+    assert len(archive.payload) < 2048
+
+    restored = MessageArchive.objects.get().get_messages()
+    fields = [
+        "id", "sender_id", "receiver_id", "message", "timestamp", "seq",
+        "conversation_id", "conversation_key",
+    ]
+    assert [[getattr(m, f) for f in fields] for m in restored] == [
+        [getattr(m, f) for f in fields] for m in messages
+    ]
+
+
+# ── InboxEntry model tests ──────────────────────────────────────
+
+def test_inbox_entries_follow_messages(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    Message.objects.create(sender=sender, receiver=receiver, message="m1")
+    msg2 = Message.objects.create(sender=sender, receiver=receiver, message="m2")
+
+    conv = Conversation.objects.get(
+        conversation_id=get_conversation_id(sender.id, receiver.id)
+    )
+    sender_entry = InboxEntry.objects.get(owner=sender, conversation=conv)
+    receiver_entry = InboxEntry.objects.get(owner=receiver, conversation=conv)
+    assert sender_entry.peer_id == receiver.id
+    assert sender_entry.unread_count == 0
+    assert receiver_entry.peer_id == sender.id
+    assert receiver_entry.unread_count == 2
+    assert receiver_entry.last_activity == msg2.timestamp
+
+
+def test_inbox_database_indexes(db):
+    indexes = {idx.name: idx for idx in InboxEntry._meta.indexes}
+    assert indexes["inbox_owner_latest_idx"].fields == ["owner", "-last_activity", "-id"]
+
+
+# ── Outbox tests ────────────────────────────────────────────────
+
+class FlakyChannelLayer:
+    """Records group_send calls; fails for the groups in ``failing``."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def group_send(self, group, message):
+        if group in self.failing:
+            raise ConnectionError("channel layer unavailable")
+        self.sent.append((group, message))
+
+
+def test_message_events_written_in_transaction(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            Message.objects.create(sender=sender, receiver=receiver, message="gone")
+            raise RuntimeError
+    assert not OutboxEvent.objects.exists()
+
+    msg = Message.objects.create(sender=sender, receiver=receiver, message="kept")
+    event = OutboxEvent.objects.get()
+    assert event.group == f"user_{receiver.id}"
+    assert event.payload["type"] == "new_message"
+    assert event.payload["message"]["id"] == msg.id
+    assert event.payload["message"]["seq"] == 1
+    assert event.payload["total_unread"] == 1
+
+
+def test_relay_events_publishes_in_order(db, user_factory):
+    sender = user_factory()
+    receiver = user_factory()
+    for text in ("one", "two", "three"):
+        Message.objects.create(sender=sender, receiver=receiver, message=text)
+    channel_layer = get_channel_layer()
+    channel = async_to_sync(channel_layer.new_channel)()
+    async_to_sync(channel_layer.group_add)(f"user_{receiver.id}", channel)
+
+    call_command("relay_events", "--once", "--batch-size", "2")
+
+    assert not OutboxEvent.objects.exists()
+    received = [
+        async_to_sync(channel_layer.receive)(channel)["message"]["message"]
+        for _ in range(3)
+    ]
+    assert received == ["one", "two", "three"]
+
+
+def test_relay_keeps_events_of_failed_groups(db, user_factory):
+    sender = user_factory()
+    online = user_factory()
+    offline = user_factory()
+    Message.objects.create(sender=sender, receiver=offline, message="retry me")
+    Message.objects.create(sender=sender, receiver=online, message="hello")
+    channel_layer = FlakyChannelLayer(failing={f"user_{offline.id}"})
+
+    assert outbox.relay_batch(channel_layer, 10)[:2] == (1, 1)
+    assert [group for group, _ in channel_layer.sent] == [f"user_{online.id}"]
+    assert OutboxEvent.objects.get().group == f"user_{offline.id}"
+
+    # Delivered once the channel layer recovers
+    channel_layer.failing.clear()
+    assert outbox.relay_batch(channel_layer, 10)[:2] == (1, 0)
+    assert not OutboxEvent.objects.exists()
+    assert outbox.get_stats() == {"pending": 0, "lag_seconds": 0.0}
+
+
+def test_outbox_stats_cap_pending_count(db, settings):
+    settings.OUTBOX_STATS_PENDING_CAP = 2
+    OutboxEvent.objects.bulk_create(
+        OutboxEvent(group=f"user_{i}", payload={}) for i in range(3)
+    )
+    assert outbox.get_stats()["pending"] == 2
+
+
+def test_relay_events_writes_heartbeat(db, settings, fake_redis, monkeypatch):
+    monkeypatch.setenv("POD_NAME", "relay-1")
+    fake_redis.hset(
+        outbox.HEARTBEATS_KEY, "relay-0",
+        json.dumps({"state": "open", "at": time.time() - 60}),
+    )
+
+    call_command("relay_events", "--once")
+
+    # The stopped relay's heartbeat expired and is dropped
+    relays = outbox.get_heartbeats()
+    assert list(relays) == ["relay-1"]
+    assert relays["relay-1"]["state"] == "closed"
+    assert fake_redis.hkeys(outbox.HEARTBEATS_KEY) == ["relay-1"]
+
+
+def test_dispatcher_publishes_in_batches():
+    channel_layer = FlakyChannelLayer(failing={"user_2"})
+    dispatcher = dispatch.EventDispatcher(
+        maxsize=10, batch_size=2, channel_layer=channel_layer,
+    )
+    for n in range(3):
+        dispatcher.put("user_1", {"type": "new_message", "n": n})
+    dispatcher.put("user_2", {"type": "new_message", "n": 3})
+    dispatcher.close()
+
+    assert [message["n"] for _, message in channel_layer.sent] == [0, 1, 2]
+    stats = dispatcher.get_stats()
+    assert stats["queued"] == 4
+    assert stats["published"] == 3
+    assert stats["failed"] == 1
+    assert stats["dropped"] == 0
+    assert stats["depth"] == 0
+
+
+@pytest.mark.parametrize("overflow, kept", [
+    ("drop_newest", [0, 1]),
+    ("drop_oldest", [1, 2]),
+    ("block", [0, 1]),
+])
+def test_dispatcher_overflow_policy(monkeypatch, overflow, kept):
+    dispatcher = dispatch.EventDispatcher(
+        maxsize=2, batch_size=10, overflow=overflow, block_timeout=0.01,
+        channel_layer=FlakyChannelLayer(),
+    )
+    # Fill the queue without a thread draining it
+    monkeypatch.setattr(dispatcher, "_ensure_started", lambda: None)
+    results = [dispatcher.put("user_1", {"n": n}) for n in range(3)]
+
+    assert results == [True, True, overflow == "drop_oldest"]
+    assert dispatcher.get_stats()["dropped"] == 1
+    assert dispatcher.get_stats()["max_depth"] == 2
+    batch, stopping = dispatcher._next_batch()
+    assert [event.payload["n"] for event in batch] == kept
+    assert not stopping
+
+    with pytest.raises(ValueError):
+        dispatch.EventDispatcher(maxsize=2, batch_size=10, overflow="spill")
+
+
+def test_queue_dispatch_sends_after_commit(
+    db, user_factory, settings, monkeypatch, django_capture_on_commit_callbacks,
+):
+    settings.EVENT_DISPATCH = "queue"
+    channel_layer = FlakyChannelLayer()
+    dispatcher = dispatch.EventDispatcher(
+        maxsize=10, batch_size=10, channel_layer=channel_layer,
+    )
+    monkeypatch.setattr(dispatch, "get_dispatcher", lambda: dispatcher)
+    sender = user_factory()
+    receiver = user_factory()
+
+    with pytest.raises(RuntimeError):
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                Message.objects.create(
+                    sender=sender, receiver=receiver, message="gone",
+                )
+                raise RuntimeError
+    with django_capture_on_commit_callbacks(execute=True):
+        msg = Message.objects.create(sender=sender, receiver=receiver, message="kept")
+    dispatcher.close()
+
+    assert not OutboxEvent.objects.exists()
+    assert [
+        (group, message["message"]["id"]) for group, message in channel_layer.sent
+    ] == [(f"user_{receiver.id}", msg.id)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker_trips_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "test", failure_threshold=2, latency_threshold=0.5, reset_timeout=10,
+        clock=clock,
+    )
+    breaker.record_failure()
+    breaker.record_success(0.01)
+    breaker.record_failure()
+    assert breaker.allow()
+
+    # A slow publish counts as a failure
+    breaker.record_success(1.0)
+    assert not breaker.allow()
+    assert breaker.get_stats() == {
+        "state": "open", "consecutive_failures": 2, "trips": 1, "retry_in": 10.0,
+    }
+
+    # The probe after the reset timeout fails: open again
+    clock.now = 10.0
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.trips == 2
+
+    # A good probe closes it
+    clock.now = 20.0
+    assert breaker.allow()
+    breaker.record_success(0.01)
+    assert breaker.get_stats() == {
+        "state": "closed", "consecutive_failures": 0, "trips": 2, "retry_in": 0.0,
+    }
+
+
+def test_relay_holds_events_while_breaker_open(db, user_factory):
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "test", failure_threshold=1, latency_threshold=0.5, reset_timeout=10,
+        clock=clock,
+    )
+    receiver = user_factory()
+    Message.objects.create(sender=user_factory(), receiver=receiver, message="hi")
+    channel_layer = FlakyChannelLayer(failing={f"user_{receiver.id}"})
+
+    assert outbox.relay_batch(channel_layer, 10, breaker)[:2] == (0, 1)
+    assert breaker.state == "open"
+
+    # Skipped without touching the channel layer until the probe is due
+    channel_layer.failing.clear()
+    assert outbox.relay_batch(channel_layer, 10, breaker)[:2] == (0, 0)
+    assert channel_layer.sent == []
+    assert OutboxEvent.objects.exists()
+
+    clock.now = 10.0
+    assert outbox.relay_batch(channel_layer, 10, breaker)[:2] == (1, 0)
+    assert breaker.state == "closed"
+    assert not OutboxEvent.objects.exists()
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Relay lock is Postgres only",
+)
+@pytest.mark.django_db(transaction=True)
+def test_relay_waits_for_the_relay_lock(user_factory, run_in_thread):
+    receiver = user_factory()
+    Message.objects.create(sender=user_factory(), receiver=receiver, message="hi")
+    channel_layer = FlakyChannelLayer()
+    relayed = {}
+
+    def relay():
+        relayed["result"] = outbox.relay_batch(channel_layer, 10)
+
+    with transaction.atomic():
+        # Another relay is publishing a batch
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [outbox.RELAY_LOCK_ID])
+        run_in_thread(relay)()
+
+    assert relayed["result"] == (0, 0, 0.0)
+    assert channel_layer.sent == []
+    assert outbox.relay_batch(channel_layer, 10)[:2] == (1, 0)
+    assert not OutboxEvent.objects.exists()
+
+
+def test_unread_counter_lock_creates_missing_rows(db, user_factory):
+    first, second = user_factory(), user_factory()
+    UnreadCounter.objects.create(user=second, total=3)
+    with transaction.atomic():
+        UnreadCounter.lock(second.id, first.id)
+    assert dict(UnreadCounter.objects.values_list("user_id", "total")) == {
+        first.id: 0, second.id: 3,
+    }
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Single-statement send is Postgres only",
+)
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("sender_is_p1", [True, False])
+def test_message_send_locks_unread_counters_in_user_order(
+    user_factory, run_in_thread, wait_for_lock_wait, sender_is_p1,
+):
+    p1, p2 = sorted([user_factory(), user_factory()], key=lambda user: user.id)
+    sender, receiver = (p1, p2) if sender_is_p1 else (p2, p1)
+    # Unreads for the sender to clear, so both counters change
+    Message.objects.create(sender=receiver, receiver=sender, message="hi")
+    UnreadCounter.objects.get_or_create(user=receiver)
+
+    with transaction.atomic():
+        UnreadCounter.objects.select_for_update().get(user=p1)
+        join = run_in_thread(lambda: Message.send(sender.id, receiver.id, ["reply"]))
+        wait_for_lock_wait()
+        # The send waits for the lower id's counter without holding the other
+        UnreadCounter.objects.select_for_update(nowait=True).get(user=p2)
+    join()
+
+    assert UnreadCounter.get_total(sender.id) == 0
+    assert UnreadCounter.get_total(receiver.id) == 1
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Single-statement send is Postgres only",
+)
+@pytest.mark.django_db(transaction=True)
+def test_message_send_defers_read_after_concurrent_reply(
+    user_factory, run_in_thread, wait_for_lock_wait,
+):
+    sender, receiver = user_factory(), user_factory()
+    Message.objects.create(sender=receiver, receiver=sender, message="first")
+    sent = {}
+
+    def send():
+        sent["messages"], sent["read"] = Message.send(
+            sender.id, receiver.id, ["reply"],
+        )
+
+    with transaction.atomic():
+        # The receiver's next message commits while the send waits for the
+        # Conversation row, after its snapshot was taken
+        Message.send(receiver.id, sender.id, ["second"])
+        join = run_in_thread(send)
+        wait_for_lock_wait()
+    join()
+
+    # Nothing marked read from the stale snapshot: "second" must stay unread
+    assert sent["read"] is Message.READ_DEFERRED
+    conv = Conversation.objects.get(
+        conversation_id=get_conversation_id(sender.id, receiver.id),
+    )
+    assert conv.get_unread_count(sender.id) == 2
+    assert conv.get_last_read_message_id(sender.id) is None
+    assert InboxEntry.objects.get(owner=sender, conversation=conv).unread_count == 2
+    assert UnreadCounter.get_total(sender.id) == 2
+    assert UnreadCounter.get_total(receiver.id) == 1
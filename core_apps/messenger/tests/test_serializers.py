@@ -1,14 +1,28 @@
+import io
+import logging
+import uuid
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+
 import pytest
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from django.utils.translation import gettext_lazy
 from django.test import RequestFactory
 from django.db.utils import IntegrityError
 
 from core_apps.messenger.serializers import (
     MessageCreateSerializer,
     MessageDetailSerializer,
-    ConversationSerializer
+    InboxEntrySerializer,
+    MESSAGE_ROW_FIELDS,
+    message_row_serializer,
 )
-from core_apps.messenger.models import Message, Conversation
+from core_apps.messenger.models import Message, InboxEntry, MessageArchive
 from core_apps.messenger.utils.conversations import get_conversation_id
+from light_messages.logging_utils import JsonFormatter
+from light_messages.parsers import ORJSONParser
+from light_messages.renderers import ORJSONRenderer
 
 
 @pytest.mark.django_db
@@ -77,6 +91,15 @@ class TestMessageDetailSerializer:
         assert serializer.data['message'] == "Test message"
         assert not serializer.data['read']
 
+    def test_read_derived_from_watermark(self, user, user_factory):
+        receiver = user_factory()
+        first = Message.objects.create(sender=user, receiver=receiver, message="one")
+        second = Message.objects.create(sender=user, receiver=receiver, message="two")
+        context = {'read_watermarks': {receiver.id: first.id, user.id: 0}}
+
+        assert MessageDetailSerializer(first, context=context).data['read'] is True
+        assert MessageDetailSerializer(second, context=context).data['read'] is False
+
     def test_read_only_fields(self, user, user_factory):
         receiver = user_factory()
         message = Message.objects.create(
@@ -111,9 +134,33 @@ class TestMessageDetailSerializer:
         assert message.conversation_id == expected_conversation_id
         assert 'conversation_id' not in serializer.data  # Should not be exposed
 
+    def test_row_fast_path_matches_serializer(self, user, user_factory):
+        receiver = user_factory()
+        messages = [
+            Message.objects.create(sender=user, receiver=receiver, message=text)
+            for text in ("one", "twö", "three")
+        ]
+        messages.append(Message.objects.create(
+            sender=receiver, receiver=user, message="reply", read=True,
+        ))
+        watermarks = {receiver.id: messages[1].id, user.id: 0}
+        queryset = Message.objects.filter(id__in=[m.id for m in messages]).order_by('id')
+        rows = list(queryset.values_list(*MESSAGE_ROW_FIELDS, named=True))
+        # Archived messages reach the fast path as unsaved instances
+        rows[0] = MessageArchive.from_messages([queryset[0]]).get_messages()[0]
+
+        expected = MessageDetailSerializer(
+            list(queryset), many=True, context={'read_watermarks': watermarks},
+        ).data
+        to_representation = message_row_serializer(watermarks)
+        renderer = JSONRenderer()
+        assert renderer.render([to_representation(row) for row in rows]) == (
+            renderer.render(expected)
+        )
+
 
 @pytest.mark.django_db
-class TestConversationSerializer:
+class TestInboxEntrySerializer:
     def setup_method(self):
         self.factory = RequestFactory()
         self.request = self.factory.get('/')
@@ -130,11 +177,11 @@ class TestConversationSerializer:
             message="Test conversation message"
         )
         
-        conv = Conversation.objects.get(
-            conversation_id=get_conversation_id(user.id, other_user.id)
+        entry = InboxEntry.objects.select_related('peer', 'conversation').get(
+            owner=user, peer=other_user,
         )
         context = {'request': mock_request(user)}
-        serializer = ConversationSerializer(conv, context=context)
+        serializer = InboxEntrySerializer(entry, context=context)
         
         assert serializer.data['user_id'] == other_user.id
         assert serializer.data['first_name'] == "Test"
@@ -150,11 +197,11 @@ class TestConversationSerializer:
             message="Test message"
         )
         
-        conv = Conversation.objects.get(
-            conversation_id=get_conversation_id(user.id, other_user.id)
+        entry = InboxEntry.objects.select_related('peer', 'conversation').get(
+            owner=user, peer=other_user,
         )
         context = {'request': mock_request(user)}
-        serializer = ConversationSerializer(conv, context=context)
+        serializer = InboxEntrySerializer(entry, context=context)
         
         expected_url = self.request.build_absolute_uri(
             other_user.profile_image.url
@@ -182,12 +229,12 @@ class TestConversationSerializer:
             message="Last message",
         )
         
-        conv = Conversation.objects.get(
-            conversation_id=get_conversation_id(user.id, other_user.id)
+        entry = InboxEntry.objects.select_related('peer', 'conversation').get(
+            owner=user, peer=other_user,
         )
         context = {'request': self.request}
         self.request.user = user
-        serializer = ConversationSerializer(conv, context=context)
+        serializer = InboxEntrySerializer(entry, context=context)
         assert serializer.data['unread_count'] == 4
 
     def test_conversation_fields(self, user, user_factory, mock_request):
@@ -208,11 +255,11 @@ class TestConversationSerializer:
             message="Second message",
         )
         
-        conv = Conversation.objects.get(
-            conversation_id=get_conversation_id(user.id, other_user.id)
+        entry = InboxEntry.objects.select_related('peer', 'conversation').get(
+            owner=user, peer=other_user,
         )
         context = {'request': mock_request(user)}
-        serializer = ConversationSerializer(conv, context=context)
+        serializer = InboxEntrySerializer(entry, context=context)
         
         assert serializer.data['last_message'] == "Second message"
         assert serializer.data['unread_count'] == 2
@@ -226,11 +273,41 @@ class TestConversationSerializer:
             message="Test message"
         )
         
-        conv = Conversation.objects.get(
-            conversation_id=get_conversation_id(user.id, other_user.id)
+        entry = InboxEntry.objects.select_related('peer', 'conversation').get(
+            owner=user, peer=other_user,
         )
         context = {'request': mock_request(user)}
-        serializer = ConversationSerializer(conv, context=context)
+        serializer = InboxEntrySerializer(entry, context=context)
         
         assert serializer.data['first_name'] == ""
         assert serializer.data['profile_image'] is None
+
+
+class TestORJSON:
+    data = {
+        'timestamp': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'day': date(2024, 5, 1),
+        'amount': Decimal('12.50'),
+        'label': gettext_lazy('Invalid sync token.'),
+        'uuid': uuid.UUID(int=1),
+        'watermarks': {1: 10, 2: None},
+        'items': [('tuple', 1.5), True],
+        'text': 'naïve line\u2028break',
+    }
+
+    def test_renderer_matches_drf(self):
+        assert ORJSONRenderer().render(self.data) == JSONRenderer().render(self.data)
+
+    def test_parser(self):
+        body = io.BytesIO('{"message": "héllo", "up_to": 3}'.encode())
+        assert ORJSONParser().parse(body) == {'message': 'héllo', 'up_to': 3}
+        with pytest.raises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"message": NaN}'))
+
+    def test_log_formatter_falls_back_to_str(self):
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 'event', None, None)
+        record.error = ValueError('boom')
+        record.user_id = 7
+        formatted = JsonFormatter().format(record)
+        assert '"error":"boom"' in formatted
+        assert '"user_id":7' in formatted
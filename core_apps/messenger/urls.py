@@ -2,13 +2,25 @@ from django.urls import path
 
 from .views import (
     ConversationMessageListCreateView, 
-    ConversationListView
+    ConversationMessageBulkCreateView,
+    ConversationMessageReadView,
+    ConversationListView,
+    UnreadCountView,
+    MessageSearchView,
 )
 
 urlpatterns = [
     # Recent conversations
     path("", ConversationListView.as_view(), name="conversation-list-view"),
+    # Total unread messages across conversations
+    path("unread/", UnreadCountView.as_view(), name="unread-count-view"),
+    # Search messages across the user's conversations
+    path("search/", MessageSearchView.as_view(), name="message-search-view"),
     # Create a new message or list messages in a conversation
     path("<str:user_id>/messages/", ConversationMessageListCreateView.as_view(), name="conversation-list-create-view"),
+    # Create a batch of messages in a conversation
+    path("<str:user_id>/messages/bulk/", ConversationMessageBulkCreateView.as_view(), name="conversation-bulk-create-view"),
+    # Mark messages in a conversation as read
+    path("<str:user_id>/messages/read/", ConversationMessageReadView.as_view(), name="conversation-read-view"),
 ]
 
@@ -0,0 +1,47 @@
+import json
+import zlib
+
+from django.utils.dateparse import parse_datetime
+
+# Row layout inside an archived batch
+ARCHIVE_FIELDS = (
+    'id', 'sender_id', 'receiver_id', 'message', 'timestamp', 'read', 'seq',
+    'conversation_key',
+)
+
+
+def pack_messages(messages):
+    '''
+    Serialize a batch of messages for the archive tier
+
+    Args:
+        messages (list[Message]): Messages of one conversation, oldest first
+
+    Return:
+        bytes: zlib-compressed JSON rows in ``ARCHIVE_FIELDS`` order
+    '''
+    rows = [
+        [
+            message.id, message.sender_id, message.receiver_id, message.message,
+            message.timestamp.isoformat(), message.read, message.seq,
+            message.conversation_key,
+        ]
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_messages(payload):
+    '''
+    Inverse of ``pack_messages``
+
+    Return:
+        list[dict]: Message field values, oldest first
+    '''
+    rows = json.loads(zlib.decompress(payload))
+    messages = []
+    for row in rows:
+        values = dict(zip(ARCHIVE_FIELDS, row))
+        values['timestamp'] = parse_datetime(values['timestamp'])
+        messages.append(values)
+    return messages
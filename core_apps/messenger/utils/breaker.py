@@ -0,0 +1,124 @@
+"""
+Circuit breaker for channel layer publishes.
+
+Request handlers never publish: events reach the channel layer from the
+``relay_events`` command or, with ``EVENT_DISPATCH = "queue"``, from the
+dispatch thread.  Both check ``allow()`` before each batch and report every
+``group_send`` to the breaker.  After ``CHANNEL_LAYER_BREAKER_FAILURES``
+consecutive failures, timeouts or publishes slower than
+``CHANNEL_LAYER_BREAKER_LATENCY`` the breaker opens, and batches wait (in
+the outbox table or the in-process queue) instead of piling onto a
+degraded Redis.  After ``CHANNEL_LAYER_BREAKER_RESET_TIMEOUT`` seconds it
+half-opens and lets the next batch through as a probe: one good publish
+closes it, a bad one opens it again.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger("light_messages.breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker; safe to share between threads."""
+
+    def __init__(
+        self, name, failure_threshold, latency_threshold, reset_timeout,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self._opened_at = None
+
+    def allow(self):
+        """Whether a publish may go ahead; half-opens once the timeout is up."""
+        with self._lock:
+            if self.state == OPEN and self._retry_in() <= 0:
+                self._transition(HALF_OPEN)
+            return self.state != OPEN
+
+    def retry_in(self):
+        """Seconds until an open breaker half-opens, 0 when it is not open."""
+        with self._lock:
+            return self._retry_in() if self.state == OPEN else 0.0
+
+    def record_success(self, latency):
+        """Record a publish that took ``latency`` seconds."""
+        if latency > self.latency_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        """Record a failed or timed out publish."""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.trips += 1
+                self._opened_at = self._clock()
+                self._transition(OPEN)
+
+    def get_stats(self):
+        """State, failure streak, times tripped and seconds until a probe."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "retry_in": (
+                    round(self._retry_in(), 3) if self.state == OPEN else 0.0
+                ),
+            }
+
+    def _retry_in(self):
+        return max(self._opened_at + self.reset_timeout - self._clock(), 0.0)
+
+    def _transition(self, state):
+        self.state = state
+        log = logger.warning if state == OPEN else logger.info
+        log(
+            f"breaker_{state}",
+            extra={
+                "event": f"breaker_{state}",
+                "breaker": self.name,
+                "consecutive_failures": self.consecutive_failures,
+            },
+        )
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """The process-wide channel layer CircuitBreaker, created on first use."""
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    "channel_layer",
+                    failure_threshold=settings.CHANNEL_LAYER_BREAKER_FAILURES,
+                    latency_threshold=settings.CHANNEL_LAYER_BREAKER_LATENCY,
+                    reset_timeout=settings.CHANNEL_LAYER_BREAKER_RESET_TIMEOUT,
+                )
+    return _breaker
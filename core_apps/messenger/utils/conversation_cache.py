@@ -0,0 +1,208 @@
+"""
+Optional Redis cache for the recent-conversations list.
+
+Per user we keep a sorted set of conversation ids scored by the last
+message timestamp, plus one small hash per (user, conversation) holding
+the pre-rendered list row.  Writers (``Message._send`` and
+``emit_read_signal``) update entries in place; a user's list is only built
+from Postgres on a miss, and only the first ``MESSENGER_CONVERSATION_CACHE_SIZE``
+conversations are kept.  Every Redis error degrades to the Postgres path.
+
+Every write also bumps a per-user version key.  A rebuild reads the
+version before its Postgres snapshot and only stores the page if the
+version is unchanged (``WATCH``), so a write that lands between the
+snapshot and ``store_page`` is never overwritten by stale data.
+"""
+import logging
+
+from redis.exceptions import WatchError
+
+from django.conf import settings
+from rest_framework.fields import DateTimeField
+
+from light_messages.redis_client import get_redis_client
+
+logger = logging.getLogger("light_messages.conversation_cache")
+
+_timestamp_field = DateTimeField()
+
+# Update an entry only if the user's list is cached.  A missing row hash
+# means a conversation the cache has never seen (or one that expired), so
+# the list is dropped and rebuilt from Postgres on the next read.
+_RECORD_MESSAGE_LUA = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[7])
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('HSET', KEYS[2], 'last_message', ARGV[3], 'timestamp', ARGV[4], 'last_activity', ARGV[5])
+redis.call('HINCRBY', KEYS[2], 'unread_count', ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[7])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[8]) - 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[7])
+end
+return 1
+"""
+
+_SET_UNREAD_LUA = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'unread_count', ARGV[1])
+end
+return 1
+"""
+
+ROW_FIELDS = (
+    "id", "user_id", "first_name", "profile_image", "last_message",
+    "timestamp", "last_activity", "unread_count",
+)
+
+
+def is_enabled() -> bool:
+    return settings.MESSENGER_CONVERSATION_CACHE_ENABLED
+
+
+def _client():
+    return get_redis_client(settings.MESSENGER_CONVERSATION_CACHE_URL)
+
+
+def _list_key(user_id):
+    return f"conv:list:{user_id}"
+
+
+def _row_key(user_id, conversation_id):
+    return f"conv:item:{user_id}:{conversation_id}"
+
+
+def _version_key(user_id):
+    return f"conv:ver:{user_id}"
+
+
+def _decode_row(row):
+    row["id"] = int(row["id"])
+    row["user_id"] = int(row["user_id"])
+    row["unread_count"] = int(row["unread_count"])
+    return row
+
+
+def get_first_page(user_id, limit):
+    """
+    Return up to ``limit`` cached rows (newest first), or None on a miss.
+    Rows are dicts of ``ROW_FIELDS``; ``last_activity`` and ``id`` are the
+    InboxEntry keyset position, stored as the strings the paginator emits.
+    """
+    client = _client()
+    conversation_ids = client.zrevrange(_list_key(user_id), 0, limit - 1)
+    if not conversation_ids:
+        return None
+    pipe = client.pipeline(transaction=False)
+    for conversation_id in conversation_ids:
+        pipe.hgetall(_row_key(user_id, conversation_id))
+    rows = pipe.execute()
+    if not all(rows):
+        # A row expired independently of the list; rebuild it.
+        return None
+    return [_decode_row(row) for row in rows]
+
+
+def get_version(user_id):
+    """Write version of a user's list; read it before the Postgres snapshot."""
+    return _client().get(_version_key(user_id))
+
+
+def store_page(user_id, entries, version):
+    """
+    Replace a user's cached list with ``entries`` (InboxEntry rows) unless
+    it was written to since ``version`` was read.  Returns the rendered
+    rows either way.
+    """
+    if not entries:
+        return []
+    ttl = settings.MESSENGER_CONVERSATION_CACHE_TTL
+    rows = []
+    pipe = _client().pipeline(transaction=True)
+    pipe.watch(_version_key(user_id))
+    stale = pipe.get(_version_key(user_id)) != version
+    pipe.multi()
+    pipe.delete(_list_key(user_id))
+    for entry in entries:
+        conversation_id = entry.conversation.conversation_id
+        image = entry.peer.profile_image
+        row = {
+            "id": entry.id,
+            "user_id": entry.peer_id,
+            "first_name": entry.peer.first_name,
+            "profile_image": image.name if image else "",
+            "last_message": entry.conversation.last_message_text,
+            "timestamp": _timestamp_field.to_representation(entry.last_activity),
+            "last_activity": str(entry.last_activity),
+            "unread_count": entry.unread_count,
+        }
+        rows.append(row)
+        pipe.hset(_row_key(user_id, conversation_id), mapping=row)
+        pipe.expire(_row_key(user_id, conversation_id), ttl)
+        pipe.zadd(_list_key(user_id), {conversation_id: entry.last_activity.timestamp()})
+    pipe.expire(_list_key(user_id), ttl)
+    if stale:
+        pipe.reset()
+        return rows
+    try:
+        pipe.execute()
+    except WatchError:
+        pass  # Written to meanwhile; the next read rebuilds
+    finally:
+        pipe.reset()
+    return rows
+
+
+def record_message(message, unread_increment=1):
+    """Move the conversation to the top of both participants' lists."""
+    client = _client()
+    script = client.register_script(_RECORD_MESSAGE_LUA)
+    timestamp = _timestamp_field.to_representation(message.timestamp)
+    for owner_id, increment in (
+        (message.sender_id, 0),
+        (message.receiver_id, unread_increment),
+    ):
+        script(
+            keys=[
+                _list_key(owner_id),
+                _row_key(owner_id, message.conversation_id),
+                _version_key(owner_id),
+            ],
+            args=[
+                message.conversation_id, message.timestamp.timestamp(),
+                message.message, timestamp, str(message.timestamp), increment,
+                settings.MESSENGER_CONVERSATION_CACHE_TTL,
+                settings.MESSENGER_CONVERSATION_CACHE_SIZE,
+            ],
+        )
+
+
+def set_unread_count(user_id, conversation_id, unread_count):
+    client = _client()
+    client.register_script(_SET_UNREAD_LUA)(
+        keys=[_row_key(user_id, conversation_id), _version_key(user_id)],
+        args=[unread_count, settings.MESSENGER_CONVERSATION_CACHE_TTL],
+    )
+
+
+def safe_call(func, *args, **kwargs):
+    """Run a cache write, logging (never raising) on Redis errors."""
+    if not is_enabled():
+        return
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        logger.warning(
+            "conversation_cache_error",
+            extra={
+                "event": "conversation_cache_error",
+                "operation": func.__name__,
+                "error": str(e),
+            },
+        )
@@ -0,0 +1,236 @@
+"""
+Dispatch of WebSocket events to the channel layer.
+
+``send_event`` is what the signal receivers call.  With
+``EVENT_DISPATCH = "outbox"`` (the default) it writes the event to the
+transactional outbox, and the ``relay_events`` command publishes it.  With
+``"queue"`` it hands the event, once the transaction commits, to a bounded
+in-process queue; a daemon thread running its own event loop drains the
+queue in batches and publishes each batch with ``outbox.publish``.  The
+request thread never waits for the channel layer, and the thread's loop
+keeps the channel layer's connections open between batches.
+
+While the channel layer circuit breaker is open the thread stops draining
+and events wait in the queue.  The queue is lighter than the outbox but
+lossy: events dropped by the overflow policy, rejected by the channel layer
+or still queued when the process exits are gone.  Each process logs
+``event_dispatch_stats`` (queue depth and the dropped and failed counts)
+every ``EVENT_DISPATCH_STATS_INTERVAL`` seconds.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from . import outbox
+from .breaker import get_breaker
+
+logger = logging.getLogger("light_messages.dispatch")
+
+# Reject the incoming event, evict the oldest queued one, or wait up to
+# EVENT_DISPATCH_BLOCK_TIMEOUT for room and then reject
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+Event = namedtuple("Event", ["group", "payload"])
+
+# Queued by ``close`` to stop the drain thread
+_STOP = object()
+
+
+class EventDispatcher:
+    """Bounded queue of events, published by a background thread."""
+
+    def __init__(
+        self, maxsize, batch_size, overflow="drop_oldest", block_timeout=0.05,
+        channel_layer=None, stats_interval=30.0, breaker=None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow!r}, "
+                f"expected one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+        self._channel_layer = channel_layer
+        self.breaker = breaker
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.counters = dict.fromkeys(
+            ("queued", "published", "failed", "dropped", "max_depth"), 0
+        )
+
+    def put(self, group, payload):
+        """Queue an event for ``group``; never raises when the queue is full."""
+        self._ensure_started()
+        event = Event(group, payload)
+        try:
+            if self.overflow == "block":
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow != "drop_oldest":
+                self._count("dropped")
+                return False
+            try:
+                self._queue.get_nowait()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        depth = self._queue.qsize()
+        with self._lock:
+            self.counters["queued"] += 1
+            self.counters["max_depth"] = max(self.counters["max_depth"], depth)
+        return True
+
+    def get_stats(self):
+        """The counters and the current queue depth."""
+        with self._lock:
+            return {**self.counters, "depth": self._queue.qsize()}
+
+    def close(self, timeout=5.0):
+        """Publish what is queued and stop the thread, waiting up to ``timeout``."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def _ensure_started(self):
+        # A thread started before a worker fork does not exist in the child
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="event-dispatch", daemon=True,
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _next_batch(self):
+        """
+        Wait for events and return up to ``batch_size`` of them, and whether
+        ``close`` was called.  Returns an empty batch after
+        ``stats_interval`` seconds without events.
+        """
+        try:
+            event = self._queue.get(timeout=self.stats_interval)
+        except queue.Empty:
+            return [], False
+        batch = []
+        while event is not _STOP:
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        channel_layer = self._channel_layer or get_channel_layer()
+        stats_at = time.monotonic()
+        stopping = False
+        while not stopping:
+            if self.breaker is not None and not self.breaker.allow():
+                # Keep events queued until the breaker lets a probe through
+                time.sleep(min(self.breaker.retry_in(), self.stats_interval))
+                batch = []
+            else:
+                batch, stopping = self._next_batch()
+            if batch:
+                self._publish(loop, channel_layer, batch)
+            if stopping or time.monotonic() - stats_at >= self.stats_interval:
+                stats_at = time.monotonic()
+                logger.info(
+                    "event_dispatch_stats",
+                    extra={"event": "event_dispatch_stats", **self.get_stats()},
+                )
+        loop.close()
+
+    def _publish(self, loop, channel_layer, batch):
+        try:
+            failed_groups = loop.run_until_complete(
+                outbox.publish(channel_layer, batch, self.breaker)
+            )
+        except Exception as error:
+            failed_groups = {event.group: error for event in batch}
+        failed = sum(event.group in failed_groups for event in batch)
+        self._count("published", len(batch) - failed)
+        self._count("failed", failed)
+        for group, error in failed_groups.items():
+            logger.warning(
+                "event_dispatch_error",
+                extra={
+                    "event": "event_dispatch_error",
+                    "group": group,
+                    "error": str(error),
+                },
+            )
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """The process-wide EventDispatcher, created from settings on first use."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EventDispatcher(
+                    maxsize=settings.EVENT_DISPATCH_QUEUE_SIZE,
+                    batch_size=settings.EVENT_DISPATCH_BATCH_SIZE,
+                    overflow=settings.EVENT_DISPATCH_OVERFLOW,
+                    block_timeout=settings.EVENT_DISPATCH_BLOCK_TIMEOUT,
+                    stats_interval=settings.EVENT_DISPATCH_STATS_INTERVAL,
+                    breaker=get_breaker(),
+                )
+                atexit.register(_dispatcher.close)
+    return _dispatcher
+
+
+def uses_outbox():
+    """Whether events go through the outbox table (else the in-process queue)."""
+    return settings.EVENT_DISPATCH == "outbox"
+
+
+def send_event(group, event):
+    """
+    Send ``event`` to channel layer group ``group`` once the current
+    transaction commits; nothing is sent if it rolls back.
+    """
+    if uses_outbox():
+        outbox.enqueue(group, event)
+    else:
+        transaction.on_commit(partial(get_dispatcher().put, group, event))
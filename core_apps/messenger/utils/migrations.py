@@ -0,0 +1,137 @@
+"""
+Migration operations for the large, write-hot messenger tables.
+
+On Postgres, indexes and unique constraints are built ``CONCURRENTLY`` so
+the table keeps taking writes during the build; the migrations using
+these must set ``atomic = False``.  Other backends (SQLite in tests) fall
+back to the plain blocking operation, and skip Postgres-only index types
+(GIN for message search).
+
+Postgres cannot build an index on a partitioned table concurrently, so on
+one (``messenger_message``, see ``utils.partitions``) the index is created
+``ON ONLY`` the parent and each partition's index is built concurrently
+and attached to it, which keeps it a single partitioned index.
+"""
+from django.contrib.postgres.indexes import PostgresIndex
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently as PostgresAddIndexConcurrently,
+    RemoveIndexConcurrently as PostgresRemoveIndexConcurrently,
+)
+from django.db.migrations.operations import AddConstraint, AddIndex, RemoveIndex
+
+from .partitions import is_partitioned, list_partitions
+
+
+def _is_postgres(schema_editor):
+    return schema_editor.connection.vendor == "postgresql"
+
+
+def _is_postgres_only(index):
+    return isinstance(index, PostgresIndex)
+
+
+def _is_partitioned(schema_editor, model):
+    return is_partitioned(schema_editor.connection, model._meta.db_table)
+
+
+def _add_partitioned_index(schema_editor, model, index):
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    parent = index.create_sql(model, schema_editor)
+    parent.parts["table"] = f"ONLY {quote(table)}"
+    schema_editor.execute(parent)
+    for partition, _, _ in list_partitions(schema_editor.connection, table):
+        name = f"{index.name}_{partition[len(table) + 1:]}"
+        child = index.create_sql(model, schema_editor, concurrently=True)
+        child.parts["table"] = quote(partition)
+        child.parts["name"] = quote(name)
+        schema_editor.execute(child)
+        schema_editor.execute(
+            f"ALTER INDEX {quote(index.name)} ATTACH PARTITION {quote(name)}"
+        )
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not _is_postgres(schema_editor):
+            if _is_postgres_only(self.index):
+                return
+            return AddIndex.database_forwards(
+                self, app_label, schema_editor, from_state, to_state,
+            )
+        if _is_partitioned(schema_editor, model):
+            if self.allow_migrate_model(schema_editor.connection.alias, model):
+                _add_partitioned_index(schema_editor, model, self.index)
+            return
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not _is_postgres(schema_editor) and _is_postgres_only(self.index):
+            return
+        if not _is_postgres(schema_editor) or _is_partitioned(schema_editor, model):
+            # A partitioned index can only be dropped with a plain DROP INDEX
+            return AddIndex.database_backwards(
+                self, app_label, schema_editor, from_state, to_state,
+            )
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class RemoveIndexConcurrently(PostgresRemoveIndexConcurrently):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not _is_postgres(schema_editor) or _is_partitioned(schema_editor, model):
+            return RemoveIndex.database_forwards(
+                self, app_label, schema_editor, from_state, to_state,
+            )
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not _is_postgres(schema_editor):
+            return RemoveIndex.database_backwards(
+                self, app_label, schema_editor, from_state, to_state,
+            )
+        if _is_partitioned(schema_editor, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(
+                self.name
+            )
+            if self.allow_migrate_model(schema_editor.connection.alias, model):
+                _add_partitioned_index(schema_editor, model, index)
+            return
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class AddUniqueConstraintConcurrently(AddConstraint):
+    """
+    ``UniqueConstraint`` (plain fields only) built as a unique index
+    ``CONCURRENTLY`` and then attached with ``ADD CONSTRAINT ... USING INDEX``,
+    which only takes a brief lock.
+    """
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        quote = schema_editor.quote_name
+        name = quote(self.constraint.name)
+        table = quote(model._meta.db_table)
+        columns = ", ".join(
+            quote(model._meta.get_field(field).column)
+            for field in self.constraint.fields
+        )
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {table} ({columns})"
+        )
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"
+        )
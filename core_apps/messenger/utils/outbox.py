@@ -0,0 +1,181 @@
+"""
+Transactional outbox for WebSocket events.
+
+Code that changes state writes the events it should announce with
+``enqueue`` inside its own transaction; nothing touches the channel layer
+on the request thread.  The ``relay_events`` command drains the table in
+id order with ``relay_batch``: it locks a batch, publishes it with one
+concurrent ``group_send`` chain per group (so a user's events keep their
+order), and deletes the rows that were accepted in the same transaction.
+Batches are relayed one at a time across all relays (an advisory lock on
+Postgres), so extra relays are standbys and never publish a later event
+of a group before an earlier one.
+
+Each relay also keeps a heartbeat in Redis with its circuit breaker state
+(``write_heartbeat``), which the health check reads with ``get_heartbeats``.
+A crash or failed publish leaves the rows for the next batch, so delivery
+is at-least-once; clients already upsert messages by ``id``.  While the
+channel layer circuit breaker is open, events stay in the table.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from light_messages.redis_client import get_redis_client
+
+from ..models import OutboxEvent
+
+logger = logging.getLogger("light_messages.outbox")
+
+# Postgres advisory lock held by the relay publishing a batch
+RELAY_LOCK_ID = 0x6F7574626F78
+
+# Hash of relay name -> JSON breaker stats and the time they were written
+HEARTBEATS_KEY = "outbox:relay:heartbeats"
+
+
+def enqueue(group, event):
+    """Write ``event`` for channel layer group ``group`` in this transaction."""
+    OutboxEvent.objects.create(group=group, payload=event)
+
+
+async def publish(channel_layer, events, breaker=None):
+    """
+    Publish ``events`` (anything with ``group`` and ``payload``): one
+    sequential chain per group, the groups concurrently.  Each
+    ``group_send`` is cut off after ``CHANNEL_LAYER_PUBLISH_TIMEOUT``
+    seconds and reported to ``breaker``.  Return ``{group: error}`` for the
+    groups whose publish failed.
+    """
+    timeout = settings.CHANNEL_LAYER_PUBLISH_TIMEOUT
+    by_group = {}
+    for event in events:
+        by_group.setdefault(event.group, []).append(event.payload)
+
+    async def send(group, payloads):
+        for payload in payloads:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(
+                    channel_layer.group_send(group, payload), timeout,
+                )
+            except Exception:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            if breaker is not None:
+                breaker.record_success(time.monotonic() - started)
+
+    results = await asyncio.gather(
+        *(send(group, payloads) for group, payloads in by_group.items()),
+        return_exceptions=True,
+    )
+    return {
+        group: result
+        for group, result in zip(by_group, results)
+        if isinstance(result, Exception)
+    }
+
+
+def relay_batch(channel_layer, batch_size, breaker=None):
+    """
+    Publish and delete up to ``batch_size`` of the oldest events.  Nothing
+    is published while another relay holds the relay lock or ``breaker`` is
+    open.  All of a group's events stay in the outbox if any of them
+    failed, and go out again, in order, with a later batch.
+
+    Returns ``(published, failed, lag)``: ``lag`` is the age in seconds of
+    the oldest event in the batch.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            # Skipping the rows another relay locked would let this batch
+            # overtake that relay's events of the same group
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [RELAY_LOCK_ID])
+                if not cursor.fetchone()[0]:
+                    return 0, 0, 0.0
+        events = list(
+            OutboxEvent.objects.select_for_update().order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0, 0, 0.0
+        lag = (timezone.now() - events[0].created_at).total_seconds()
+        if breaker is not None and not breaker.allow():
+            return 0, 0, lag
+        failed_groups = async_to_sync(publish)(channel_layer, events, breaker)
+        for group, error in failed_groups.items():
+            logger.warning(
+                "outbox_publish_error",
+                extra={
+                    "event": "outbox_publish_error",
+                    "group": group,
+                    "error": str(error),
+                },
+            )
+        published = [event.id for event in events if event.group not in failed_groups]
+        OutboxEvent.objects.filter(id__in=published).delete()
+    return len(published), len(events) - len(published), lag
+
+
+def get_stats():
+    """
+    Pending events, counted up to ``OUTBOX_STATS_PENDING_CAP``, and the age
+    in seconds of the oldest one.
+    """
+    oldest = (
+        OutboxEvent.objects.order_by("id")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+    pending = OutboxEvent.objects.order_by().values("id")
+    return {
+        "pending": pending[:settings.OUTBOX_STATS_PENDING_CAP].count(),
+        "lag_seconds": (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+def _heartbeat_client():
+    return get_redis_client(settings.OUTBOX_RELAY_HEARTBEAT_URL)
+
+
+def write_heartbeat(name, breaker):
+    """
+    Store ``breaker``'s stats as relay ``name``'s heartbeat, and drop the
+    heartbeats of relays gone for over ``OUTBOX_RELAY_HEARTBEAT_TTL`` seconds.
+    """
+    client = _heartbeat_client()
+    now = time.time()
+    ttl = settings.OUTBOX_RELAY_HEARTBEAT_TTL
+    gone = [
+        relay for relay, beat in client.hgetall(HEARTBEATS_KEY).items()
+        if json.loads(beat)["at"] < now - ttl
+    ]
+    pipe = client.pipeline()
+    if gone:
+        pipe.hdel(HEARTBEATS_KEY, *gone)
+    pipe.hset(HEARTBEATS_KEY, name, json.dumps({**breaker.get_stats(), "at": now}))
+    pipe.expire(HEARTBEATS_KEY, ttl)
+    pipe.execute()
+
+
+def get_heartbeats():
+    """
+    The breaker stats of the relays heard from in the last
+    ``OUTBOX_RELAY_HEARTBEAT_TTL`` seconds, by name, with the heartbeat's
+    age in seconds.
+    """
+    now = time.time()
+    relays = {}
+    for relay, beat in _heartbeat_client().hgetall(HEARTBEATS_KEY).items():
+        stats = json.loads(beat)
+        age = now - stats.pop("at")
+        if age <= settings.OUTBOX_RELAY_HEARTBEAT_TTL:
+            relays[relay] = {**stats, "heartbeat_age": round(max(age, 0.0), 3)}
+    return relays
@@ -0,0 +1,243 @@
+"""
+Monthly range partitioning of ``messenger_message`` on ``timestamp``
+(Postgres only).
+
+The conversion attaches the existing table as the first partition,
+``<table>_legacy``, covering everything before a month boundary, so no
+rows are copied.  Monthly partitions ``<table>_pYYYYMM`` follow it and
+are created ahead of time by the ``message_partitions`` command.  An
+insert with no partition for its timestamp fails, so that command must
+run (e.g. daily) before the last one fills up.
+
+Postgres requires the partition key in every unique index of a
+partitioned table, so the primary key becomes ``(id, timestamp)``.  Ids
+stay unique because they all come from one sequence (or generator).
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+LEGACY_SUFFIX = "legacy"
+# How long the conversion waits for its table lock before giving up (the
+# migration can simply be re-run)
+CONVERT_LOCK_TIMEOUT = "5s"
+
+_BOUND_RE = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+_MIN_BOUND = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+def month_start(value):
+    """First instant (UTC) of the month containing ``value``."""
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    """``value`` (a month start) shifted by ``months``."""
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y%m}"
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table],
+        )
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def _parse_bound(value):
+    """A partition bound literal as printed by ``pg_get_expr``; None for MINVALUE."""
+    if value == "MINVALUE":
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def list_partitions(connection, table):
+    """``[(name, lower, upper)]`` ordered by range; lower is None for MINVALUE."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [table],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        lower, upper = _BOUND_RE.search(bound).groups()
+        partitions.append((name, _parse_bound(lower), _parse_bound(upper)))
+    return sorted(
+        partitions,
+        key=lambda partition: partition[1] or _MIN_BOUND,
+    )
+
+
+def ensure_partitions(connection, table, now, ahead):
+    """
+    Create the monthly partitions missing between the newest existing
+    partition and ``ahead`` months after ``now``.  Returns the names of
+    the partitions created.  The new partitions are empty, so Postgres
+    builds their share of every partitioned index instantly.
+    """
+    partitions = list_partitions(connection, table)
+    start = partitions[-1][2] if partitions else month_start(now)
+    until = add_months(month_start(now), ahead + 1)
+    quote = connection.ops.quote_name
+    created = []
+    with connection.cursor() as cursor:
+        while start < until:
+            end = add_months(start, 1)
+            name = partition_name(table, start)
+            cursor.execute(
+                f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, end],
+            )
+            created.append(name)
+            start = end
+    return created
+
+
+def detach_partition(connection, table, name, drop=False):
+    """
+    Detach a partition without blocking reads and writes on the parent
+    (``DETACH ... CONCURRENTLY``, so not inside a transaction).  The table
+    is kept for archiving unless ``drop`` is set.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)} CONCURRENTLY"
+        )
+        if drop:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+
+
+def convert_to_partitioned(connection, table, column, cutoff):
+    """
+    Turn ``table`` into a table partitioned by range on ``column`` without
+    copying rows: the current table becomes the ``<table>_legacy``
+    partition for ``[MINVALUE, cutoff)``.  Slow steps (the unique index
+    for the new primary key, validating the range check) run first
+    without blocking writes; the swap itself only changes the catalog,
+    under a short ``ACCESS EXCLUSIVE`` lock.  Must not run inside a
+    transaction.  No foreign key may reference ``table``.
+    """
+    quote = connection.ops.quote_name
+    legacy = f"{table}_{LEGACY_SUFFIX}"
+    pk_index = f"{legacy}_pkey"
+    range_check = f"{legacy}_range"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {quote(pk_index)} "
+            f"ON {quote(table)} (id, {quote(column)})"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(range_check)} "
+            f"CHECK ({quote(column)} < %s) NOT VALID",
+            [cutoff],
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} VALIDATE CONSTRAINT {quote(range_check)}"
+        )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'")
+        cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            """
+            SELECT idx.relname, pg_get_indexdef(idx.oid)
+            FROM pg_index
+            JOIN pg_class AS idx ON idx.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = %s::regclass
+                AND NOT pg_index.indisprimary AND idx.relname <> %s
+            """,
+            [table, pk_index],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """,
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass "
+            "AND contype = 'p'",
+            [table],
+        )
+        (old_pk,) = cursor.fetchone()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        (sequence,) = cursor.fetchone()
+        next_id = None
+        if sequence:
+            cursor.execute(f"SELECT last_value, is_called FROM {sequence}")
+            next_id = cursor.fetchone()
+
+        # The old table becomes the legacy partition; its index names are
+        # freed up for the partitioned indexes of the new parent
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}")
+        for name, _ in indexes:
+            legacy_name = f"{name}_{LEGACY_SUFFIX}"
+            cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(legacy_name)}")
+        cursor.execute(
+            f"ALTER TABLE {quote(legacy)} DROP CONSTRAINT {quote(old_pk)}, "
+            f"ADD CONSTRAINT {quote(pk_index)} "
+            f"PRIMARY KEY USING INDEX {quote(pk_index)}"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS"
+        )
+
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS "
+            f"INCLUDING CONSTRAINTS) PARTITION BY RANGE ({quote(column)})"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(range_check)}"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(old_pk)} "
+            f"PRIMARY KEY (id, {quote(column)})"
+        )
+        id_sequence = f"{table}_id_seq"
+        cursor.execute(
+            f"CREATE SEQUENCE {quote(id_sequence)} OWNED BY {quote(table)}.id"
+        )
+        if next_id is not None:
+            cursor.execute("SELECT setval(%s, %s, %s)", [id_sequence, *next_id])
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ALTER COLUMN id "
+            f"SET DEFAULT nextval(%s::regclass)",
+            [id_sequence],
+        )
+        # Identical definitions on the (still empty) parent, so ATTACH
+        # adopts the legacy indexes and foreign keys instead of rebuilding
+        # or revalidating them
+        for name, definition in foreign_keys:
+            cursor.execute(
+                f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}"
+            )
+        for _, definition in indexes:
+            cursor.execute(definition)
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} "
+            f"FOR VALUES FROM (MINVALUE) TO (%s)",
+            [cutoff],
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(legacy)} DROP CONSTRAINT {quote(range_check)}"
+        )
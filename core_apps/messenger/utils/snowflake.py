@@ -0,0 +1,198 @@
+"""
+Time-ordered 64-bit message ids generated in-process.
+
+Layout (most significant bit first)::
+
+    | 38 bits: 10 ms ticks since EPOCH | 9 bits: worker | 6 bits: sequence |
+
+53 bits in total, so ids stay exact as JSON numbers in JavaScript clients
+while still fitting the BigAutoField column.  That gives ~87 years of ids,
+512 concurrent workers and 6,400 ids per second per worker.  Each process
+(gunicorn / daphne worker, in every pod) leases a distinct worker id from
+Redis at its first insert (see ``WorkerLease``).
+
+Once enabled, the generator must stay on: database-sequence ids would sort
+below the snowflake ids already issued, breaking ``id``-based read
+watermarks and sync tokens (``check --database default`` reports this).
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from light_messages.redis_client import get_redis_client
+
+logger = logging.getLogger("light_messages.snowflake")
+
+# 2024-01-01T00:00:00Z in milliseconds
+EPOCH_MS = 1_704_067_200_000
+TICK_MS = 10
+TIMESTAMP_BITS = 38
+WORKER_BITS = 9
+SEQUENCE_BITS = 6
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+WORKER_SHIFT = SEQUENCE_BITS
+TIMESTAMP_SHIFT = SEQUENCE_BITS + WORKER_BITS
+
+
+class SnowflakeGenerator:
+    """Thread-safe generator of strictly increasing ids for one worker."""
+
+    def __init__(self, worker_id, clock=time.time):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_tick = -1
+        self._sequence = 0
+
+    def _current_tick(self):
+        return (int(self._clock() * 1000) - EPOCH_MS) // TICK_MS
+
+    def __call__(self):
+        with self._lock:
+            tick = self._current_tick()
+            # Clock moved backwards (NTP step): keep issuing from the last
+            # tick rather than risk duplicates.
+            tick = max(tick, self._last_tick)
+            if tick == self._last_tick:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted for this tick; wait for the next one
+                    while tick <= self._last_tick:
+                        time.sleep(TICK_MS / 1000 / 4)
+                        tick = max(self._current_tick(), tick)
+            else:
+                self._sequence = 0
+            self._last_tick = tick
+            return (
+                (tick << TIMESTAMP_SHIFT)
+                | (self.worker_id << WORKER_SHIFT)
+                | self._sequence
+            )
+
+
+def parse_snowflake(snowflake_id):
+    """Split an id into (unix time in ms, worker id, sequence)."""
+    tick = snowflake_id >> TIMESTAMP_SHIFT
+    worker_id = (snowflake_id >> WORKER_SHIFT) & MAX_WORKER_ID
+    sequence = snowflake_id & MAX_SEQUENCE
+    return EPOCH_MS + tick * TICK_MS, worker_id, sequence
+
+
+# Keep our lease if we still own it; fails if it expired and was re-leased
+_RENEW_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class WorkerLease:
+    """
+    Exclusive worker id leased from Redis (``SET NX`` with a TTL), so forked
+    gunicorn / daphne workers and every pod get distinct ids without any
+    per-insert coordination.  The lease is renewed from ``next_id`` once a
+    third of the TTL has passed; if it was lost (process idle longer than the
+    TTL and the id re-leased), a new worker id is leased before issuing ids.
+    """
+    key_prefix = "snowflake:worker"
+
+    def __init__(self, client, ttl_seconds):
+        self.client = client
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.worker_id = None
+        self._renewed_at = 0.0
+
+    def _key(self, worker_id):
+        return f"{self.key_prefix}:{worker_id}"
+
+    def acquire(self):
+        # Start at a random id so concurrently booting workers rarely probe
+        # the same keys; each SET NX is atomic, so clashes are only retried.
+        offset = random.randrange(MAX_WORKER_ID + 1)
+        for step in range(MAX_WORKER_ID + 1):
+            worker_id = (offset + step) & MAX_WORKER_ID
+            key = self._key(worker_id)
+            if self.client.set(key, self.owner, nx=True, px=self.ttl_ms):
+                self.worker_id = worker_id
+                self._renewed_at = time.monotonic()
+                return worker_id
+        raise RuntimeError("No free snowflake worker id (all leases taken)")
+
+    def ensure(self):
+        """Return a worker id this process holds a live lease on."""
+        if self.worker_id is None:
+            return self.acquire()
+        elapsed_ms = (time.monotonic() - self._renewed_at) * 1000
+        if elapsed_ms < self.ttl_ms / 3:
+            return self.worker_id
+        renewed = self.client.eval(
+            _RENEW_LEASE_LUA, 1, self._key(self.worker_id), self.owner, self.ttl_ms,
+        )
+        if not renewed:
+            logger.warning(
+                "snowflake_worker_lease_lost",
+                extra={
+                    "event": "snowflake_worker_lease_lost",
+                    "worker_id": self.worker_id,
+                },
+            )
+            return self.acquire()
+        self._renewed_at = time.monotonic()
+        return self.worker_id
+
+
+_state_lock = threading.Lock()
+_lease = None
+_generator = None
+_generator_pid = None
+
+
+def next_id():
+    """
+    Next id for this process.  State is rebuilt after a fork, so workers
+    forked from a preloaded master never share a lease or a sequence.
+    """
+    global _lease, _generator, _generator_pid
+    with _state_lock:
+        pid = os.getpid()
+        if _generator_pid != pid:
+            _lease = WorkerLease(
+                get_redis_client(settings.MESSENGER_ID_LEASE_URL),
+                settings.MESSENGER_ID_LEASE_TTL,
+            )
+            _generator = None
+            _generator_pid = pid
+        worker_id = _lease.ensure()
+        if _generator is None or _generator.worker_id != worker_id:
+            _generator = SnowflakeGenerator(worker_id)
+        generate = _generator
+    return generate()
+
+
+@lru_cache(maxsize=None)
+def _load_generator(path):
+    return import_string(path)
+
+
+def get_message_id_generator():
+    """
+    Callable configured in ``MESSENGER_MESSAGE_ID_GENERATOR``, or None to
+    let the database assign ids.
+    """
+    path = settings.MESSENGER_MESSAGE_ID_GENERATOR
+    return _load_generator(path) if path else None
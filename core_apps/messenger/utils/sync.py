@@ -0,0 +1,44 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from urllib import parse
+
+from django.utils.dateparse import parse_datetime
+
+
+def encode_sync_token(last_message_id, updated_at, entry_id=0):
+    '''
+    Build the opaque token returned by the sync endpoint
+
+    Args:
+        last_message_id (int): Highest message id the client has received
+        updated_at (datetime): Newest inbox ``updated_at`` the client has seen
+        entry_id (int): Inbox entry id tie-break for that ``updated_at``
+
+    Return:
+        str: url-safe base64 token
+    '''
+    querystring = parse.urlencode({
+        'm': last_message_id, 'u': updated_at.isoformat(), 'e': entry_id,
+    })
+    return urlsafe_b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+def decode_sync_token(token):
+    '''
+    Inverse of ``encode_sync_token``
+
+    Return:
+        tuple[int, datetime, int]: (last_message_id, updated_at, entry_id)
+
+    Raises:
+        ValueError: if the token is malformed
+    '''
+    try:
+        tokens = parse.parse_qs(urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+        last_message_id = int(tokens['m'][0])
+        updated_at = parse_datetime(tokens['u'][0])
+        entry_id = int(tokens.get('e', ['0'])[0])
+    except (KeyError, TypeError, UnicodeError, ValueError) as e:
+        raise ValueError("Invalid sync token") from e
+    if updated_at is None or last_message_id < 0 or entry_id < 0:
+        raise ValueError("Invalid sync token")
+    return last_message_id, updated_at, entry_id
@@ -1,113 +1,562 @@
-from rest_framework import generics
+from datetime import timedelta
+
+from rest_framework import generics, status
 from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 
-from django.db.models import Q
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
-from .models import Message, Conversation
+from core_apps.users.utils.avatars import get_profile_image_url
+
+from .models import Message, Conversation, InboxEntry, UnreadCounter
 from .serializers import (
     MessageCreateSerializer,
+    MessageBulkCreateSerializer,
+    MessageReadSerializer,
     MessageDetailSerializer, 
-    ConversationSerializer
+    InboxEntrySerializer,
+    SyncConversationSerializer,
+    MESSAGE_ROW_FIELDS,
+    message_row_serializer,
 )
 from .paginations import (
     RecentConversationsPagination,
-    ConversationMessagesPagination
+    ConversationMessagesPagination,
+    MessageSearchPagination,
 )
+from .utils import conversation_cache, dispatch
 from .utils.conversations import get_conversation_id
-from .signals import messages_read
+from .utils.sync import encode_sync_token, decode_sync_token
+from .signals import messages_read, messages_created
 
 
 User = get_user_model()
 
-class ConversationMessageListCreateView(generics.ListCreateAPIView):
-    ''' List or Create messages View ( for a specific conversation ) '''
-    serializer_class = MessageCreateSerializer
-    permission_classes = [IsAuthenticated]
-    pagination_class = ConversationMessagesPagination
+
+def apply_read_watermarks(messages):
+    ''' Flag messages covered by their receiver's watermark as read '''
+    conversation_ids = {message.conversation_id for message in messages}
+    watermarks = {
+        conversation.conversation_id: conversation.get_read_watermarks()
+        for conversation in Conversation.objects.filter(
+            conversation_id__in=conversation_ids,
+        ).only(
+            'conversation_id', 'participant_1_id', 'participant_2_id',
+            'last_read_message_id_p1', 'last_read_message_id_p2',
+        )
+    }
+    for message in messages:
+        receiver_watermark = watermarks.get(message.conversation_id, {}).get(
+            message.receiver_id, 0,
+        )
+        if message.id <= receiver_watermark:
+            message.read = True
+
+
+class ConversationMixin:
+    ''' Shared receiver lookup and read-marking for conversation views '''
 
     def get_queryset(self):
-        conversation_id = get_conversation_id(
+        return Message.objects.for_conversation(
             self.request.user.id,
             self.kwargs.get('user_id')
+        ).order_by('-timestamp', '-id')
+
+    def get_conversation_id(self):
+        return get_conversation_id(self.request.user.id, self.kwargs.get('user_id'))
+
+    def get_read_context(self):
+        ''' Serializer context carrying both participants' read watermarks '''
+        conversation = (
+            Conversation.objects
+            .filter(conversation_id=self.get_conversation_id())
+            .only(
+                'participant_1_id', 'participant_2_id',
+                'last_read_message_id_p1', 'last_read_message_id_p2',
+            )
+            .first()
         )
-        return Message.objects.filter(
-            conversation_id=conversation_id
-        ).order_by('-timestamp')
+        watermarks = conversation.get_read_watermarks() if conversation else {}
+        return {'request': self.request, 'read_watermarks': watermarks}
 
-    def perform_create(self, serializer):
-        receiver_id = self.kwargs.get('user_id')
-        receiver = get_object_or_404(User, id=receiver_id)
+    def get_receiver(self):
+        receiver = get_object_or_404(User, id=self.kwargs.get('user_id'))
         if receiver.id == self.request.user.id:
             raise ValidationError({
                 'receiver': [_('You cannot send a message to yourself.'),]
-            })        
-        serializer.save(sender=self.request.user, receiver=receiver)
-        # Mark previous messages from receiver as read
-        self.emit_read_signal(receiver_id, self.request.user.id, self.get_queryset())
+            })
+        return receiver
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        sender_id = self.kwargs.get('user_id')
-        reader_id = request.user.id
-        self.emit_read_signal(sender_id, reader_id, queryset)
-        queryset = self.paginate_queryset(queryset)
-        serializer = MessageDetailSerializer(queryset, many=True)
-        return self.get_paginated_response(serializer.data)
-    
-    def emit_read_signal(self, sender_id, reader_id, queryset) -> bool:
-        ''' Mark unread messages as read and emit signal + update Conversation. '''
+    def get_peer_id(self):
+        ''' The other user's id from the URL, validated without a query '''
+        try:
+            peer_id = int(self.kwargs.get('user_id'))
+        except (TypeError, ValueError):
+            raise NotFound()
+        min_id, max_id = connection.ops.integer_field_range(
+            User._meta.pk.get_internal_type(),
+        )
+        if not min_id <= peer_id <= max_id:
+            raise NotFound()
+        return peer_id
+
+    def get_receiver_id(self):
+        ''' The receiver id from the URL, validated without a query '''
+        receiver_id = self.get_peer_id()
+        if receiver_id == self.request.user.id:
+            raise ValidationError({
+                'receiver': [_('You cannot send a message to yourself.'),]
+            })
+        return receiver_id
+
+    def send_messages(self, texts):
+        '''
+        Send ``texts`` to the receiver, then mark everything they sent so far
+        as read by the sender, in one transaction with the WebSocket events
+        they raise.  On Postgres the receiver check, inserts, counter
+        updates, read marking and events are one statement (Message.send);
+        elsewhere they are separate queries.
+
+        Return:
+            list[Message]: The sent messages, oldest first
+        '''
+        reader_id = self.request.user.id
+        if connection.vendor != 'postgresql':
+            receiver = self.get_receiver()
+            with transaction.atomic():
+                messages = Message.bulk_send(reader_id, receiver.id, texts)
+                messages_created.send(sender=self.__class__, messages=messages)
+                self.emit_read_signal(receiver.id, reader_id)
+            return messages
+
+        receiver_id = self.get_receiver_id()
+        messages, read = Message.send(reader_id, receiver_id, texts)
+        if messages is None:
+            raise NotFound()
+        deferred = read is Message.READ_DEFERRED
+        if deferred:
+            read = None
+        if not dispatch.uses_outbox():
+            # Message.send left the events to the signal receivers
+            messages_created.send(sender=self.__class__, messages=messages)
+            if read is not None:
+                messages_read.send(
+                    sender=self.__class__,
+                    reader_id=reader_id,
+                    sender_id=receiver_id,
+                    last_message_id=read[0],
+                    total_unread=read[1],
+                )
+        if read is not None:
+            conversation_cache.safe_call(
+                conversation_cache.set_unread_count,
+                reader_id, get_conversation_id(receiver_id, reader_id), 0,
+            )
+        if deferred:
+            # The receiver sent more while the statement waited for the
+            # Conversation lock: mark read again with a fresh snapshot
+            self.emit_read_signal(receiver_id, reader_id)
+        return messages
+
+    def emit_read_signal(self, sender_id, reader_id, up_to_message_id=None) -> bool:
+        '''
+        Advance the reader's read watermark and emit signal.
+        ``up_to_message_id`` limits the watermark to messages up to that id;
+        by default everything the sender has sent so far is marked read.
+        '''
         conv_id = get_conversation_id(sender_id, reader_id)
         p1_id = min(int(sender_id), int(reader_id))
         reader_is_p1 = int(reader_id) == p1_id
-        unread_field = 'unread_count_p1' if reader_is_p1 else 'unread_count_p2'
+        suffix = 'p1' if reader_is_p1 else 'p2'
+        unread_field = f'unread_count_{suffix}'
+        watermark_field = f'last_read_message_id_{suffix}'
 
-        # Skip the expensive message scan when the conversation has no unreads
-        has_unreads = (
-            Conversation.objects
-            .filter(conversation_id=conv_id, **{f'{unread_field}__gt': 0})
-            .exists()
-        )
-        if not has_unreads:
-            return False
-
-        read_updated_qs = queryset.filter(sender_id=sender_id, read=False)
-        last_message_id = read_updated_qs.values_list('id', flat=True).first()
-        if last_message_id is None:
-            return False
-
-        read_updated_qs.update(read=True)
-        Conversation.objects.filter(conversation_id=conv_id).update(**{unread_field: 0})
-
-        messages_read.send(
-            sender=self.__class__,
-            reader_id=reader_id,
-            sender_id=sender_id,
-            last_message_id=last_message_id
+        with transaction.atomic():
+            # Skip the message lookup when the conversation has no unreads.
+            # The row stays locked until the reset below, so the reader's
+            # total drops by exactly the unreads it clears.
+            conversation = (
+                Conversation.objects
+                .select_for_update()
+                .filter(conversation_id=conv_id, **{f'{unread_field}__gt': 0})
+                .values_list('pk', unread_field)
+                .first()
+            )
+            if conversation is None:
+                return False
+            conversation_pk, unread_count = conversation
+
+            # Newest message from the sender: one seek on conversation_timestamp_idx
+            sender_messages = Message.objects.for_conversation(
+                sender_id, reader_id,
+            ).filter(sender_id=sender_id)
+            if up_to_message_id is not None:
+                sender_messages = sender_messages.filter(id__lte=up_to_message_id)
+            last_message_id = (
+                sender_messages
+                .order_by('-timestamp', '-id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if last_message_id is None:
+                return False
+
+            remaining_unread = 0
+            if up_to_message_id is not None:
+                remaining_unread = Message.objects.for_conversation(
+                    sender_id, reader_id,
+                ).filter(
+                    sender_id=sender_id, id__gt=last_message_id, read=False,
+                ).count()
+
+            # O(1) write: everything up to the watermark is read.  The watermark
+            # only moves forward, so a stale up_to cannot un-read messages.
+            updated = (
+                Conversation.objects
+                .filter(pk=conversation_pk)
+                .filter(
+                    Q(**{f'{watermark_field}__isnull': True})
+                    | Q(**{f'{watermark_field}__lt': last_message_id})
+                )
+                .update(**{
+                    unread_field: remaining_unread,
+                    watermark_field: last_message_id,
+                    f'last_read_at_{suffix}': timezone.now(),
+                })
+            )
+            if not updated:
+                return False
+            # Both entries change for sync: the reader's unread count and the
+            # sender's view of the read watermark.
+            InboxEntry.objects.filter(conversation_id=conversation_pk).update(
+                unread_count=Case(
+                    When(owner_id=reader_id, then=Value(remaining_unread)),
+                    default=F('unread_count'),
+                    output_field=PositiveIntegerField(),
+                ),
+                updated_at=timezone.now(),
+            )
+            total_unread = UnreadCounter.subtract(
+                reader_id, unread_count - remaining_unread,
+            )
+            messages_read.send(
+                sender=self.__class__,
+                reader_id=reader_id,
+                sender_id=sender_id,
+                last_message_id=last_message_id,
+                total_unread=total_unread,
+            )
+        conversation_cache.safe_call(
+            conversation_cache.set_unread_count, reader_id, conv_id, remaining_unread,
         )
         return True
 
 
+class ConversationMessageListCreateView(ConversationMixin, generics.ListCreateAPIView):
+    ''' List or Create messages View ( for a specific conversation ) '''
+    serializer_class = MessageCreateSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ConversationMessagesPagination
+
+    def perform_create(self, serializer):
+        # Also marks previous messages from the receiver as read
+        serializer.instance = self.send_messages(
+            [serializer.validated_data['message']],
+        )[0]
+
+    def list(self, request, *args, **kwargs):
+        # Read-only fast path: plain row tuples instead of model instances,
+        # rendered by message_row_serializer instead of MessageDetailSerializer
+        sender_id = self.get_peer_id()
+        queryset = self.get_queryset().values_list(*MESSAGE_ROW_FIELDS, named=True)
+        reader_id = request.user.id
+        # Implicit marking turns the GET into a write; disable it to keep
+        # message history cacheable and replica-safe (clients then POST to
+        # the read endpoint instead).
+        if settings.MESSENGER_MARK_READ_ON_LIST:
+            self.emit_read_signal(sender_id, reader_id)
+        params = request.query_params
+        paginator = self.paginator
+        if paginator.around_query_param in params:
+            queryset = paginator.paginate_around(
+                queryset, request, params[paginator.around_query_param], view=self,
+            )
+        elif paginator.after_query_param in params:
+            queryset = paginator.paginate_after(
+                queryset, request, params[paginator.after_query_param], view=self,
+            )
+        elif paginator.seq_from_query_param in params:
+            queryset = paginator.paginate_seq_range(
+                queryset, request,
+                params[paginator.seq_from_query_param],
+                params.get(paginator.seq_to_query_param),
+                view=self,
+            )
+        else:
+            queryset = self.paginate_queryset(queryset)
+        to_representation = message_row_serializer(
+            self.get_read_context()['read_watermarks'],
+        )
+        return self.get_paginated_response([to_representation(row) for row in queryset])
+
+
+class ConversationMessageBulkCreateView(ConversationMixin, generics.CreateAPIView):
+    ''' Send a batch of messages with one insert and one Conversation update '''
+    serializer_class = MessageBulkCreateSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Also marks previous messages from the receiver as read
+        messages = self.send_messages(serializer.validated_data['messages'])
+        return Response(
+            MessageCreateSerializer(messages, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ConversationMessageReadView(ConversationMixin, generics.GenericAPIView):
+    ''' Explicitly mark messages from the other user as read '''
+    serializer_class = MessageReadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = self.emit_read_signal(
+            self.get_peer_id(),
+            request.user.id,
+            up_to_message_id=serializer.validated_data.get('up_to'),
+        )
+        return Response({'updated': updated}, status=status.HTTP_200_OK)
+
+
 class ConversationListView(generics.ListAPIView):
     ''' List recent conversations View '''
-    serializer_class = ConversationSerializer
+    serializer_class = InboxEntrySerializer
     permission_classes = [IsAuthenticated]
     pagination_class = RecentConversationsPagination
 
     def get_queryset(self):
-        user = self.request.user
+        # Single range scan on inbox_owner_latest_idx
         return (
-            Conversation.objects
-            .filter(Q(participant_1=user) | Q(participant_2=user))
-            .select_related('participant_1', 'participant_2')
+            InboxEntry.objects
+            .filter(owner=self.request.user)
+            .select_related('conversation', 'peer')
             .only(
-                'conversation_id', 'last_message_text', 'last_message_timestamp',
-                'unread_count_p1', 'unread_count_p2',
-                'participant_1__id', 'participant_1__first_name', 'participant_1__profile_image',
-                'participant_2__id', 'participant_2__first_name', 'participant_2__profile_image',
+                'id', 'peer_id', 'unread_count', 'last_activity',
+                'conversation__last_message_text',
+                'peer__id', 'peer__first_name', 'peer__profile_image',
             )
-            .order_by('-last_message_timestamp')
-        )
\ No newline at end of file
+            .order_by('-last_activity', '-id')
+        )
+
+    def list(self, request, *args, **kwargs):
+        if conversation_cache.is_enabled() and self.paginator.is_cacheable(
+            request, settings.MESSENGER_CONVERSATION_CACHE_SIZE,
+        ):
+            rows = self.get_cached_rows()
+            if rows is not None:
+                page = self.paginator.paginate_cached_rows(rows, request, view=self)
+                return self.paginator.get_paginated_response(
+                    [self.render_cached_row(row) for row in page]
+                )
+        return super().list(request, *args, **kwargs)
+
+    def get_cached_rows(self):
+        ''' First page from Redis, rebuilding the user's list from Postgres on a miss '''
+        user_id = self.request.user.id
+        limit = self.paginator.get_page_size(self.request) + 1
+        try:
+            rows = conversation_cache.get_first_page(user_id, limit)
+            if rows is None:
+                version = conversation_cache.get_version(user_id)
+                entries = list(
+                    self.get_queryset()[:settings.MESSENGER_CONVERSATION_CACHE_SIZE]
+                )
+                rows = conversation_cache.store_page(user_id, entries, version)[:limit]
+            return rows
+        except Exception as e:
+            conversation_cache.logger.warning(
+                "conversation_cache_error",
+                extra={
+                    "event": "conversation_cache_error",
+                    "operation": "get_cached_rows",
+                    "user_id": user_id,
+                    "error": str(e),
+                },
+            )
+            return None
+
+    def render_cached_row(self, row):
+        profile_image = get_profile_image_url(self.request, row['profile_image'])
+        return {
+            'user_id': row['user_id'],
+            'first_name': row['first_name'],
+            'profile_image': profile_image,
+            'last_message': row['last_message'],
+            'timestamp': row['timestamp'],
+            'unread_count': row['unread_count'],
+        }
+
+
+class UnreadCountView(generics.GenericAPIView):
+    ''' The user's unread messages across all conversations (the unread badge) '''
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(
+            {'total_unread': UnreadCounter.get_total(request.user.id)},
+            status=status.HTTP_200_OK,
+        )
+
+
+class SyncView(generics.GenericAPIView):
+    '''
+    Everything that changed for the user after a sync token: new incoming
+    and outgoing messages (by id) and inbox entries whose unread count or
+    read watermarks moved.  Without ``since`` only a fresh token is returned.
+
+    Ids and ``updated_at`` are assigned before commit, so a row can become
+    visible behind a cursor that already moved past it.  The token therefore
+    only advances over rows older than ``MESSENGER_SYNC_SETTLE_SECONDS``;
+    newer rows are returned again on the next call (clients upsert by id).
+    '''
+    serializer_class = SyncConversationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        # Two index range scans: message_receiver_id_idx / message_sender_id_idx
+        user_messages = Message.objects.filter(Q(sender=user) | Q(receiver=user))
+        horizon = timezone.now() - timedelta(
+            seconds=settings.MESSENGER_SYNC_SETTLE_SECONDS,
+        )
+        token = request.query_params.get('since')
+        if not token:
+            last_message_id = (
+                user_messages.filter(timestamp__lte=horizon)
+                .order_by('-id').values_list('id', flat=True).first() or 0
+            )
+            return Response({
+                'messages': [],
+                'conversations': [],
+                'token': encode_sync_token(last_message_id, horizon),
+                'has_more': False,
+            })
+
+        try:
+            last_message_id, updated_since, entry_id = decode_sync_token(token)
+        except ValueError:
+            raise ValidationError({'since': [_('Invalid sync token.')]})
+
+        limit = settings.MESSENGER_SYNC_MAX_ITEMS
+        messages = list(
+            user_messages.filter(id__gt=last_message_id).order_by('id')[:limit + 1]
+        )
+        # (updated_at, id) keyset: entries sharing a timestamp are not skipped
+        entries = list(
+            InboxEntry.objects
+            .filter(owner=user)
+            .filter(
+                Q(updated_at__gt=updated_since)
+                | Q(updated_at=updated_since, id__gt=entry_id)
+            )
+            .select_related('conversation')
+            .order_by('updated_at', 'id')[:limit + 1]
+        )
+        messages_more, entries_more = len(messages) > limit, len(entries) > limit
+        messages, entries = messages[:limit], entries[:limit]
+
+        apply_read_watermarks(messages)
+        last_message = self.get_settled_last(
+            messages, lambda message: message.timestamp <= horizon, messages_more,
+        )
+        if last_message is not None:
+            last_message_id = last_message.id
+        last_entry = self.get_settled_last(
+            entries, lambda entry: entry.updated_at <= horizon, entries_more,
+        )
+        if last_entry is not None:
+            updated_since, entry_id = last_entry.updated_at, last_entry.id
+
+        return Response({
+            'messages': MessageDetailSerializer(messages, many=True).data,
+            'conversations': self.get_serializer(entries, many=True).data,
+            'token': encode_sync_token(last_message_id, updated_since, entry_id),
+            'has_more': messages_more or entries_more,
+        })
+
+    @staticmethod
+    def get_settled_last(rows, is_settled, page_full):
+        '''
+        Last row the cursor may move past: the end of the leading run of
+        settled rows.  A full page with no settled rows still advances (to
+        its end) so paging cannot stall; that only happens when more than a
+        page of changes landed inside the settle window.
+        '''
+        last = None
+        for row in rows:
+            if not is_settled(row):
+                break
+            last = row
+        if last is None and page_full:
+            return rows[-1]
+        return last
+
+
+class MessageSearchView(generics.ListAPIView):
+    '''
+    Search the messages of every conversation the user takes part in, best
+    match first.  On Postgres, terms of ``MESSENGER_SEARCH_MIN_FTS_LENGTH``
+    characters or more use full-text search (``mode=fts``); shorter terms,
+    and queries full-text search finds nothing for, fall back to a
+    trigram-ranked substring match (``mode=substring``).  Messages moved to
+    the archive are not searched.
+    '''
+    serializer_class = MessageDetailSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = MessageSearchPagination
+    search_modes = ('fts', 'substring')
+
+    def get_queryset(self):
+        messages = Message.objects.for_user(self.request.user.id)
+        if self.search_mode == 'fts':
+            return messages.search(self.search_text)
+        return messages.search_substring(self.search_text)
+
+    def get_search_mode(self):
+        mode = self.request.query_params.get(self.paginator.mode_query_param)
+        if mode is not None and mode not in self.search_modes:
+            raise ValidationError({'mode': [_('Invalid search mode.')]})
+        if connection.vendor != 'postgresql':
+            return 'substring'
+        if mode is None:
+            too_short = len(self.search_text) < settings.MESSENGER_SEARCH_MIN_FTS_LENGTH
+            mode = 'substring' if too_short else 'fts'
+        return mode
+
+    def list(self, request, *args, **kwargs):
+        self.search_text = request.query_params.get('q', '').strip()
+        if not self.search_text:
+            raise ValidationError({'q': [_('This query parameter is required.')]})
+        self.search_mode = self.get_search_mode()
+        page = self.paginate_queryset(self.get_queryset())
+        # Nothing for the whole words: retry as a partial term
+        if (
+            not page and self.search_mode == 'fts' and self.paginator.cursor is None
+            and self.paginator.mode_query_param not in request.query_params
+        ):
+            self.search_mode = 'substring'
+            page = self.paginate_queryset(self.get_queryset())
+        apply_read_watermarks(page)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
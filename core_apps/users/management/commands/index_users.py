@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core_apps.users.utils import autocomplete
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Add every user to the Redis autocomplete index (run once when "
+        "enabling USER_AUTOCOMPLETE_ENABLED; registration keeps it current)"
+    )
+
+    def handle(self, *args, **options):
+        users = User.objects.only(
+            "id", "email", "first_name", "last_name", "profile_image",
+        ).order_by("id")
+        indexed = 0
+        for user in users.iterator(chunk_size=1_000):
+            autocomplete.index_user(user)
+            indexed += 1
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed:,} users"))
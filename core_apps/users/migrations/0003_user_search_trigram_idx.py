@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-18 00:58
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+from core_apps.messenger.utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0002_alter_lightmessagesuser_profile_image'),
+    ]
+
+    operations = [
+        # No-op outside Postgres, like the GIN indexes below
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='lightmessagesuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'), name='user_email_trigram_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lightmessagesuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='gin_trgm_ops'), name='user_first_name_trigram_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lightmessagesuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='gin_trgm_ops'), name='user_last_name_trigram_idx'),
+        ),
+    ]
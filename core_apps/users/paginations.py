@@ -1,7 +1,12 @@
-from rest_framework.pagination import PageNumberPagination
+from core_apps.messenger.paginations import KeysetCursorPagination
 
 
-class UserSearchPagination(PageNumberPagination):
+class UserSearchPagination(KeysetCursorPagination):
+    '''
+    Best match first.  Fetches page_size + 1 rows and pages with a
+    (rank, id) cursor, so a search never runs COUNT(*) over its matches
+    '''
     page_size = 5
     page_size_query_param = 'page_size'
-    max_page_size = 5
\ No newline at end of file
+    max_page_size = 5
+    ordering = ('-rank', '-id')
@@ -1,9 +1,12 @@
 from rest_framework.serializers import ModelSerializer, CharField, ValidationError, SerializerMethodField
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
 from .exceptions import DuplicatedEmailException
+from .utils import autocomplete
+from .utils.avatars import get_profile_image_url
 from .utils.images import validate_image_file
 
 User = get_user_model()
@@ -19,8 +22,8 @@ class UserSerializer(ModelSerializer):
     def get_profile_image(self, obj):
         ''' Build the absloute profile image URL '''
         request = self.context.get("request")
-        if request and obj.profile_image and hasattr(obj.profile_image, "url"):
-            return request.build_absolute_uri(obj.profile_image.url)
+        if request:
+            return get_profile_image_url(request, obj.profile_image)
         return None
 
 
@@ -71,6 +74,9 @@ class UserRegistrationSerializer(ModelSerializer):
         )
         user.set_password(validated_data["password"])
         user.save()
+        transaction.on_commit(
+            lambda: autocomplete.safe_call(autocomplete.index_user, user)
+        )
         return user
 
 
@@ -85,6 +91,6 @@ class UserSearchSerializer(ModelSerializer):
     def get_profile_image(self, obj):
         ''' Build the absloute profile image URL '''
         request = self.context.get("request")
-        if request and obj.profile_image and hasattr(obj.profile_image, "url"):
-            return request.build_absolute_uri(obj.profile_image.url)
+        if request:
+            return get_profile_image_url(request, obj.profile_image)
         return None
\ No newline at end of file
@@ -1,9 +1,14 @@
+import io
+
 import pytest
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from core_apps.messenger.models import Message
 
 User = get_user_model()
 
@@ -117,3 +122,97 @@ class TestUserAPIs:
         response = self.client.get(self.user_search_url)
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data["results"]) == 0
+
+    @pytest.mark.django_db
+    def test_user_search_excludes_existing_conversations(self, user, user_factory):
+        self.client.force_authenticate(user=user)
+        contacted = user_factory(email="findme-contacted@example.com")
+        replied = user_factory(email="findme-replied@example.com")
+        stranger = user_factory(email="findme-stranger@example.com", first_name="Zed")
+        named = user_factory(email="someone@example.com", first_name="Findme")
+        Message.objects.create(sender=user, receiver=contacted, message="hi")
+        Message.objects.create(sender=replied, receiver=user, message="hello")
+
+        response = self.client.get(f"{self.user_search_url}?query=FINDME")
+        assert response.status_code == status.HTTP_200_OK
+        assert {u["id"] for u in response.data["results"]} == {stranger.id, named.id}
+
+    @pytest.mark.django_db
+    def test_user_search_pagination(self, user, user_factory):
+        self.client.force_authenticate(user=user)
+        found = [
+            user_factory(email=f"paged{index}@example.com") for index in range(7)
+        ]
+
+        response = self.client.get(f"{self.user_search_url}?query=paged")
+        assert "count" not in response.data
+        ids = [u["id"] for u in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        ids += [u["id"] for u in response.data["results"]]
+        assert response.data["next"] is None
+        # Equally good matches: newest first
+        assert ids == [u.id for u in reversed(found)]
+
+    @pytest.mark.django_db
+    def test_user_autocomplete_from_index(
+        self, user, user_factory, settings, fake_redis,
+        django_capture_on_commit_callbacks, django_assert_num_queries,
+    ):
+        settings.USER_AUTOCOMPLETE_ENABLED = True
+        existing = user_factory(email="ann.lee@example.com", first_name="Ann")
+        call_command("index_users", stdout=io.StringIO())
+        with django_capture_on_commit_callbacks(execute=True):
+            response = self.client.post(self.registration_url, {
+                "email": "zoe@example.com", "password": "testpass123",
+                "first_name": "Annabel", "last_name": "Smith",
+            })
+        assert response.status_code == status.HTTP_201_CREATED
+        registered = User.objects.get(email="zoe@example.com")
+
+        self.client.force_authenticate(user=user)
+        url = f"{self.user_search_url}?prefix=%20ANN"
+        # Only the check for existing conversations hits the database
+        with django_assert_num_queries(1):
+            response = self.client.get(url)
+        assert [u["id"] for u in response.data["results"]] == [
+            existing.id, registered.id,
+        ]
+        assert response.data["results"][1] == {
+            "id": registered.id, "email": "zoe@example.com",
+            "first_name": "Annabel", "last_name": "Smith", "profile_image": None,
+        }
+        assert fake_redis.exists("user:ac:prefix:ann")
+
+        # A new match drops the cached prefix
+        with django_capture_on_commit_callbacks(execute=True):
+            self.client.post(self.registration_url, {
+                "email": "annie@example.com", "password": "testpass123",
+                "first_name": "Annie", "last_name": "Hall",
+            })
+        response = self.client.get(url)
+        assert len(response.data["results"]) == 3
+
+        # Users already in a conversation are left out, as with ``query``
+        Message.objects.create(sender=user, receiver=existing, message="Hi")
+        response = self.client.get(url)
+        assert existing.id not in [u["id"] for u in response.data["results"]]
+        assert len(response.data["results"]) == 2
+
+    @pytest.mark.django_db
+    def test_user_autocomplete_without_index(self, user, user_factory, settings):
+        settings.USER_AUTOCOMPLETE_ENABLED = False
+        match = user_factory(email="someone@example.com", last_name="Prefixson")
+        user_factory(email="other@example.com", last_name="Smith")
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(f"{self.user_search_url}?prefix=prefix")
+        assert [u["id"] for u in response.data["results"]] == [match.id]
+        response = self.client.get(f"{self.user_search_url}?prefix=%20")
+        assert response.data["results"] == []
+        # Too short for the trigram indexes
+        response = self.client.get(f"{self.user_search_url}?prefix=pr")
+        assert response.data["results"] == []
+
+        Message.objects.create(sender=match, receiver=user, message="Hi")
+        response = self.client.get(f"{self.user_search_url}?prefix=prefix")
+        assert response.data["results"] == []
@@ -1,6 +1,9 @@
+from unittest import mock
+
 import pytest
 from rest_framework.exceptions import ValidationError
 
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from core_apps.users.serializers import (
@@ -8,6 +11,7 @@ from core_apps.users.serializers import (
     UserRegistrationSerializer,
     UserSearchSerializer
 )
+from core_apps.users.utils import avatars
 
 
 @pytest.mark.django_db
@@ -160,3 +164,44 @@ class TestUserSearchSerializer:
         serializer.save()
         user.refresh_from_db()
         assert user.first_name != 'Changed'
+
+
+@pytest.mark.django_db
+class TestProfileImageURL:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        avatars.resolve.cache_clear()
+        yield
+        avatars.resolve.cache_clear()
+
+    @pytest.mark.parametrize('media_url', ['/media/', 'https://cdn.example.com/media/'])
+    def test_matches_build_absolute_uri(self, mock_request, settings, media_url):
+        settings.MEDIA_URL = media_url
+        request = mock_request()
+        path = 'profile_images/1_12:00 ü.png'
+
+        expected = request.build_absolute_uri(default_storage.url(path))
+        assert avatars.get_profile_image_url(request, path) == expected
+
+    def test_no_image(self, mock_request):
+        assert avatars.get_profile_image_url(mock_request(), '') is None
+
+    def test_resolved_once_per_path_and_host(self, mock_request, settings):
+        settings.ALLOWED_HOSTS = ['testserver', 'api.example.com']
+        path = 'profile_images/1.png'
+        with mock.patch.object(
+            default_storage, 'url', wraps=default_storage.url
+        ) as storage_url:
+            request = mock_request()
+            first = avatars.get_profile_image_url(request, path)
+            assert avatars.get_profile_image_url(request, path) == first
+            # A later request to the same host hits the process cache
+            assert avatars.get_profile_image_url(mock_request(), path) == first
+            assert storage_url.call_count == 1
+
+            other_host = mock_request()
+            other_host.META['HTTP_HOST'] = 'api.example.com'
+            assert avatars.get_profile_image_url(other_host, path) == (
+                'http://api.example.com/media/profile_images/1.png'
+            )
+            assert storage_url.call_count == 2
@@ -0,0 +1,143 @@
+"""
+Redis index for user autocomplete (``?prefix=`` on user search).
+
+One sorted set holds every user's normalized email, first name, last name
+and full name as ``<term>\\0<user id>`` members, all scored 0, so a
+prefix lookup is a single ``ZRANGEBYLEX`` range read.  A hash maps user
+ids to their search row (id, email, names, profile image path), so
+suggestions never touch Postgres.  The suggestions for each prefix are
+cached for ``USER_AUTOCOMPLETE_CACHE_TTL`` seconds; indexing a user drops
+the cached prefixes of their old and new terms.
+
+Registration indexes the new user and ``index_users`` fills the index
+for existing ones.  Every Redis error degrades to the Postgres lookup.
+"""
+import json
+import logging
+
+from django.conf import settings
+
+from light_messages.redis_client import get_redis_client
+
+logger = logging.getLogger("light_messages.user_autocomplete")
+
+INDEX_KEY = "user:ac:index"
+ROWS_KEY = "user:ac:rows"
+ROW_FIELDS = ("id", "email", "first_name", "last_name", "profile_image")
+
+# Separates a term from the user id in an index member; sorts below every
+# character a term can contain
+_SEPARATOR = "\x00"
+# Closes a prefix range: sorts above any UTF-8 encoded character
+_MAX_CHAR = "\U0010ffff"
+# Index members read per suggestion; one user can match through each term
+_MEMBERS_PER_USER = 4
+
+
+def is_enabled() -> bool:
+    return settings.USER_AUTOCOMPLETE_ENABLED
+
+
+def _client():
+    return get_redis_client(settings.USER_AUTOCOMPLETE_URL)
+
+
+def _prefix_key(prefix):
+    return f"user:ac:prefix:{prefix}"
+
+
+def _member(term, user_id):
+    return f"{term}{_SEPARATOR}{user_id}"
+
+
+def normalize(text):
+    """Case-folded, with surrounding and repeated whitespace collapsed."""
+    return " ".join(text.replace(_SEPARATOR, "").split()).casefold()
+
+
+def get_terms(row):
+    """The normalized terms a search row is found by."""
+    full_name = f"{row['first_name']} {row['last_name']}"
+    terms = {
+        normalize(value)
+        for value in (row["email"], row["first_name"], row["last_name"], full_name)
+    }
+    terms.discard("")
+    return terms
+
+
+def index_user(user):
+    """Add or refresh a user's terms and row."""
+    image = user.profile_image
+    row = {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "profile_image": image.name if image else "",
+    }
+    terms = get_terms(row)
+    client = _client()
+    previous = client.hget(ROWS_KEY, user.id)
+    stale_terms = get_terms(json.loads(previous)) - terms if previous else set()
+    prefixes = {
+        term[:length]
+        for term in terms | stale_terms
+        for length in range(1, len(term) + 1)
+    }
+
+    pipe = client.pipeline(transaction=True)
+    if stale_terms:
+        pipe.zrem(INDEX_KEY, *[_member(term, user.id) for term in stale_terms])
+    pipe.zadd(INDEX_KEY, {_member(term, user.id): 0 for term in terms})
+    pipe.hset(ROWS_KEY, user.id, json.dumps(row))
+    pipe.delete(*[_prefix_key(prefix) for prefix in prefixes])
+    pipe.execute()
+
+
+def lookup(prefix):
+    """
+    Search rows (dicts of ``ROW_FIELDS``) of up to
+    ``USER_AUTOCOMPLETE_LIMIT`` + 1 users with a term starting with
+    ``prefix``, in term order.  One more than the limit, so the caller can
+    drop the requesting user and still fill the list.
+    """
+    prefix = normalize(prefix)
+    client = _client()
+    cached = client.get(_prefix_key(prefix))
+    if cached is not None:
+        return json.loads(cached)
+
+    limit = settings.USER_AUTOCOMPLETE_LIMIT + 1
+    members = client.zrangebylex(
+        INDEX_KEY, f"[{prefix}", f"[{prefix}{_MAX_CHAR}",
+        start=0, num=limit * _MEMBERS_PER_USER,
+    )
+    user_ids = list(dict.fromkeys(
+        member.rsplit(_SEPARATOR, 1)[1] for member in members
+    ))[:limit]
+    rows = []
+    if user_ids:
+        rows = [json.loads(row) for row in client.hmget(ROWS_KEY, user_ids) if row]
+    client.set(
+        _prefix_key(prefix), json.dumps(rows),
+        ex=settings.USER_AUTOCOMPLETE_CACHE_TTL,
+    )
+    return rows
+
+
+def safe_call(func, *args, **kwargs):
+    """Run an index write, logging (never raising) on Redis errors."""
+    if not is_enabled():
+        return
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        logger.warning(
+            "user_autocomplete_error",
+            extra={
+                "event": "user_autocomplete_error",
+                "operation": func.__name__,
+                "error": str(e),
+            },
+        )
@@ -0,0 +1,54 @@
+"""
+Absolute profile image URLs for API responses.
+
+``storage.url()`` is a local string join for ``FileSystemStorage`` but
+goes through boto3 for S3, and the list endpoints used to call it (plus
+``build_absolute_uri``) for every row.  URLs are resolved through a
+per-process LRU cache keyed by ``(storage path, scheme and host)`` and,
+in front of it, a plain dict kept on the request, so an avatar repeated on
+a page costs one lookup.
+
+Profile image URLs must be stable for the cache to be valid: they are
+unsigned (``AWS_QUERYSTRING_AUTH = False``) and image paths are never
+reused (``AWS_S3_FILE_OVERWRITE = False``, timestamped file names).
+"""
+from functools import lru_cache
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.encoding import iri_to_uri
+
+# Attribute holding the per-request memo on the HttpRequest
+_REQUEST_ATTR = "_profile_image_urls"
+
+
+@lru_cache(maxsize=settings.PROFILE_IMAGE_URL_CACHE_SIZE)
+def resolve(path, base):
+    """
+    Absolute URL of the stored image ``path`` as seen from ``base``
+    (``scheme://host``); same result as
+    ``request.build_absolute_uri(default_storage.url(path))``.
+    """
+    return iri_to_uri(urljoin(f"{base}/", default_storage.url(path)))
+
+
+def get_profile_image_url(request, image):
+    """
+    Absolute URL of ``image`` (an ``ImageFieldFile`` or a storage path),
+    or None when the user has no profile image.
+    """
+    path = getattr(image, "name", image)
+    if not path:
+        return None
+    # Share one memo between the DRF Request and the HttpRequest it wraps
+    request = getattr(request, "_request", request)
+    urls = getattr(request, _REQUEST_ATTR, None)
+    if urls is None:
+        urls = {}
+        setattr(request, _REQUEST_ATTR, urls)
+    url = urls.get(path)
+    if url is None:
+        base = f"{request.scheme}://{request.get_host()}"
+        url = urls[path] = resolve(path, base)
+    return url
@@ -7,15 +7,22 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.functions import Cast, Greatest
 
+from core_apps.messenger.models import InboxEntry, SEARCH_RANK_FIELD
 from .serializers import (
     UserRegistrationSerializer, 
     UserSerializer,
     UserSearchSerializer,
 )
 from .paginations import UserSearchPagination
+from .utils import autocomplete
+from .utils.avatars import get_profile_image_url
 
 
 User = get_user_model()
@@ -44,26 +51,119 @@ class UserRetrieveView(RetrieveAPIView):
     
 
 class UserSearchView(ListAPIView):
-    ''' Search for users through their email '''
+    ''' Search for users through their email or name '''
     permission_classes = [IsAuthenticated]
     serializer_class = UserSearchSerializer
     pagination_class = UserSearchPagination
 
     def get_queryset(self):
         query = self.request.GET.get('query')
-        # At least 3 characters are required to search
+        # At least 3 characters are required to search (one trigram)
         if not query or len(query) < 3:
-            return User.objects.none()
-        # Eliminate the users that are already in conversation with the current user
-        return User.objects.exclude(
-            Q(sent_messages__receiver=self.request.user) | 
-            Q(received_messages__sender=self.request.user)
-        ).filter(
-            Q(email__icontains=query)
-        ).exclude(id=self.request.user.id)
-        
-    
+            # Still ranked: the paginator orders by it
+            return User.objects.none().annotate(rank=Value(0))
+        # Users already in conversation with the current user: a range scan
+        # of their own inbox instead of a join through every message
+        peers = self.get_peers()
+        # Each condition is served by its trigram index on Postgres.  The
+        # rank ordering also keeps the planner on those indexes: ordered by
+        # id alone it walks the primary key when it misjudges a rare term.
+        return User.objects.filter(
+            Q(email__icontains=query) |
+            Q(first_name__icontains=query) |
+            Q(last_name__icontains=query)
+        ).exclude(id__in=peers).exclude(id=self.request.user.id).annotate(
+            rank=self.get_rank(query),
+        )
+
+    @staticmethod
+    def get_rank(query):
+        ''' Best trigram word similarity of the query to the email or a name '''
+        if connection.vendor != 'postgresql':
+            return Cast(Value(0), SEARCH_RANK_FIELD)
+        return Cast(
+            Greatest(*[
+                TrigramWordSimilarity(query, field)
+                for field in ('email', 'first_name', 'last_name')
+            ]),
+            SEARCH_RANK_FIELD,
+        )
+
     def list(self, request, *args, **kwargs):
+        prefix = request.GET.get('prefix')
+        if prefix is not None:
+            return Response({'results': self.autocomplete(prefix)})
         queryset = self.paginate_queryset(self.get_queryset())
         serializer = self.get_serializer(queryset, many=True)
-        return self.get_paginated_response(serializer.data)
\ No newline at end of file
+        return self.get_paginated_response(serializer.data)
+
+    def autocomplete(self, prefix):
+        '''
+        Up to USER_AUTOCOMPLETE_LIMIT users with an email or name starting
+        with ``prefix``: from the Redis index, or from Postgres when it is
+        disabled or unavailable.  Like ``query``, leaves out the current
+        user and users already in a conversation with them, so a page can
+        come back short when the index matches them.
+        '''
+        if not autocomplete.normalize(prefix):
+            return []
+        rows = None
+        if autocomplete.is_enabled():
+            try:
+                rows = autocomplete.lookup(prefix)
+            except Exception as e:
+                autocomplete.logger.warning(
+                    "user_autocomplete_error",
+                    extra={
+                        "event": "user_autocomplete_error",
+                        "operation": "lookup",
+                        "error": str(e),
+                    },
+                )
+        if rows is None:
+            rows = self.get_autocomplete_rows(prefix.strip())
+        else:
+            rows = self.exclude_peers(rows)
+        return [
+            self.render_row(row)
+            for row in rows[:settings.USER_AUTOCOMPLETE_LIMIT]
+        ]
+
+    def get_peers(self):
+        ''' Ids of the users already in conversation with the current user '''
+        return InboxEntry.objects.filter(owner=self.request.user).values('peer_id')
+
+    def exclude_peers(self, rows):
+        ''' Drop the current user and their peers from index rows '''
+        user_id = self.request.user.id
+        peer_ids = set(
+            self.get_peers()
+            .filter(peer_id__in=[row['id'] for row in rows])
+            .values_list('peer_id', flat=True)
+        )
+        return [
+            row for row in rows
+            if row['id'] != user_id and row['id'] not in peer_ids
+        ]
+
+    def get_autocomplete_rows(self, prefix):
+        # The trigram indexes only serve LIKE patterns of at least 3
+        # characters; shorter prefixes would scan the users table on every
+        # keystroke
+        if len(prefix) < settings.USER_AUTOCOMPLETE_DB_MIN_PREFIX:
+            return []
+        return list(
+            User.objects.filter(
+                Q(email__istartswith=prefix) |
+                Q(first_name__istartswith=prefix) |
+                Q(last_name__istartswith=prefix)
+            )
+            .exclude(id__in=self.get_peers())
+            .exclude(id=self.request.user.id)
+            .order_by('email')
+            .values(*autocomplete.ROW_FIELDS)[:settings.USER_AUTOCOMPLETE_LIMIT]
+        )
+
+    def render_row(self, row):
+        profile_image = get_profile_image_url(self.request, row['profile_image'])
+        return {**row, 'profile_image': profile_image}
@@ -0,0 +1,30 @@
+"""
+orjson-backed JSON encoding shared by the REST API
+(``light_messages.renderers`` / ``light_messages.parsers``), the WebSocket
+consumer and the structured log formatter.
+
+orjson handles the common types natively.  Everything else, and
+datetimes (so their format matches what DRF emits), goes to a
+``default`` hook, which by default is DRF's own ``JSONEncoder``: lazy
+translation strings, Decimals, dates, times, timedeltas and so on come
+out exactly as they did with the stdlib encoder.
+"""
+import orjson
+from rest_framework.utils.encoders import JSONEncoder
+
+_drf_encoder = JSONEncoder()
+
+
+def dumps(obj, default=None, indent=False) -> bytes:
+    """
+    Serialize ``obj`` to compact UTF-8 JSON.  ``default`` converts the
+    values orjson does not encode itself (DRF's encoder if omitted).
+    """
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=default or _drf_encoder.default, option=option)
+
+
+def loads(data):
+    return orjson.loads(data)
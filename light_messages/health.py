@@ -3,17 +3,61 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 
+from django.conf import settings
+from django.db import DatabaseError
+
+from core_apps.messenger.utils import dispatch, outbox
+from core_apps.messenger.utils.breaker import CLOSED, get_breaker
+
 import os
 
+
+def get_event_health():
+    """
+    How WebSocket events leave the service.  With the in-process queue
+    this process publishes them: report its channel layer circuit breaker
+    and queue.  With the outbox the relays publish them: report the backlog
+    they leave and the breakers from their heartbeats.  Degraded once the
+    oldest event is older than ``OUTBOX_RELAY_LAG_THRESHOLD`` seconds, or
+    when no relay is running or one's breaker is not closed.
+    """
+    if dispatch.uses_outbox():
+        try:
+            backlog = outbox.get_stats()
+        except DatabaseError:
+            backlog = None
+        try:
+            relays = outbox.get_heartbeats()
+        except Exception:
+            relays = None
+        healthy = (
+            backlog is not None
+            and backlog["lag_seconds"] <= settings.OUTBOX_RELAY_LAG_THRESHOLD
+            and bool(relays)
+            and all(relay["state"] == CLOSED for relay in relays.values())
+        )
+        return {"dispatch": "outbox", "outbox": backlog, "relays": relays}, healthy
+    breaker = get_breaker().get_stats()
+    return {
+        "dispatch": "queue",
+        "circuit_breaker": breaker,
+        "queue": dispatch.get_dispatcher().get_stats(),
+    }, breaker["state"] == CLOSED
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def health_check(request):
     """
-    A simple health check endpoint that returns 200 OK
+    A simple health check endpoint that returns 200 OK.  ``status`` is
+    "degraded" while WebSocket events cannot be published; the API keeps
+    serving requests, so the response stays 200.
     """
+    events, healthy = get_event_health()
     return Response({
-            "status": "healthy",
+            "status": "healthy" if healthy else "degraded",
             "pod_name": os.getenv("POD_NAME", "N/A"),
+            "events": events,
         },
         status=status.HTTP_200_OK
-    )
\ No newline at end of file
+    )
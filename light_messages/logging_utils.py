@@ -1,7 +1,8 @@
-import json
 import logging
 from datetime import datetime, timezone
 
+from light_messages import fast_json
+
 
 class JsonFormatter(logging.Formatter):
     """Minimal JSON formatter for structured application logs."""
@@ -40,13 +41,10 @@ class JsonFormatter(logging.Formatter):
 
         for key, value in record.__dict__.items():
             if key not in standard_keys and not key.startswith("_"):
-                try:
-                    json.dumps(value)
-                    log_entry[key] = value
-                except TypeError:
-                    log_entry[key] = str(value)
+                log_entry[key] = value
 
         if record.exc_info:
             log_entry["exception"] = self.formatException(record.exc_info)
 
-        return json.dumps(log_entry, ensure_ascii=False)
+        # Values JSON cannot represent are logged as their str()
+        return fast_json.dumps(log_entry, default=str).decode()
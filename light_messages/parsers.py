@@ -0,0 +1,15 @@
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from light_messages import fast_json
+
+
+class ORJSONParser(JSONParser):
+    """``JSONParser`` with orjson (UTF-8 request bodies)."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return fast_json.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
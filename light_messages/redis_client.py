@@ -0,0 +1,9 @@
+from functools import lru_cache
+
+import redis
+
+
+@lru_cache(maxsize=None)
+def get_redis_client(url: str) -> redis.Redis:
+    """Return a process-wide Redis client (connection pool) for ``url``."""
+    return redis.Redis.from_url(url, decode_responses=True)
@@ -0,0 +1,23 @@
+from rest_framework.renderers import JSONRenderer
+
+from light_messages import fast_json
+
+# DRF escapes these for JavaScript; orjson leaves them as UTF-8
+_LINE_SEPARATORS = (
+    ("\u2028".encode(), b"\\u2028"),
+    ("\u2029".encode(), b"\\u2029"),
+)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` with orjson; same media type and output."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        ret = fast_json.dumps(data, indent=bool(indent))
+        for separator, escaped in _LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
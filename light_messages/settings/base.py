@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "drf_yasg",
     "corsheaders",
     "channels",
@@ -96,6 +97,111 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Messenger
+# Mark messages as read on every GET of the message list.  Disable to make
+# the list a pure read and use POST .../messages/read/ instead.
+MESSENGER_MARK_READ_ON_LIST = env.bool("MESSENGER_MARK_READ_ON_LIST", default=True)
+# Optional Redis cache for the first page(s) of the conversation list
+MESSENGER_CONVERSATION_CACHE_ENABLED = env.bool(
+    "MESSENGER_CONVERSATION_CACHE_ENABLED", default=False
+)
+MESSENGER_CONVERSATION_CACHE_URL = env.str(
+    "MESSENGER_CONVERSATION_CACHE_URL",
+    default=f"redis://{env.str('REDIS_HOST')}:{env.int('REDIS_PORT')}/1",
+)
+# Conversations kept per user, and seconds before an idle list expires
+MESSENGER_CONVERSATION_CACHE_SIZE = env.int("MESSENGER_CONVERSATION_CACHE_SIZE", default=51)
+MESSENGER_CONVERSATION_CACHE_TTL = env.int("MESSENGER_CONVERSATION_CACHE_TTL", default=3600)
+# Max messages / conversations returned by one /api/v1/sync/ call
+MESSENGER_SYNC_MAX_ITEMS = env.int("MESSENGER_SYNC_MAX_ITEMS", default=500)
+# Sync tokens only move past rows older than this; must exceed the longest
+# send / read transaction
+MESSENGER_SYNC_SETTLE_SECONDS = env.int("MESSENGER_SYNC_SETTLE_SECONDS", default=30)
+# Monthly messenger_message partitions kept ready beyond the current month
+# (Postgres); ``message_partitions`` tops them up and must run before they
+# run out
+MESSENGER_MESSAGE_PARTITIONS_AHEAD = env.int("MESSENGER_MESSAGE_PARTITIONS_AHEAD", default=3)
+# ``archive_messages`` moves messages older than this many days into
+# compressed MessageArchive rows of up to MESSENGER_ARCHIVE_BATCH_SIZE messages
+MESSENGER_ARCHIVE_AFTER_DAYS = env.int("MESSENGER_ARCHIVE_AFTER_DAYS", default=365)
+MESSENGER_ARCHIVE_BATCH_SIZE = env.int("MESSENGER_ARCHIVE_BATCH_SIZE", default=500)
+# Message search terms shorter than this skip full-text search and go
+# straight to the trigram substring match
+MESSENGER_SEARCH_MIN_FTS_LENGTH = env.int("MESSENGER_SEARCH_MIN_FTS_LENGTH", default=3)
+# Read messages by the packed integer conversation_key instead of the
+# "min_max" string; turn on once `backfill_messages` has completed
+MESSENGER_READ_CONVERSATION_KEY = env.bool("MESSENGER_READ_CONVERSATION_KEY", default=False)
+# Dotted path to a zero-argument callable returning new Message ids, e.g.
+# "core_apps.messenger.utils.snowflake.next_id"; empty = database sequence
+MESSENGER_MESSAGE_ID_GENERATOR = env.str("MESSENGER_MESSAGE_ID_GENERATOR", default="")
+# Once on, keep it on: sequence ids would sort below the snowflake ids.
+# Each process leases its snowflake worker id from this Redis, renewed
+# while in use and released after TTL seconds idle.
+MESSENGER_ID_LEASE_URL = env.str(
+    "MESSENGER_ID_LEASE_URL",
+    default=f"redis://{env.str('REDIS_HOST')}:{env.int('REDIS_PORT')}/1",
+)
+MESSENGER_ID_LEASE_TTL = env.int("MESSENGER_ID_LEASE_TTL", default=60)
+
+# Users
+# Redis index behind ``GET /api/v1/users/search/?prefix=``; without it the
+# autocomplete runs on Postgres.  Fill it once with ``index_users``.
+USER_AUTOCOMPLETE_ENABLED = env.bool("USER_AUTOCOMPLETE_ENABLED", default=False)
+USER_AUTOCOMPLETE_URL = env.str(
+    "USER_AUTOCOMPLETE_URL",
+    default=f"redis://{env.str('REDIS_HOST')}:{env.int('REDIS_PORT')}/1",
+)
+# Suggestions per prefix, and seconds a prefix's suggestions stay cached
+USER_AUTOCOMPLETE_LIMIT = env.int("USER_AUTOCOMPLETE_LIMIT", default=10)
+USER_AUTOCOMPLETE_CACHE_TTL = env.int("USER_AUTOCOMPLETE_CACHE_TTL", default=30)
+# Shortest prefix the Postgres fallback serves (the trigram indexes need 3)
+USER_AUTOCOMPLETE_DB_MIN_PREFIX = env.int("USER_AUTOCOMPLETE_DB_MIN_PREFIX", default=3)
+# Absolute profile image URLs kept per process, keyed by (image path, host)
+PROFILE_IMAGE_URL_CACHE_SIZE = env.int("PROFILE_IMAGE_URL_CACHE_SIZE", default=4096)
+
+# ``relay_events`` publishes up to this many outbox events per batch, polls
+# every OUTBOX_RELAY_POLL_INTERVAL seconds once the outbox is drained and
+# logs its lag every OUTBOX_RELAY_STATS_INTERVAL seconds
+OUTBOX_RELAY_BATCH_SIZE = env.int("OUTBOX_RELAY_BATCH_SIZE", default=200)
+OUTBOX_RELAY_POLL_INTERVAL = env.float("OUTBOX_RELAY_POLL_INTERVAL", default=0.1)
+OUTBOX_RELAY_STATS_INTERVAL = env.float("OUTBOX_RELAY_STATS_INTERVAL", default=30.0)
+# Each relay stores its circuit breaker state in this Redis; the health check
+# reports relays heard from in the last OUTBOX_RELAY_HEARTBEAT_TTL seconds
+OUTBOX_RELAY_HEARTBEAT_URL = env.str(
+    "OUTBOX_RELAY_HEARTBEAT_URL",
+    default=f"redis://{env.str('REDIS_HOST')}:{env.int('REDIS_PORT')}/1",
+)
+OUTBOX_RELAY_HEARTBEAT_TTL = env.int("OUTBOX_RELAY_HEARTBEAT_TTL", default=30)
+# The health check is "degraded" once the oldest outbox event is older than
+# this many seconds, and counts pending events up to OUTBOX_STATS_PENDING_CAP
+OUTBOX_RELAY_LAG_THRESHOLD = env.float("OUTBOX_RELAY_LAG_THRESHOLD", default=30.0)
+OUTBOX_STATS_PENDING_CAP = env.int("OUTBOX_STATS_PENDING_CAP", default=10000)
+# How WebSocket events leave the process: "outbox" (the table above, lossless)
+# or "queue" (a bounded in-process queue drained by a background thread, no
+# relay needed; events are lost on overflow or when the process dies)
+EVENT_DISPATCH = env.str("EVENT_DISPATCH", default="outbox")
+# Events the queue holds, and events published per batch by its thread
+EVENT_DISPATCH_QUEUE_SIZE = env.int("EVENT_DISPATCH_QUEUE_SIZE", default=10000)
+EVENT_DISPATCH_BATCH_SIZE = env.int("EVENT_DISPATCH_BATCH_SIZE", default=100)
+# What a full queue does with a new event: "drop_newest", "drop_oldest", or
+# "block" for up to EVENT_DISPATCH_BLOCK_TIMEOUT seconds and then drop it
+EVENT_DISPATCH_OVERFLOW = env.str("EVENT_DISPATCH_OVERFLOW", default="drop_oldest")
+EVENT_DISPATCH_BLOCK_TIMEOUT = env.float("EVENT_DISPATCH_BLOCK_TIMEOUT", default=0.05)
+# Seconds between the queue's ``event_dispatch_stats`` log lines
+EVENT_DISPATCH_STATS_INTERVAL = env.float(
+    "EVENT_DISPATCH_STATS_INTERVAL", default=30.0
+)
+# Seconds before a channel layer group_send counts as failed
+CHANNEL_LAYER_PUBLISH_TIMEOUT = env.float("CHANNEL_LAYER_PUBLISH_TIMEOUT", default=2.0)
+# The channel layer circuit breaker opens after this many consecutive failed
+# publishes, counting those slower than CHANNEL_LAYER_BREAKER_LATENCY seconds,
+# and probes again after CHANNEL_LAYER_BREAKER_RESET_TIMEOUT seconds
+CHANNEL_LAYER_BREAKER_FAILURES = env.int("CHANNEL_LAYER_BREAKER_FAILURES", default=5)
+CHANNEL_LAYER_BREAKER_LATENCY = env.float("CHANNEL_LAYER_BREAKER_LATENCY", default=0.5)
+CHANNEL_LAYER_BREAKER_RESET_TIMEOUT = env.float(
+    "CHANNEL_LAYER_BREAKER_RESET_TIMEOUT", default=10.0
+)
+
 # Timeouts
 MESSAGE_CONSUMER_PING_INTERVAL = env.int("MESSAGE_CONSUMER_PING_INTERVAL", default=40)
 MESSAGE_CONSUMER_PONG_TIMEOUT = env.int("MESSAGE_CONSUMER_PONG_TIMEOUT", default=10)
@@ -120,6 +226,15 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "light_messages.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "light_messages.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 25,  # Default page size
 }
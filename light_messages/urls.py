@@ -29,6 +29,7 @@ from django.urls import path, include
 from django.conf import settings
 
 from .health import health_check
+from core_apps.messenger.views import SyncView
 
 
 schema_view = get_schema_view(
@@ -55,6 +56,8 @@ urlpatterns = [
     path("api/v1/users/", include("core_apps.users.urls")),
     # Conversations URLs
     path("api/v1/conversations/", include("core_apps.messenger.urls")),
+    # Delta sync for reconnecting clients
+    path("api/v1/sync/", SyncView.as_view(), name="sync-view"),
     # Swagger | docs URLs
     path("api/v1/docs/", schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     # Health Check URL